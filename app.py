@@ -122,8 +122,8 @@ def init_session_state():
         st.session_state.selected_input_path = None
     if 'selected_output_path' not in st.session_state:
         # 使用TMP目录下的base_output文件夹作为默认输出路径
-        from src.file_upload_manager import FileUploadManager
-        file_manager = FileUploadManager()
+        from src.file_upload_manager import get_file_upload_manager
+        file_manager = get_file_upload_manager()
         base_output_path = os.path.join(file_manager.get_tmp_dir_path(), "base_output")
         st.session_state.selected_output_path = base_output_path
     if 'preview_file_path' not in st.session_state:
@@ -141,8 +141,8 @@ def select_folder():
         root.attributes('-topmost', True)  # 置顶显示
         
         # 默认打开TMP目录
-        from src.file_upload_manager import file_upload_manager
-        initial_dir = file_upload_manager.get_tmp_dir_path()
+        from src.file_upload_manager import get_file_upload_manager
+        initial_dir = get_file_upload_manager().get_tmp_dir_path()
         
         selected_path = filedialog.askdirectory(
             title="选择数据集文件夹",
@@ -163,8 +163,8 @@ def select_file():
         root.attributes('-topmost', True)  # 置顶显示
         
         # 默认打开TMP目录
-        from src.file_upload_manager import file_upload_manager
-        initial_dir = file_upload_manager.get_tmp_dir_path()
+        from src.file_upload_manager import get_file_upload_manager
+        initial_dir = get_file_upload_manager().get_tmp_dir_path()
         
         selected_path = filedialog.askopenfilename(
             title="选择数据集文件",
@@ -186,8 +186,8 @@ def select_output_folder():
         root.attributes('-topmost', True)  # 置顶显示
         
         # 默认打开TMP目录
-        from src.file_upload_manager import file_upload_manager
-        initial_dir = file_upload_manager.get_tmp_dir_path()
+        from src.file_upload_manager import get_file_upload_manager
+        initial_dir = get_file_upload_manager().get_tmp_dir_path()
         
         selected_path = filedialog.askdirectory(
             title="选择输出文件夹",
@@ -1127,7 +1127,8 @@ def show_dataset_generation():
                         model_type=model_type,
                         model_name=model_name,
                         api_key=api_key,
-                        base_url=base_url
+                        base_url=base_url,
+                        validate=True
                     )
                     
                     # 获取当前提示词配置
@@ -1542,8 +1543,8 @@ def show_file_management():
     st.header("📁 文件管理")
     
     # 初始化文件管理器
-    from src.file_upload_manager import FileUploadManager
-    file_manager = FileUploadManager()
+    from src.file_upload_manager import get_file_upload_manager
+    file_manager = get_file_upload_manager()
     
     # 初始化当前路径状态
     if 'current_folder' not in st.session_state:
@@ -1764,7 +1765,8 @@ def show_file_management():
     st.markdown("---")
     
     # 获取当前目录的内容
-    current_files = file_manager.list_files_in_folder(st.session_state.current_folder)
+    current_file_infos = file_manager.list_files_with_info(st.session_state.current_folder)
+    current_files = [file_path for file_path, _ in current_file_infos]
     
     # 如果在根目录，显示文件夹
     if st.session_state.current_folder is None:
@@ -1914,9 +1916,8 @@ def show_file_management():
         
         # 使用网格布局显示文件
         file_cols = st.columns(4)  # 每行4个文件
-        for idx, file_path in enumerate(current_files):
+        for idx, (file_path, file_info) in enumerate(current_file_infos):
             with file_cols[idx % 4]:
-                file_info = file_manager.get_file_info(file_path)
                 file_name = os.path.basename(file_path)
                 
                 # 文件卡片
@@ -33,6 +33,7 @@ OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
 SAMPLE_MIN = 3  # 最少示例数量
 SAMPLE_MAX = 6  # 最多示例数量
 GENERATION_NUM = 50  # 默认生成的数据条目数量
+CHECKPOINT_FSYNC = True  # 写入断点续传检查点时是否同步到磁盘（关闭后更快，但系统崩溃时可能丢失最近的进度）
 
 # 提示词模板
 INSTRUCTION_PROMPT = """
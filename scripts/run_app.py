@@ -8,17 +8,37 @@
 import subprocess
 import sys
 import os
+import shutil
 import signal
+import sysconfig
 import time
 import atexit
+import importlib.util
 from pathlib import Path
 
+# 尝试导入psutil，如果不可用则回退到PowerShell清理
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 项目根目录（当前脚本所在目录的上级目录）及应用入口文件
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+APP_FILE = str(PROJECT_ROOT / "app.py")
+
 # 全局变量用于存储子进程
 streamlit_process = None
 
+# 清理是否已执行（信号处理和atexit都会触发清理，只需执行一次）
+_cleanup_done = False
+
 def cleanup_processes():
     """清理所有相关进程"""
-    global streamlit_process
+    global streamlit_process, _cleanup_done
+    
+    if _cleanup_done:
+        return
+    _cleanup_done = True
     
     if streamlit_process:
         try:
@@ -43,10 +63,18 @@ def cleanup_processes():
         try:
             print("🧹 清理残留进程...")
             # 终止端口8501上的进程
-            subprocess.run([
-                "powershell", "-Command", 
-                "Get-NetTCPConnection -LocalPort 8501 -ErrorAction SilentlyContinue | ForEach-Object { Stop-Process -Id $_.OwningProcess -Force -ErrorAction SilentlyContinue }"
-            ], capture_output=True)
+            if psutil is not None:
+                for conn in psutil.net_connections(kind='tcp'):
+                    if conn.laddr and conn.laddr.port == 8501 and conn.pid:
+                        try:
+                            psutil.Process(conn.pid).kill()
+                        except psutil.Error:
+                            pass
+            else:
+                subprocess.run([
+                    "powershell", "-Command", 
+                    "Get-NetTCPConnection -LocalPort 8501 -ErrorAction SilentlyContinue | ForEach-Object { Stop-Process -Id $_.OwningProcess -Force -ErrorAction SilentlyContinue }"
+                ], capture_output=True)
             
             # 终止包含streamlit的python进程
             subprocess.run([
@@ -77,23 +105,17 @@ def main():
     # 注册退出时的清理函数
     atexit.register(cleanup_processes)
     
-    # 获取当前脚本所在目录的上级目录（项目根目录）
-    current_dir = Path(__file__).parent.parent
-    app_file = current_dir / "app.py"
-    
     # 检查app.py是否存在
-    if not app_file.exists():
+    if not os.path.isfile(APP_FILE):
         print("❌ 错误: 找不到app.py文件")
         return
     
-    # 检查是否安装了streamlit
-    try:
-        import streamlit
-        print("✅ Streamlit已安装")
-    except ImportError:
+    # 检查是否安装了streamlit（只查找模块，不实际导入）
+    if importlib.util.find_spec("streamlit") is None:
         print("❌ 错误: 未安装Streamlit")
         print("请运行: pip install -r requirements.txt")
         return
+    print("✅ Streamlit已安装")
     
     print("🚀 正在启动数据集生成器可视化界面...")
     print("📱 界面将在浏览器中自动打开")
@@ -107,9 +129,15 @@ def main():
     
     # 启动Streamlit应用
     try:
-        streamlit_process = subprocess.Popen([
-            sys.executable, "-m", "streamlit", "run", 
-            str(app_file),
+        # 优先使用当前环境中的streamlit命令行入口，找不到时回退到 python -m streamlit
+        streamlit_bin = shutil.which("streamlit", path=sysconfig.get_path("scripts"))
+        streamlit_cmd = [streamlit_bin] if streamlit_bin else [sys.executable, "-m", "streamlit"]
+        
+        # 非Windows系统关闭close_fds，让subprocess走os.posix_spawn快速路径
+        # （Python默认创建的文件描述符不可继承，无需逐个关闭）
+        streamlit_process = subprocess.Popen(streamlit_cmd + [
+            "run", 
+            APP_FILE,
             "--server.address", "localhost",
             "--server.port", "8501",
             "--browser.gatherUsageStats", "false",
@@ -117,7 +145,7 @@ def main():
             "--global.developmentMode", "false",
             "--server.enableCORS", "false",
             "--server.enableXsrfProtection", "false"
-        ])
+        ], close_fds=(sys.platform == "win32"))
         
         # 等待进程结束
         streamlit_process.wait()
@@ -8,20 +8,30 @@
 import subprocess
 import sys
 import os
-import psutil
+import signal
 import time
 
 def find_streamlit_processes():
     """查找所有Streamlit相关进程"""
+    # 延迟导入psutil，未安装时跳过进程扫描，仍可通过端口清理
+    try:
+        import psutil
+    except ImportError:
+        print("⚠️ 未安装psutil，跳过进程扫描")
+        return []
+    
     streamlit_processes = []
+    current_pid = os.getpid()
     
     try:
         for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
             try:
                 cmdline = proc.info['cmdline']
-                if cmdline and any('streamlit' in str(cmd).lower() for cmd in cmdline):
-                    streamlit_processes.append(proc)
-                elif cmdline and any('app.py' in str(cmd) for cmd in cmdline):
+                # 跳过当前脚本自身（stop_app.py 同样包含 app.py）
+                if not cmdline or proc.info['pid'] == current_pid:
+                    continue
+                joined = " ".join(cmdline).lower()
+                if 'streamlit' in joined or 'app.py' in joined:
                     streamlit_processes.append(proc)
             except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
                 pass
@@ -30,6 +40,49 @@ def find_streamlit_processes():
     
     return streamlit_processes
 
+def find_pids_by_port_proc(port=8501):
+    """
+    通过/proc文件系统查找监听指定端口的进程PID（仅Linux）
+    
+    Returns:
+        PID列表；如果/proc不可用则返回None
+    """
+    if not os.path.exists("/proc/net/tcp"):
+        return None
+    
+    # 收集监听该端口的socket inode（状态0A表示LISTEN）
+    port_hex = f"{port:04X}"
+    inodes = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table, 'r') as f:
+                next(f, None)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 9 and fields[3] == "0A" and fields[1].rsplit(':', 1)[-1] == port_hex:
+                        inodes.add(f"socket:[{fields[9]}]")
+        except OSError:
+            continue
+    
+    if not inodes:
+        return []
+    
+    # 遍历进程的文件描述符，找到持有这些socket的进程
+    pids = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            for fd in os.listdir(fd_dir):
+                if os.readlink(f"{fd_dir}/{fd}") in inodes:
+                    pids.append(pid)
+                    break
+        except OSError:
+            continue
+    
+    return pids
+
 def kill_processes_by_port(port=8501):
     """通过端口号查找并终止进程"""
     try:
@@ -53,21 +106,22 @@ def kill_processes_by_port(port=8501):
                         except subprocess.CalledProcessError:
                             print(f"⚠️ 无法终止进程 PID: {pid}")
         else:
-            # Unix/Linux/macOS系统
-            result = subprocess.run(
-                ["lsof", "-ti", f":{port}"], 
-                capture_output=True, 
-                text=True
-            )
+            # Unix/Linux/macOS系统：优先读取/proc，避免启动lsof进程
+            pids = find_pids_by_port_proc(port)
+            if pids is None:
+                result = subprocess.run(
+                    ["lsof", "-ti", f":{port}"], 
+                    capture_output=True, 
+                    text=True
+                )
+                pids = result.stdout.strip().split('\n') if result.stdout.strip() else []
             
-            if result.stdout.strip():
-                pids = result.stdout.strip().split('\n')
-                for pid in pids:
-                    try:
-                        subprocess.run(["kill", "-9", pid], check=True)
-                        print(f"✅ 已终止端口 {port} 上的进程 (PID: {pid})")
-                    except subprocess.CalledProcessError:
-                        print(f"⚠️ 无法终止进程 PID: {pid}")
+            for pid in pids:
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                    print(f"✅ 已终止端口 {port} 上的进程 (PID: {pid})")
+                except (ProcessLookupError, PermissionError, ValueError):
+                    print(f"⚠️ 无法终止进程 PID: {pid}")
                         
     except subprocess.CalledProcessError:
         print(f"⚠️ 无法查找端口 {port} 上的进程")
@@ -84,24 +138,34 @@ def main():
     processes = find_streamlit_processes()
     
     if processes:
+        import psutil
+        
         print(f"🔍 找到 {len(processes)} 个相关进程")
+        terminated = []
         for proc in processes:
             try:
                 print(f"⏹️  终止进程: {proc.info['name']} (PID: {proc.info['pid']})")
                 proc.terminate()
-                
-                # 等待进程结束
-                try:
-                    proc.wait(timeout=3)
-                    print(f"✅ 进程 {proc.info['pid']} 已正常终止")
-                except psutil.TimeoutExpired:
-                    print(f"⚠️ 进程 {proc.info['pid']} 未响应，强制终止...")
-                    proc.kill()
-                    proc.wait()
-                    print(f"✅ 进程 {proc.info['pid']} 已强制终止")
-                    
+                terminated.append(proc)
             except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
                 print(f"⚠️ 无法终止进程 {proc.info['pid']}: {e}")
+        
+        # 同时等待所有进程结束，而不是逐个等待
+        gone, alive = psutil.wait_procs(terminated, timeout=3)
+        for proc in gone:
+            print(f"✅ 进程 {proc.info['pid']} 已正常终止")
+        
+        # 强制终止未响应的进程
+        for proc in alive:
+            try:
+                print(f"⚠️ 进程 {proc.info['pid']} 未响应，强制终止...")
+                proc.kill()
+            except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
+                print(f"⚠️ 无法终止进程 {proc.info['pid']}: {e}")
+        if alive:
+            gone, alive = psutil.wait_procs(alive, timeout=1)
+            for proc in gone:
+                print(f"✅ 进程 {proc.info['pid']} 已强制终止")
     else:
         print("ℹ️  未找到Streamlit进程")
     
@@ -132,8 +196,14 @@ def main():
     print("💡 如果浏览器页面仍然显示，请手动刷新或关闭")
     print("💡 现在可以安全地重新启动应用: python run_app.py")
     
-    # 等待用户确认
-    input("\n按回车键退出...")
+    # 仅在交互模式下等待用户确认，避免阻塞自动化流程
+    if sys.stdin.isatty() and '--interactive' in sys.argv:
+        input("\n按回车键退出...")
+    
+    # 跳过解释器的清理流程直接退出
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(0)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+提示词响应缓存模块
+用于缓存模型对相同提示词的响应，避免重复调用模型
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class PromptCache:
+    """
+    提示词响应缓存
+
+    以完整提示词的blake2b摘要为键，内存LRU在前、SQLite磁盘存储在后。
+    只有提示词完全一致（包括模板、指令和随机示例）时才会命中，
+    因此不会把不同上下文的请求合并成同一个结果。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_memory_items: int = 1024):
+        """
+        初始化提示词缓存
+
+        Args:
+            db_path: SQLite数据库文件路径，为None时只使用内存缓存
+            max_memory_items: 内存LRU中保留的最大条目数
+        """
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS prompt_cache (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(prompt: str) -> str:
+        """
+        计算提示词的缓存键
+
+        Args:
+            prompt: 完整的提示词
+
+        Returns:
+            提示词的blake2b十六进制摘要
+        """
+        return hashlib.blake2b(prompt.encode('utf-8'), digest_size=20).hexdigest()
+
+    def get(self, prompt: str) -> Optional[str]:
+        """
+        获取缓存的响应
+
+        Args:
+            prompt: 完整的提示词
+
+        Returns:
+            缓存的响应，未命中时返回None
+        """
+        key = self.make_key(prompt)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if self._conn is None:
+                return None
+
+            row = self._conn.execute(
+                "SELECT response FROM prompt_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, prompt: str, response: str) -> None:
+        """
+        写入缓存
+
+        Args:
+            prompt: 完整的提示词
+            response: 模型响应
+        """
+        key = self.make_key(prompt)
+        with self._lock:
+            self._remember(key, response)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO prompt_cache (key, response) VALUES (?, ?)", (key, response)
+                )
+                self._conn.commit()
+
+    def _remember(self, key: str, response: str) -> None:
+        """
+        写入内存LRU，超出容量时淘汰最久未使用的条目
+        """
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def close(self) -> None:
+        """
+        关闭SQLite连接
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
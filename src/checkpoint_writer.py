@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+后台检查点写入模块
+在独立线程中把生成的样本逐条追加到JSONL临时文件，避免在生成过程中反复重写整个数据集
+"""
+import json
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from src.data_loader import _dump_json_bytes, _ensure_dir, _write_bytes_atomic
+
+# 尝试导入orjson，如果不可用则使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class CheckpointWriter(threading.Thread):
+    """
+    检查点写入线程
+
+    生成线程通过submit提交样本，写入线程把样本追加到 `<output_file>.partial.jsonl`，
+    生成结束后调用finalize一次性写出最终的JSON数组文件。
+    调用sync时，写入线程把已提交的样本同步到磁盘后再回调on_checkpoint记录进度。
+    """
+
+    _STOP = object()
+    _SYNC = object()
+
+    def __init__(
+        self,
+        output_file: str,
+        append: bool = False,
+        on_checkpoint: Optional[Callable[[int, int], None]] = None,
+        maxsize: int = 0
+    ):
+        """
+        初始化检查点写入线程
+
+        Args:
+            output_file: 最终输出文件路径，临时文件保存在其旁边
+            append: 是否在已有临时文件后追加（断点续传），否则清空重写
+            on_checkpoint: 同步到磁盘后在写入线程中调用，参数为(已完成数量, 临时文件长度)
+            maxsize: 待写入队列的最大长度，0表示不限制
+        """
+        super().__init__(daemon=True)
+        self.output_file = output_file
+        self.partial_file = f"{output_file}.partial.jsonl"
+        self.append = append
+        self.on_checkpoint = on_checkpoint
+        self.error: Optional[Exception] = None
+        self._queue = queue.Queue(maxsize)
+
+    def submit(self, sample: Dict[str, Any]) -> None:
+        """
+        提交一个样本等待写入
+
+        Args:
+            sample: 生成的样本
+        """
+        self._queue.put(sample)
+
+    def sync(self, completed_count: int) -> None:
+        """
+        请求写入线程把此前提交的样本同步到磁盘，然后回调on_checkpoint
+
+        Args:
+            completed_count: 截至目前已完成的数量，原样传给on_checkpoint
+        """
+        self._queue.put((self._SYNC, completed_count))
+
+    def run(self) -> None:
+        """
+        写入线程主循环，队列暂时为空时刷新文件缓冲区
+        """
+        try:
+            _ensure_dir(self.partial_file)
+
+            with open(self.partial_file, 'ab' if self.append else 'wb') as f:
+                while True:
+                    item = self._queue.get()
+                    if item is self._STOP:
+                        break
+                    if isinstance(item, tuple) and item[0] is self._SYNC:
+                        # 先落盘再记录进度，保证检查点指向的内容确实已经写入磁盘
+                        f.flush()
+                        os.fsync(f.fileno())
+                        if self.on_checkpoint is not None:
+                            self.on_checkpoint(item[1], f.tell())
+                        continue
+                    f.write(self._dumps_line(item))
+                    if self._queue.empty():
+                        f.flush()
+        except Exception as e:
+            self.error = e
+            # 写入失败后继续清空队列，避免生成线程阻塞
+            while self._queue.get() is not self._STOP:
+                pass
+
+    def close(self) -> None:
+        """
+        停止写入线程并保留临时文件，用于生成被中断时保留已完成的样本
+        """
+        self._queue.put(self._STOP)
+        self.join()
+
+    def finalize(self, output_file: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        停止写入线程并删除临时文件
+
+        Args:
+            output_file: 如果提供，则先把临时文件中的样本整理为JSON数组写入该文件
+
+        Returns:
+            写入最终文件的样本列表，未提供output_file时返回None
+        """
+        self._queue.put(self._STOP)
+        self.join()
+
+        if self.error is not None:
+            raise Exception(f"保存检查点失败: {str(self.error)}")
+
+        data = None
+        if output_file:
+            data = self._read_partial()
+            try:
+                _write_bytes_atomic(output_file, _dump_json_bytes(data))
+            except Exception as e:
+                raise Exception(f"保存数据失败: {str(e)}")
+
+        if os.path.exists(self.partial_file):
+            os.remove(self.partial_file)
+        return data
+
+    def _read_partial(self) -> List[Dict[str, Any]]:
+        """
+        读取临时文件中的所有样本
+        """
+        loads = orjson.loads if orjson is not None else json.loads
+        with open(self.partial_file, 'rb') as f:
+            return [loads(line) for line in f if line.strip()]
+
+    @staticmethod
+    def _dumps_line(sample: Dict[str, Any]) -> bytes:
+        """
+        把样本序列化为一行UTF-8编码的JSON（与_dump_json_bytes的紧凑格式一致）
+        """
+        return _dump_json_bytes(sample, pretty=False) + b"\n"
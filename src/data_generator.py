@@ -12,19 +12,26 @@
 import json
 import os
 import random
-from typing import List, Dict, Any, Tuple, Optional
+import re
+import threading
 import time
+from collections import deque
+from typing import List, Dict, Any, Tuple, Optional
 from tqdm import tqdm
 import asyncio
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from src.data_loader import DataLoader
 from src.model_caller import ModelCaller, extract_content_between_backticks
+from src.cache import PromptCache
+from src.checkpoint_writer import CheckpointWriter
+from src.rate_limiter import TokenBucket
+from src.progress_publisher import ProgressPublisher
 
 # 导入新的模块化生成器
 from src.dataset_generators.sft_generator import SFTDatasetGenerator
 from src.dataset_generators.dpo_generator import DPODatasetGenerator
 from src.dataset_generators.sft_to_dpo_converter import SFTToDPOConverter
+from src.dataset_generators.base_generator import _compile_template, _FENCED_BLOCK_PATTERN
 
 # 尝试导入streamlit，如果不可用则使用None
 try:
@@ -32,11 +39,41 @@ try:
 except ImportError:
     st = None
 
+# 非instruction行的常见前缀（解释性文本、多余的 'json' 标识符或代码块标记）
+_NON_INSTRUCTION_LINE = re.compile(r'(?:示例|以下是|这是|json|```)', re.IGNORECASE)
+
+# 共享的JSON解码器及解析失败标记
+_JSON_DECODER = json.JSONDecoder()
+_NOT_JSON = object()
+
+
+def _decode_json_or_sentinel(text: str) -> Any:
+    """
+    尝试将文本整体解析为JSON，失败时返回_NOT_JSON
+
+    只有以 [ { " 开头的文本才会尝试解析，其余内容直接按普通文本处理，
+    避免对明显不是JSON的模型输出做一次注定失败的完整解析。
+    """
+    stripped = text.strip()
+    if not stripped or stripped[0] not in '[{"':
+        return _NOT_JSON
+    try:
+        obj, end = _JSON_DECODER.raw_decode(stripped)
+    except json.JSONDecodeError:
+        return _NOT_JSON
+    # 必须完整解析整个文本，否则视为普通文本
+    if end != len(stripped):
+        return _NOT_JSON
+    return obj
+
 
 class DataGenerator:
     """
     数据生成器，用于生成新的数据集
     """
+    # 预先格式化的示例池大小
+    EXAMPLE_POOL_SIZE = 256
+    
     def __init__(
         self, 
         model_caller: ModelCaller, 
@@ -45,7 +82,10 @@ class DataGenerator:
         input_prompt: str,
         output_prompt: str,
         sample_min: int = 3,
-        sample_max: int = 6
+        sample_max: int = 6,
+        cache: Optional[PromptCache] = None,
+        rps: float = 10.0,
+        batch_size: int = 20
     ):
         """
         初始化数据生成器
@@ -58,6 +98,9 @@ class DataGenerator:
             output_prompt: 生成output的提示模板
             sample_min: 最少示例数量
             sample_max: 最多示例数量
+            cache: 提示词响应缓存，为None时不使用缓存
+            rps: 每秒最多发起的模型请求数，小于等于0表示不限流
+            batch_size: 完整模式下每次请求批量生成的instruction数量
         """
         self.model_caller = model_caller
         self.data_loader = data_loader
@@ -66,125 +109,310 @@ class DataGenerator:
         self.output_prompt = output_prompt
         self.sample_min = sample_min
         self.sample_max = sample_max
+        self.cache = cache
+        self.rps = rps
+        self.batch_size = max(1, batch_size)
+        self._example_pool: List[str] = []
+        
+        # 批量生成的instruction缓冲区，供后续样本依次取用
+        self._instruction_buffer = deque()
+        self._instruction_lock = threading.Lock()
+        # 补充缓冲区时只允许一个请求在途，其余调用方等待后直接从缓冲区取用
+        self._instruction_refill_lock = threading.Lock()
+        self._instruction_refill_task: Optional[asyncio.Future] = None
+        # 本次生成还需要的instruction数量，补充缓冲区时最多请求这么多；None表示不限制
+        self._instructions_needed: Optional[int] = None
+        
+        # 进行中的异步请求（缓存键 -> 任务），用于合并相同提示词的并发请求
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
+        # 令牌桶限流：由模型调用器在每次请求前获取令牌，只在请求过快或收到429时等待
+        self._bucket = TokenBucket(rps)
+        if getattr(model_caller, 'rate_limiter', None) is None:
+            model_caller.rate_limiter = self._bucket
+    
+    def _build_example_pool(self, num_samples: int) -> None:
+        """
+        预先格式化一批随机示例，生成过程中直接从池中随机选取
+        
+        Args:
+            num_samples: 本次要生成的样本数量，用于确定示例池大小（每个样本最多3次模型调用）
+        """
+        pool_size = min(self.EXAMPLE_POOL_SIZE, max(1, num_samples * 3))
+        self._example_pool = [
+            self.data_loader.format_examples(
+                self.data_loader.get_random_samples(self.sample_min, self.sample_max)
+            )
+            for _ in range(pool_size)
+        ]
+    
+    def _get_formatted_examples(self) -> str:
+        """
+        获取格式化后的随机示例，优先从示例池中选取
+        """
+        if self._example_pool:
+            return random.choice(self._example_pool)
+        examples = self.data_loader.get_random_samples(self.sample_min, self.sample_max)
+        return self.data_loader.format_examples(examples)
+    
+    def _call_model(self, prompt: str) -> str:
+        """
+        调用模型生成，命中缓存时直接返回缓存的响应
+        """
+        if self.cache is not None:
+            cached = self.cache.get(prompt)
+            if cached is not None:
+                return cached
+        
+        response = self.model_caller.generate(prompt)
+        
+        # 只缓存有效响应，调用失败返回的空字符串不缓存
+        if self.cache is not None and response:
+            self.cache.put(prompt, response)
+        return response
     
-    def generate_instructions(self, num_to_generate: int = 1) -> List[str]:
+    async def _acall_model(self, prompt: str) -> str:
+        """
+        异步调用模型生成，命中缓存时直接返回缓存的响应
+
+        启用缓存时，正在进行中的相同提示词请求会被合并：后到的任务直接等待
+        先发出的请求结果，而不是再发起一次注定会写入同一缓存条目的请求。
+        """
+        if self.cache is None:
+            return await self.model_caller.agenerate(prompt)
+        
+        cached = self.cache.get(prompt)
+        if cached is not None:
+            return cached
+        
+        key = PromptCache.make_key(prompt)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._afetch_and_cache(prompt))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # 某个等待方被取消时不取消共享的请求，其余等待方仍能拿到结果
+        return await asyncio.shield(task)
+    
+    async def _afetch_and_cache(self, prompt: str) -> str:
+        """
+        异步调用模型并缓存有效响应
+        """
+        response = await self.model_caller.agenerate(prompt)
+        if response:
+            self.cache.put(prompt, response)
+        return response
+    
+    def generate_instructions(self, num_to_generate: int = 1, formatted_examples: Optional[str] = None) -> List[str]:
         """
         生成新的instructions
         
         Args:
             num_to_generate: 要生成的instruction数量
+            formatted_examples: 格式化后的示例，为None时随机选取
             
         Returns:
             生成的instruction列表
         """
         # 获取随机示例
-        examples = self.data_loader.get_random_samples(self.sample_min, self.sample_max)
-        formatted_examples = self.data_loader.format_examples(examples)
+        if formatted_examples is None:
+            formatted_examples = self._get_formatted_examples()
         
         # 构建提示词
-        prompt = self.instruction_prompt.format(
+        prompt = _compile_template(self.instruction_prompt)(
             num_to_generate=num_to_generate,
             examples=formatted_examples
         )
         
         # 调用模型生成
-        response = self.model_caller.generate(prompt)
+        response = self._call_model(prompt)
+        
+        return self._parse_instructions(response, num_to_generate)
+    
+    async def agenerate_instructions(self, num_to_generate: int = 1, formatted_examples: Optional[str] = None) -> List[str]:
+        """
+        异步生成新的instructions
         
+        Args:
+            num_to_generate: 要生成的instruction数量
+            formatted_examples: 格式化后的示例，为None时随机选取
+            
+        Returns:
+            生成的instruction列表
+        """
+        if formatted_examples is None:
+            formatted_examples = self._get_formatted_examples()
+        
+        prompt = _compile_template(self.instruction_prompt)(
+            num_to_generate=num_to_generate,
+            examples=formatted_examples
+        )
+        
+        response = await self._acall_model(prompt)
+        
+        return self._parse_instructions(response, num_to_generate)
+    
+    def _parse_instructions(self, response: str, num_to_generate: int) -> List[str]:
+        """
+        从模型响应中解析instructions
+        
+        Args:
+            response: 模型响应
+            num_to_generate: 要生成的instruction数量
+            
+        Returns:
+            解析出的instruction列表
+        """
         # 解析生成的instructions
         instructions = []
+        extracted_lines = None
         
         # 尝试从三个反引号中提取内容
         extracted = extract_content_between_backticks(response)
         
-        if extracted:
-            try:
-                # 尝试将提取的内容解析为 JSON 数组
-                parsed_json = json.loads(extracted)
-                if isinstance(parsed_json, list):
-                    # 如果是列表，则每个元素视为一个 instruction
-                    instructions.extend([str(item).strip() for item in parsed_json if str(item).strip()])
-                elif isinstance(parsed_json, str):
-                    # 如果是字符串，按行分割
-                    lines = [line.strip() for line in parsed_json.split('\n') if line.strip()]
-                    instructions.extend(lines)
-                else:
-                    # 其他类型直接转换为字符串
-                    instructions.append(str(parsed_json).strip())
-            except json.JSONDecodeError:
+        # 多个代码块时，每个代码块视为一个 instruction
+        blocks = [block for block in _FENCED_BLOCK_PATTERN.findall(response) if block]
+        if len(blocks) > 1:
+            instructions.extend(dict.fromkeys(blocks))
+        elif extracted:
+            # 尝试将提取的内容解析为 JSON
+            parsed_json = _decode_json_or_sentinel(extracted)
+            if isinstance(parsed_json, list):
+                # 如果是列表，则每个元素视为一个 instruction
+                instructions.extend([item for item in map(str.strip, map(str, parsed_json)) if item])
+            elif isinstance(parsed_json, str):
+                # 如果是字符串，按行分割
+                instructions.extend([line for line in map(str.strip, parsed_json.splitlines()) if line])
+            elif parsed_json is not _NOT_JSON:
+                # 其他类型直接转换为字符串
+                instructions.append(str(parsed_json).strip())
+            else:
                 # 如果不是有效的 JSON，则按行分割
-                lines = [line.strip() for line in extracted.split('\n') if line.strip()]
-                instructions.extend(lines)
+                extracted_lines = [line for line in map(str.strip, extracted.splitlines()) if line]
+                instructions.extend(extracted_lines)
         
         # 如果提取后仍然没有足够的 instructions，或者模型直接返回了非反引号包裹的内容
         if not instructions or len(instructions) < num_to_generate:
             # 再次尝试直接处理原始响应，以防 extract_content_between_backticks 过滤掉了有效内容
-            raw_lines = [line.strip() for line in response.split('\n') if line.strip()]
+            # 提取结果与原始响应一致时直接复用已分割的行
+            if extracted_lines is not None and extracted == response.strip():
+                raw_lines = extracted_lines
+            else:
+                raw_lines = [line for line in map(str.strip, response.splitlines()) if line]
+            seen = set(instructions)
             for line in raw_lines:
-                # 过滤掉可能的非 instruction 行（如解释性文本或多余的 'json' 标识符）
-                if not line.lower().startswith('示例') and \
-                   not line.lower().startswith('以下是') and \
-                   not line.lower().startswith('这是') and \
-                   not line.lower().startswith('json') and \
-                   line not in instructions: # 避免重复添加
+                # 过滤掉可能的非 instruction 行（如解释性文本或多余的 'json' 标识符），并避免重复添加
+                if line not in seen and _NON_INSTRUCTION_LINE.match(line) is None:
                     instructions.append(line)
+                    seen.add(line)
         
         # 确保返回指定数量的instructions
         return instructions[:num_to_generate]
     
-    def generate_input(self, instruction: str) -> str:
+    def generate_input(self, instruction: str, formatted_examples: Optional[str] = None) -> str:
         """
         为给定的instruction生成input
         
         Args:
             instruction: 指令
+            formatted_examples: 格式化后的示例，为None时随机选取
             
         Returns:
             生成的input
         """
         # 获取随机示例
-        examples = self.data_loader.get_random_samples(self.sample_min, self.sample_max)
-        formatted_examples = self.data_loader.format_examples(examples)
+        if formatted_examples is None:
+            formatted_examples = self._get_formatted_examples()
         
         # 构建提示词
-        prompt = self.input_prompt.format(
+        prompt = _compile_template(self.input_prompt)(
             instruction=instruction,
             examples=formatted_examples
         )
         
         # 调用模型生成
-        response = self.model_caller.generate(prompt)
+        response = self._call_model(prompt)
         
         # 提取生成的input
         return extract_content_between_backticks(response)
     
-    def generate_output(self, instruction: str, input_text: str) -> str:
+    def generate_output(self, instruction: str, input_text: str, formatted_examples: Optional[str] = None) -> str:
         """
         为给定的instruction和input生成output
         
         Args:
             instruction: 指令
             input_text: 输入
+            formatted_examples: 格式化后的示例，为None时随机选取
             
         Returns:
             生成的output
         """
         # 获取随机示例
-        examples = self.data_loader.get_random_samples(self.sample_min, self.sample_max)
-        formatted_examples = self.data_loader.format_examples(examples)
+        if formatted_examples is None:
+            formatted_examples = self._get_formatted_examples()
         
         # 构建提示词
-        prompt = self.output_prompt.format(
+        prompt = _compile_template(self.output_prompt)(
             instruction=instruction,
             input=input_text,
             examples=formatted_examples
         )
         
         # 调用模型生成
-        response = self.model_caller.generate(prompt)
+        response = self._call_model(prompt)
         
         # 提取生成的output
         return extract_content_between_backticks(response)
     
+    async def agenerate_input(self, instruction: str, formatted_examples: Optional[str] = None) -> str:
+        """
+        异步为给定的instruction生成input
+        
+        Args:
+            instruction: 指令
+            formatted_examples: 格式化后的示例，为None时随机选取
+            
+        Returns:
+            生成的input
+        """
+        if formatted_examples is None:
+            formatted_examples = self._get_formatted_examples()
+        
+        prompt = _compile_template(self.input_prompt)(
+            instruction=instruction,
+            examples=formatted_examples
+        )
+        
+        response = await self._acall_model(prompt)
+        
+        return extract_content_between_backticks(response)
+    
+    async def agenerate_output(self, instruction: str, input_text: str, formatted_examples: Optional[str] = None) -> str:
+        """
+        异步为给定的instruction和input生成output
+        
+        Args:
+            instruction: 指令
+            input_text: 输入
+            formatted_examples: 格式化后的示例，为None时随机选取
+            
+        Returns:
+            生成的output
+        """
+        if formatted_examples is None:
+            formatted_examples = self._get_formatted_examples()
+        
+        prompt = _compile_template(self.output_prompt)(
+            instruction=instruction,
+            input=input_text,
+            examples=formatted_examples
+        )
+        
+        response = await self._acall_model(prompt)
+        
+        return extract_content_between_backticks(response)
+    
     def generate_input_output_sample(self, instruction: str = None) -> Dict[str, str]:
         """
         为给定的instruction生成input和output（新模式）
@@ -214,6 +442,84 @@ class DataGenerator:
             "output": output
         }
     
+    def _set_instructions_needed(self, num_samples: int) -> None:
+        """
+        记录本次生成还需要的instruction数量，补充缓冲区时不会请求超过这个数量
+        
+        Args:
+            num_samples: 本次要生成的样本数量
+        """
+        with self._instruction_lock:
+            self._instructions_needed = num_samples
+    
+    def _instruction_refill_size(self) -> int:
+        """
+        计算补充缓冲区时请求的instruction数量：不超过batch_size，也不超过剩余需要的数量
+        """
+        with self._instruction_lock:
+            needed = self._instructions_needed
+        if needed is None:
+            return self.batch_size
+        return max(1, min(self.batch_size, needed))
+    
+    def _take_buffered_instruction(self) -> Optional[str]:
+        """
+        从缓冲区取出一个instruction，缓冲区为空时返回None
+        """
+        with self._instruction_lock:
+            if self._instruction_buffer:
+                if self._instructions_needed:
+                    self._instructions_needed -= 1
+                return self._instruction_buffer.popleft()
+        return None
+    
+    def _buffer_instructions(self, instructions: List[str]) -> None:
+        """
+        把生成的instructions放入缓冲区
+        """
+        if not instructions:
+            raise ValueError("生成instruction失败")
+        with self._instruction_lock:
+            self._instruction_buffer.extend(instructions)
+    
+    def _next_instruction(self) -> str:
+        """
+        获取下一个instruction，缓冲区为空时批量补充
+        
+        同一时间只有一个线程补充缓冲区，其余线程等待补充完成后直接从缓冲区取用。
+        """
+        while True:
+            instruction = self._take_buffered_instruction()
+            if instruction is not None:
+                return instruction
+            with self._instruction_refill_lock:
+                # 等待锁期间其他线程可能已经补充了缓冲区
+                if not self._instruction_buffer:
+                    self._buffer_instructions(self.generate_instructions(self._instruction_refill_size()))
+    
+    async def _anext_instruction(self) -> str:
+        """
+        异步获取下一个instruction，缓冲区为空时批量补充
+        
+        同一时间只有一个补充任务在途，其余协程等待该任务完成后直接从缓冲区取用。
+        """
+        while True:
+            instruction = self._take_buffered_instruction()
+            if instruction is not None:
+                return instruction
+            task = self._instruction_refill_task
+            if task is None or task.done():
+                task = asyncio.ensure_future(self._arefill_instructions())
+                self._instruction_refill_task = task
+            # 某个等待方被取消时不影响共享的补充任务
+            await asyncio.shield(task)
+    
+    async def _arefill_instructions(self) -> None:
+        """
+        异步批量生成instructions并放入缓冲区
+        """
+        self._buffer_instructions(await self.agenerate_instructions(self._instruction_refill_size()))
+    
     def generate_complete_sample(self) -> Dict[str, str]:
         """
         生成完整的样本（instruction, input, output）
@@ -221,11 +527,8 @@ class DataGenerator:
         Returns:
             包含instruction, input, output的字典
         """
-        # 生成instruction
-        instructions = self.generate_instructions(1)
-        if not instructions:
-            raise ValueError("生成instruction失败")
-        instruction = instructions[0]
+        # 从缓冲区获取instruction，缓冲区为空时批量生成
+        instruction = self._next_instruction()
         
         # 生成input
         input_text = self.generate_input(instruction)
@@ -239,6 +542,103 @@ class DataGenerator:
             "output": output
         }
     
+    async def agenerate_input_output_sample(self, instruction: str = None) -> Dict[str, str]:
+        """
+        异步为给定的instruction生成input和output（新模式）
+        
+        Args:
+            instruction: 固定的指令，如果为None或空字符串则从原始数据集中随机选择
+            
+        Returns:
+            包含instruction, input, output的字典
+        """
+        if not instruction or not instruction.strip():
+            sample = self.data_loader.get_random_samples(1, 1)[0]
+            instruction = sample.get('instruction', '')
+            if not instruction:
+                raise ValueError("原始数据集中没有找到有效的instruction")
+        
+        input_text = await self.agenerate_input(instruction)
+        output = await self.agenerate_output(instruction, input_text)
+        
+        return {
+            "instruction": instruction,
+            "input": input_text,
+            "output": output
+        }
+    
+    async def agenerate_complete_sample(self) -> Dict[str, str]:
+        """
+        异步生成完整的样本（instruction, input, output）
+        
+        Returns:
+            包含instruction, input, output的字典
+        """
+        instruction = await self._anext_instruction()
+        
+        input_text = await self.agenerate_input(instruction)
+        output = await self.agenerate_output(instruction, input_text)
+        
+        return {
+            "instruction": instruction,
+            "input": input_text,
+            "output": output
+        }
+    
+    async def _agenerate_sample(self, mode: str, fixed_instruction: str = None) -> Dict[str, str]:
+        """
+        根据模式异步生成单个样本
+        """
+        if mode == "complete":
+            return await self.agenerate_complete_sample()
+        elif mode == "input_output":
+            return await self.agenerate_input_output_sample(fixed_instruction)
+        else:
+            raise ValueError(f"不支持的生成模式: {mode}")
+    
+    async def _agenerate_indexed_samples(self, generator_instance, num_samples: int, mode: str, fixed_instruction: str, concurrency: int):
+        """
+        以有限并发异步生成样本，按完成顺序产出(索引, 样本)，失败的样本为None
+
+        同一时刻最多只有concurrency个任务存在，每完成一个再补充一个，
+        不会一次性为全部样本创建任务。
+        """
+        async def generate_single_sample(index: int) -> Tuple[int, Optional[Dict[str, str]]]:
+            try:
+                return index, await generator_instance._agenerate_sample(mode, fixed_instruction)
+            except Exception as e:
+                # 生成样本时出错
+                return index, None
+        
+        pending = set()
+        next_index = 0
+        try:
+            while next_index < num_samples or pending:
+                while next_index < num_samples and len(pending) < concurrency:
+                    pending.add(asyncio.create_task(generate_single_sample(next_index)))
+                    next_index += 1
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # 调用方提前退出或被取消时取消尚未完成的任务，并等待其结束以释放连接
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    
+    def _run_async(self, coro):
+        """
+        在新的事件循环中运行协程，结束后关闭模型调用器的异步连接池
+        """
+        async def runner():
+            try:
+                return await coro
+            finally:
+                await self.model_caller.aclose()
+        
+        return asyncio.run(runner())
+    
     def generate_dataset(self, num_samples: int, output_file: str, mode: str = "complete", fixed_instruction: str = None, folder_mode: str = "merged", custom_filenames: Dict[str, str] = None, concurrency: int = 1) -> List[Dict[str, str]]:
         """
         生成完整的数据集
@@ -259,6 +659,10 @@ class DataGenerator:
         if folder_mode == "separate" and len(self.data_loader.file_paths) > 1:
             return self.generate_dataset_for_folder_separate(num_samples, output_file, mode, fixed_instruction, custom_filenames, concurrency)
         
+        # 预先构建示例池，避免每次请求都重新抽样和格式化
+        self._build_example_pool(num_samples)
+        self._set_instructions_needed(num_samples)
+        
         # 根据并发数选择生成方式
         if concurrency > 1:
             return self._generate_dataset_concurrent(num_samples, output_file, mode, fixed_instruction, concurrency)
@@ -286,6 +690,10 @@ class DataGenerator:
             progress_bar = st.progress(0)
             status_text = st.empty()
             
+        # 后台线程逐条写入检查点，避免反复重写整个数据集
+        checkpoint_writer = CheckpointWriter(output_file)
+        checkpoint_writer.start()
+        
         # 使用tqdm显示终端进度
         for i in tqdm(range(num_samples), desc=desc):
             try:
@@ -304,13 +712,7 @@ class DataGenerator:
                     raise ValueError(f"不支持的生成模式: {mode}")
                     
                 generated_data.append(sample)
-                
-                # 每生成10个样本保存一次，防止中途失败
-                if (i + 1) % 10 == 0:
-                    self.data_loader.save_data(generated_data, output_file)
-                    
-                # 添加随机延迟，避免频繁请求
-                time.sleep(random.uniform(0.5, 2.0))
+                checkpoint_writer.submit(sample)
                 
             except Exception as e:
                 # 生成样本时出错
@@ -321,8 +723,8 @@ class DataGenerator:
             progress_bar.progress(1.0)
             status_text.text(f"{desc}: 完成 ({len(generated_data)}/{num_samples})")
         
-        # 最终保存
-        self.data_loader.save_data(generated_data, output_file)
+        # 最终保存：把检查点整理为JSON数组写入输出文件
+        checkpoint_writer.finalize(output_file)
         
         return generated_data
     
@@ -330,6 +732,14 @@ class DataGenerator:
         """
         并发生成数据集，确保请求结果与内容一一对应
         """
+        return self._run_async(
+            self._agenerate_dataset(num_samples, output_file, mode, fixed_instruction, concurrency)
+        )
+    
+    async def _agenerate_dataset(self, num_samples: int, output_file: str, mode: str, fixed_instruction: str = None, concurrency: int = 3) -> List[Dict[str, str]]:
+        """
+        基于asyncio并发生成数据集，同时进行的任务数不超过concurrency，每完成一个再补充一个
+        """
         generated_data = [None] * num_samples  # 预分配列表，保持顺序
         
         # 设置进度描述
@@ -349,46 +759,32 @@ class DataGenerator:
         
         completed_count = 0
         
-        def generate_single_sample(index: int, generator_instance, generation_mode: str, instruction: str) -> Tuple[int, Dict[str, str]]:
-            """
-            生成单个样本，返回索引和样本数据以保持顺序
-            """
-            try:
-                if generation_mode == "complete":
-                    sample = generator_instance.generate_complete_sample()
-                elif generation_mode == "input_output":
-                    sample = generator_instance.generate_input_output_sample(instruction)
-                else:
-                    raise ValueError(f"不支持的生成模式: {generation_mode}")
-                return index, sample
-            except Exception as e:
-                # 生成样本时出错
-                return index, None
+        # 进度条由独立线程刷新，事件循环只记录最新进度
+        publisher = None
+        if progress_bar is not None:
+            publisher = ProgressPublisher(progress_bar, status_text)
+            publisher.start()
         
-        # 使用ThreadPoolExecutor进行并发生成
-        with ThreadPoolExecutor(max_workers=concurrency) as executor:
-            # 提交所有任务
-            future_to_index = {executor.submit(generate_single_sample, i, self, mode, fixed_instruction): i for i in range(num_samples)}
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_index):
-                index, sample = future.result()
+        # 后台线程逐条写入检查点，避免反复重写整个数据集
+        checkpoint_writer = CheckpointWriter(output_file)
+        checkpoint_writer.start()
+        
+        # 处理完成的任务
+        try:
+            async for index, sample in self._agenerate_indexed_samples(self, num_samples, mode, fixed_instruction, concurrency):
                 if sample is not None:
                     generated_data[index] = sample
+                    checkpoint_writer.submit(sample)
                 
                 completed_count += 1
                 
-                # 更新进度条
-                if progress_bar is not None:
+                # 更新进度
+                if publisher is not None:
                     progress = completed_count / num_samples
-                    progress_bar.progress(progress)
-                    status_text.text(f"{desc}: {completed_count}/{num_samples} ({progress:.1%})")
-                
-                # 每完成10个样本保存一次（只保存非None的样本）
-                if completed_count % 10 == 0:
-                    valid_data = [sample for sample in generated_data if sample is not None]
-                    if valid_data:
-                        self.data_loader.save_data(valid_data, output_file)
+                    publisher.publish(progress, f"{desc}: {completed_count}/{num_samples} ({progress:.1%})")
+        finally:
+            if publisher is not None:
+                publisher.close()
         
         # 过滤掉None值，保持原有顺序
         final_data = [sample for sample in generated_data if sample is not None]
@@ -398,9 +794,10 @@ class DataGenerator:
             progress_bar.progress(1.0)
             status_text.text(f"{desc}: 完成 ({len(final_data)}/{num_samples})")
         
-        # 最终保存
+        # 最终保存（按原有顺序），随后删除检查点临时文件
         if final_data:
             self.data_loader.save_data(final_data, output_file)
+        checkpoint_writer.finalize()
         
         return final_data
     
@@ -443,6 +840,8 @@ class DataGenerator:
             overall_status = st.empty()
         
         total_files = len(self.data_loader.file_paths)
+        # 同一批次的输出文件共用一个时间戳，便于归档
+        timestamp = self._get_short_timestamp()
         
         for file_idx, file_path in enumerate(self.data_loader.file_paths):
             try:
@@ -452,8 +851,12 @@ class DataGenerator:
                     overall_progress.progress(progress)
                     overall_status.text(f"正在处理文件 {file_idx + 1}/{total_files}: {os.path.basename(file_path)}")
                 
-                # 为每个文件创建单独的数据加载器
-                file_loader = DataLoader(file_path)
+                # 为每个文件创建单独的数据加载器，直接复用已加载的数据，不再重新读取文件
+                source_data = self.data_loader.data_by_file.get(file_path)
+                if not source_data:
+                    # 文件加载失败或为空，跳过
+                    continue
+                file_loader = DataLoader(file_path, data=source_data, file_paths=[file_path])
                 file_generator = DataGenerator(
                     model_caller=self.model_caller,
                     data_loader=file_loader,
@@ -461,8 +864,13 @@ class DataGenerator:
                     input_prompt=self.input_prompt,
                     output_prompt=self.output_prompt,
                     sample_min=self.sample_min,
-                    sample_max=self.sample_max
+                    sample_max=self.sample_max,
+                    cache=self.cache,
+                    rps=self.rps,
+                    batch_size=self.batch_size
                 )
+                file_generator._build_example_pool(num_samples)
+                file_generator._set_instructions_needed(num_samples)
                 
                 # 生成文件名
                 original_filename = os.path.basename(file_path)
@@ -475,7 +883,6 @@ class DataGenerator:
                 else:
                     # 使用默认命名规则
                     file_base_name = os.path.splitext(original_filename)[0]
-                    timestamp = self._get_short_timestamp()
                     output_filename = f"{file_base_name}_{timestamp}.json"
                 
                 file_output_path = os.path.join(output_dir, output_filename)
@@ -550,9 +957,6 @@ class DataGenerator:
                     
                 file_data.append(sample)
                 
-                # 添加随机延迟
-                time.sleep(random.uniform(0.5, 2.0))
-                
             except Exception as e:
                 # 生成样本时出错
                 continue
@@ -568,6 +972,14 @@ class DataGenerator:
         """
         为单个文件并发生成数据，确保请求结果与内容一一对应
         """
+        return self._run_async(
+            self._agenerate_file_data(file_generator, num_samples, mode, fixed_instruction, desc, concurrency)
+        )
+    
+    async def _agenerate_file_data(self, file_generator, num_samples: int, mode: str, fixed_instruction: str, desc: str, concurrency: int) -> List[Dict[str, str]]:
+        """
+        基于asyncio为单个文件并发生成数据
+        """
         file_data = [None] * num_samples  # 预分配列表，保持顺序
         
         # 为单个文件创建进度条
@@ -579,40 +991,27 @@ class DataGenerator:
         
         completed_count = 0
         
-        def generate_single_sample(index: int, generator_instance, generation_mode: str, instruction: str) -> Tuple[int, Dict[str, str]]:
-            """
-            生成单个样本，返回索引和样本数据以保持顺序
-            """
-            try:
-                if generation_mode == "complete":
-                    sample = generator_instance.generate_complete_sample()
-                elif generation_mode == "input_output":
-                    sample = generator_instance.generate_input_output_sample(instruction)
-                else:
-                    raise ValueError(f"不支持的生成模式: {generation_mode}")
-                return index, sample
-            except Exception as e:
-                # 生成样本时出错
-                return index, None
+        # 进度条由独立线程刷新，事件循环只记录最新进度
+        publisher = None
+        if file_progress is not None:
+            publisher = ProgressPublisher(file_progress, file_status)
+            publisher.start()
         
-        # 使用ThreadPoolExecutor进行并发生成
-        with ThreadPoolExecutor(max_workers=concurrency) as executor:
-            # 提交所有任务
-            future_to_index = {executor.submit(generate_single_sample, i, file_generator, mode, fixed_instruction): i for i in range(num_samples)}
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_index):
-                index, sample = future.result()
+        # 处理完成的任务
+        try:
+            async for index, sample in self._agenerate_indexed_samples(file_generator, num_samples, mode, fixed_instruction, concurrency):
                 if sample is not None:
                     file_data[index] = sample
                 
                 completed_count += 1
                 
-                # 更新进度条
-                if file_progress is not None:
+                # 更新进度
+                if publisher is not None:
                     progress = completed_count / num_samples
-                    file_progress.progress(progress)
-                    file_status.text(f"{desc}: {completed_count}/{num_samples} ({progress:.1%})")
+                    publisher.publish(progress, f"{desc}: {completed_count}/{num_samples} ({progress:.1%})")
+        finally:
+            if publisher is not None:
+                publisher.close()
         
         # 过滤掉None值，保持原有顺序
         final_data = [sample for sample in file_data if sample is not None]
@@ -631,6 +1030,4 @@ class DataGenerator:
         Returns:
             短时间戳字符串
         """
-        import datetime
-        now = datetime.datetime.now()
-        return now.strftime("%m%d_%H%M")
\ No newline at end of file
+        return time.strftime("%m%d_%H%M")
\ No newline at end of file
@@ -6,24 +6,188 @@ import json
 import random
 from typing import List, Dict, Any, Tuple, Optional
 import os
+import threading
 from pathlib import Path
-import glob
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import numpy as np
+
+# 尝试导入orjson，如果不可用则使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 已解析文件的缓存：(真实路径, 修改时间, 文件大小) -> 数据列表
+# Streamlit每次交互都会重新运行脚本并重新创建DataLoader，未修改的文件无需重复解析。
+# 服务进程长期运行，缓存按文件大小总和限制（解析后的对象通常还会大几倍），
+# 超过上限时淘汰最久未使用的文件，单个文件超过上限时不缓存
+_PARSED_FILE_CACHE: "OrderedDict[Tuple[str, int, int], List[Any]]" = OrderedDict()
+_PARSED_FILE_CACHE_MAX_BYTES = 256 << 20
+_parsed_file_cache_bytes = 0
+_parsed_file_cache_lock = threading.Lock()
+
+
+def _load_json_file(file_path: str) -> Tuple[Optional[List[Any]], Optional[str]]:
+    """
+    读取并解析单个JSON文件，统一转换为列表
+    
+    文件未修改时直接返回缓存的解析结果（调用方不应修改返回的列表）。
+    
+    Args:
+        file_path: JSON文件路径
+        
+    Returns:
+        (数据列表, 错误信息)，加载成功时错误信息为None，失败时数据列表为None
+    """
+    try:
+        stat = os.stat(file_path)
+        cache_key = (os.path.realpath(file_path), stat.st_mtime_ns, stat.st_size)
+        with _parsed_file_cache_lock:
+            cached = _PARSED_FILE_CACHE.get(cache_key)
+            if cached is not None:
+                _PARSED_FILE_CACHE.move_to_end(cache_key)
+                return cached, None
+        
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        if orjson is not None:
+            data = orjson.loads(content)
+        else:
+            data = json.loads(content)
+    except Exception as e:
+        # 加载文件失败，保留错误信息供调用方汇总
+        return None, str(e)
+    
+    data = data if isinstance(data, list) else [data]
+    if stat.st_size <= _PARSED_FILE_CACHE_MAX_BYTES:
+        _cache_parsed_file(cache_key, data)
+    return data, None
+
+
+def _cache_parsed_file(cache_key: Tuple[str, int, int], data: List[Any]) -> None:
+    """
+    把解析结果放入缓存，同一路径的旧版本直接丢弃，超过字节上限时淘汰最久未使用的文件
+    
+    Args:
+        cache_key: (真实路径, 修改时间, 文件大小)
+        data: 解析后的数据列表
+    """
+    global _parsed_file_cache_bytes
+    with _parsed_file_cache_lock:
+        # 文件已被修改时，旧的解析结果不会再命中
+        for key in [key for key in _PARSED_FILE_CACHE if key[0] == cache_key[0]]:
+            del _PARSED_FILE_CACHE[key]
+            _parsed_file_cache_bytes -= key[2]
+        _PARSED_FILE_CACHE[cache_key] = data
+        _parsed_file_cache_bytes += cache_key[2]
+        while _parsed_file_cache_bytes > _PARSED_FILE_CACHE_MAX_BYTES:
+            key, _ = _PARSED_FILE_CACHE.popitem(last=False)
+            _parsed_file_cache_bytes -= key[2]
+
+
+def _dump_json_bytes(data: Any, pretty: bool = True) -> bytes:
+    """
+    把数据序列化为不转义非ASCII字符的UTF-8 JSON字节串
+    
+    Args:
+        data: 要序列化的数据
+        pretty: 是否缩进2格；只给程序读取的文件可以关闭，序列化更快、文件更小
+        
+    Returns:
+        序列化后的字节串
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _write_bytes_atomic(output_file: str, payload: bytes, fsync: bool = False) -> None:
+    """
+    先写入同目录下的临时文件再替换目标文件，读取方不会看到写了一半的文件
+    
+    Args:
+        output_file: 输出文件路径
+        payload: 要写入的字节串
+        fsync: 替换前是否把临时文件同步到磁盘（进程或系统崩溃后仍保证文件完整）
+    """
+    tmp_file = f"{output_file}.tmp"
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(payload)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, output_file)
+    except BaseException:
+        # 写入失败时清理临时文件，原输出文件保持不变
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def _ensure_dir(output_file: str) -> None:
+    """
+    确保输出文件所在目录存在
+    
+    每次都检查一次：目录可能在两次保存之间被删除（例如在文件管理页删除文件夹），
+    不能缓存"已创建"的结果。
+    
+    Args:
+        output_file: 输出文件路径
+    """
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
 
 class DataLoader:
     """
     数据加载器，用于加载和处理数据集
     """
-    def __init__(self, input_path: str):
+    def __init__(self, input_path: str, data: Optional[List[Dict[str, Any]]] = None, file_paths: Optional[List[str]] = None):
         """
         初始化数据加载器
         
         Args:
             input_path: 数据集文件路径或文件夹路径
+            data: 已加载的数据，提供时不再读取文件
+            file_paths: 数据对应的文件路径列表，仅在提供data时使用
         """
         self.input_path = input_path
         self.data = []
         self.file_paths = []
-        self.load_data()
+        # 每个文件各自的数据，便于按文件分别生成时复用
+        self.data_by_file: Dict[str, List[Dict[str, Any]]] = {}
+        # 加载失败的文件及对应的错误信息
+        self.load_errors: Dict[str, str] = {}
+        self._sample_lock = threading.Lock()
+        
+        if data is not None:
+            self.data = data
+            self.file_paths = file_paths if file_paths is not None else [input_path]
+            if len(self.file_paths) == 1:
+                self.data_by_file = {self.file_paths[0]: data}
+        else:
+            self.load_data()
+        self._reset_sampler()
+    
+    def _reset_sampler(self) -> None:
+        """
+        重建随机抽样用的洗牌索引
+        """
+        self._n = len(self.data)
+        self._idx = np.arange(self._n, dtype=np.int64)
+        np.random.shuffle(self._idx)
+        self._cursor = 0
     
     def load_data(self) -> None:
         """
@@ -37,8 +201,12 @@ class DataLoader:
             # 单个文件
             self.file_paths = [self.input_path]
         elif os.path.isdir(self.input_path):
-            # 文件夹，查找所有JSON文件
-            json_files = glob.glob(os.path.join(self.input_path, "*.json"))
+            # 文件夹，查找所有JSON文件（与glob一致，忽略隐藏文件）
+            with os.scandir(self.input_path) as entries:
+                json_files = [
+                    entry.path for entry in entries
+                    if entry.name.endswith('.json') and not entry.name.startswith('.') and entry.is_file()
+                ]
             if not json_files:
                 raise FileNotFoundError(f"文件夹中未找到JSON文件: {self.input_path}")
             self.file_paths = json_files
@@ -46,26 +214,27 @@ class DataLoader:
         else:
             raise ValueError(f"输入路径既不是文件也不是文件夹: {self.input_path}")
         
-        # 加载所有文件的数据
-        all_data = []
-        for file_path in self.file_paths:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    file_data = json.load(f)
-                    if isinstance(file_data, list):
-                        all_data.extend(file_data)
-                        # 成功加载数据
-                    else:
-                        all_data.append(file_data)
-                        # 成功加载数据
-            except Exception as e:
-                # 加载文件失败
-                continue
+        # 并发加载所有文件的数据（磁盘读取与JSON解析相互重叠），结果保持文件顺序
+        data_by_file = {}
+        load_errors = {}
+        max_workers = min(16, len(self.file_paths))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for file_path, (file_data, error) in zip(self.file_paths, executor.map(_load_json_file, self.file_paths)):
+                if error is not None:
+                    load_errors[file_path] = error
+                    continue
+                data_by_file[file_path] = file_data
         
+        self.load_errors = load_errors
+        
+        # 所有文件加载完成后一次性合并，避免逐个文件extend造成的反复扩容
+        all_data = list(chain.from_iterable(data_by_file.values()))
         if not all_data:
-            raise Exception("未能加载任何有效数据")
+            details = "; ".join(f"{os.path.basename(path)}: {error}" for path, error in load_errors.items())
+            raise Exception(f"未能加载任何有效数据{'（' + details + '）' if details else ''}")
         
         self.data = all_data
+        self.data_by_file = data_by_file
         # 总共成功加载数据集
     
     def get_random_samples(self, min_samples: int = 3, max_samples: int = 6) -> List[Dict[str, Any]]:
@@ -89,8 +258,17 @@ class DataLoader:
         # 随机确定样本数量
         sample_count = random.randint(min_samples, max_samples)
         
-        # 随机选择样本
-        return random.sample(self.data, sample_count)
+        # 从洗牌后的索引中顺序截取，一轮用完后重新洗牌（每轮内不重复抽样）
+        with self._sample_lock:
+            if self._n != len(self.data):
+                self._reset_sampler()
+            if self._cursor + sample_count > self._n:
+                np.random.shuffle(self._idx)
+                self._cursor = 0
+            selected = self._idx[self._cursor:self._cursor + sample_count].tolist()
+            self._cursor += sample_count
+        
+        return [self.data[i] for i in selected]
     
     def format_examples(self, examples: List[Dict[str, Any]]) -> str:
         """
@@ -102,14 +280,13 @@ class DataLoader:
         Returns:
             格式化后的示例字符串
         """
-        formatted = ""
-        for i, example in enumerate(examples):
-            formatted += f"示例 {i+1}:\n"
-            formatted += f"instruction: {example.get('instruction', '')}\n"
-            formatted += f"input: {example.get('input', '')}\n"
-            formatted += f"output: {example.get('output', '')}\n\n"
-        
-        return formatted
+        return "".join([
+            f"示例 {i+1}:\n"
+            f"instruction: {example.get('instruction', '')}\n"
+            f"input: {example.get('input', '')}\n"
+            f"output: {example.get('output', '')}\n\n"
+            for i, example in enumerate(examples)
+        ])
     
     def save_data(self, data: List[Dict[str, Any]], output_file: str) -> None:
         """
@@ -121,10 +298,10 @@ class DataLoader:
         """
         try:
             # 确保输出目录存在
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            _ensure_dir(output_file)
             
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # 直接写入序列化好的字节，省去文本模式的编码开销；通过临时文件原子替换
+            _write_bytes_atomic(output_file, _dump_json_bytes(data))
             
             # 成功保存数据
         except Exception as e:
@@ -4,17 +4,31 @@
 定义数据集生成的通用接口和共享功能
 """
 
+import asyncio
 import json
 import os
 import random
+import re
+import string
+import threading
 import time
 from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ..data_loader import DataLoader
-from ..model_caller import ModelCaller
+from ..model_caller import ModelCaller, extract_content_between_backticks
+from ..checkpoint_writer import CheckpointWriter
+from ..rate_limiter import TokenBucket
+
+# 尝试导入orjson，如果不可用则使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # 尝试导入streamlit，如果不可用则使用None
 try:
@@ -23,18 +37,79 @@ except ImportError:
     st = None
 
 
+# 匹配每一个用三个反引号包裹的代码块（批量生成时每个instruction各自包裹）
+_FENCED_BLOCK_PATTERN = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+
+
+@lru_cache(maxsize=64)
+def _compile_template(template: str):
+    """
+    预编译提示模板，返回按字段名填充模板的函数
+
+    模板只在首次使用时解析一次，之后每次填充只需拼接预先切分好的文本片段，
+    无需像str.format那样在每个样本上重新解析占位符。
+    含有格式说明、转换标记或属性/下标访问的模板退回使用str.format，行为保持一致。
+
+    Args:
+        template: 提示模板
+
+    Returns:
+        以关键字参数填充模板的函数
+    """
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError:
+        # 模板格式有误，交给str.format在调用时抛出相同的错误
+        return template.format
+
+    # literals比fields多一个元素：literals[i]位于fields[i]之前，最后一个是结尾文本
+    literals = []
+    fields = []
+    pending = ""
+    for literal, field_name, format_spec, conversion in parsed:
+        pending += literal
+        if field_name is None:
+            continue
+        if format_spec or conversion or not field_name.isidentifier():
+            return template.format
+        literals.append(pending)
+        fields.append(field_name)
+        pending = ""
+    literals.append(pending)
+
+    def render(**kwargs) -> str:
+        parts = []
+        for literal, field_name in zip(literals, fields):
+            parts.append(literal)
+            parts.append(str(kwargs[field_name]))
+        parts.append(literals[-1])
+        return "".join(parts)
+
+    return render
+
+
 class BaseDatasetGenerator(ABC):
     """
     数据集生成器基类
     定义通用接口和共享功能
     """
+    # 预先格式化的示例池大小
+    EXAMPLE_POOL_SIZE = 256
+    
+    # 一次生成过程中Streamlit进度条最多刷新的次数
+    MAX_PROGRESS_UPDATES = 200
+    
+    # 解析instruction时需要过滤的非instruction行（解释性文本、多余的 'json' 标识符或代码块标记）
+    _FILTER_RE = re.compile(r'^\s*(?:示例|以下是|这是|json|```)', re.IGNORECASE)
     
     def __init__(
         self,
         model_caller: ModelCaller,
         data_loader: DataLoader,
         sample_min: int = 3,
-        sample_max: int = 6
+        sample_max: int = 6,
+        rps: float = 10.0,
+        instruction_batch: int = 16
     ):
         """
         初始化基础数据集生成器
@@ -44,11 +119,36 @@ class BaseDatasetGenerator(ABC):
             data_loader: 数据加载器
             sample_min: 最少示例数量
             sample_max: 最多示例数量
+            rps: 每秒最多发起的模型请求数，小于等于0表示不限流
+            instruction_batch: 完整模式下每次请求批量生成的instruction数量
         """
         self.model_caller = model_caller
         self.data_loader = data_loader
         self.sample_min = sample_min
         self.sample_max = sample_max
+        self.rps = rps
+        self.instruction_batch = max(1, instruction_batch)
+        
+        # 并发模式下单个样本的超时时间（秒），为None时不限制
+        self.sample_timeout: Optional[float] = None
+        
+        # 批量生成的instruction队列，供后续样本依次取用
+        self._instruction_queue = deque()
+        self._instruction_lock = threading.Lock()
+        # 补充队列时只允许一个请求在途，其余调用方等待后直接从队列取用
+        self._instruction_refill_lock = threading.Lock()
+        self._instruction_refill_task: Optional[asyncio.Future] = None
+        # 本次生成还需要的instruction数量，补充队列时最多请求这么多；None表示不限制
+        self._instructions_needed: Optional[int] = None
+        
+        # 预先格式化的示例池，首次使用时构建
+        self._example_pool: List[str] = []
+        self._example_pool_lock = threading.Lock()
+        
+        # 令牌桶限流：由模型调用器在每次请求前获取令牌，只在请求过快或收到429时等待
+        self._bucket = TokenBucket(rps)
+        if getattr(model_caller, 'rate_limiter', None) is None:
+            model_caller.rate_limiter = self._bucket
     
     @abstractmethod
     def generate_sample(self, **kwargs) -> Dict[str, Any]:
@@ -60,6 +160,15 @@ class BaseDatasetGenerator(ABC):
         """
         pass
     
+    async def agenerate_sample(self, **kwargs) -> Dict[str, Any]:
+        """
+        异步生成单个样本，默认在线程中调用同步的generate_sample，子类可覆盖为原生异步实现
+        
+        Returns:
+            生成的样本数据
+        """
+        return await asyncio.to_thread(self.generate_sample, **kwargs)
+    
     @abstractmethod
     def get_dataset_format_description(self) -> str:
         """
@@ -119,6 +228,7 @@ class BaseDatasetGenerator(ABC):
         串行生成数据集
         """
         generated_data = []
+        self._set_instructions_needed(num_samples)
         
         # 设置进度描述
         desc = f"生成{self.get_dataset_format_description()}数据集"
@@ -130,37 +240,43 @@ class BaseDatasetGenerator(ABC):
             progress_bar = st.progress(0)
             status_text = st.empty()
         
+        # 后台线程逐条写入检查点，避免反复重写整个数据集
+        checkpoint_writer = CheckpointWriter(output_file)
+        checkpoint_writer.start()
+        
+        # 每隔ui_stride个样本刷新一次进度条，减少Streamlit消息数量
+        ui_stride = max(1, num_samples // self.MAX_PROGRESS_UPDATES)
+        
         # 使用tqdm显示终端进度
-        for i in tqdm(range(num_samples), desc=desc):
-            try:
-                # 更新Streamlit进度条
-                if progress_bar is not None:
-                    progress = (i + 1) / num_samples
-                    progress_bar.progress(progress)
-                    status_text.text(f"{desc}: {i + 1}/{num_samples} ({progress:.1%})")
-                
-                # 生成样本
-                sample = self.generate_sample(**kwargs)
-                generated_data.append(sample)
-                
-                # 每生成10个样本保存一次，防止中途失败
-                if (i + 1) % 10 == 0:
-                    self.data_loader.save_data(generated_data, output_file)
-                
-                # 添加随机延迟，避免频繁请求
-                time.sleep(random.uniform(0.5, 2.0))
-                
-            except Exception as e:
-                # 生成样本时出错
-                continue
+        try:
+            for i in tqdm(range(num_samples), desc=desc):
+                try:
+                    # 更新Streamlit进度条
+                    if progress_bar is not None and (i % ui_stride == 0 or i + 1 == num_samples):
+                        progress = (i + 1) / num_samples
+                        progress_bar.progress(progress)
+                        status_text.text(f"{desc}: {i + 1}/{num_samples} ({progress:.1%})")
+                    
+                    # 生成样本
+                    sample = self.generate_sample(**kwargs)
+                    generated_data.append(sample)
+                    checkpoint_writer.submit(sample)
+                    
+                except Exception as e:
+                    # 生成样本时出错
+                    continue
+        except BaseException:
+            # 被用户中断时停止写入线程，保留已写入的检查点文件
+            checkpoint_writer.close()
+            raise
         
         # 完成进度条
         if progress_bar is not None:
             progress_bar.progress(1.0)
             status_text.text(f"{desc}: 完成 ({len(generated_data)}/{num_samples})")
         
-        # 最终保存
-        self.data_loader.save_data(generated_data, output_file)
+        # 最终保存：把检查点整理为JSON数组写入输出文件
+        checkpoint_writer.finalize(output_file)
         
         return generated_data
     
@@ -174,6 +290,21 @@ class BaseDatasetGenerator(ABC):
         """
         并发生成数据集，确保请求结果与内容一一对应
         """
+        self._set_instructions_needed(num_samples)
+        return self._run_async(
+            self._agenerate_dataset(num_samples, output_file, concurrency, **kwargs)
+        )
+    
+    async def _agenerate_dataset(
+        self,
+        num_samples: int,
+        output_file: str,
+        concurrency: int = 3,
+        **kwargs
+    ) -> List[Dict[str, Any]]:
+        """
+        基于asyncio并发生成数据集，同一时刻最多有concurrency个样本在生成
+        """
         generated_data = [None] * num_samples  # 预分配列表，保持顺序
         
         # 设置进度描述
@@ -187,45 +318,45 @@ class BaseDatasetGenerator(ABC):
             status_text = st.empty()
         
         completed_count = 0
+        # 每完成ui_stride个样本刷新一次进度条，减少Streamlit消息数量
+        ui_stride = max(1, num_samples // self.MAX_PROGRESS_UPDATES)
         
-        def generate_single_sample(index: int) -> tuple:
+        async def generate_single_sample(index: int) -> tuple:
             """
             生成单个样本，返回索引和样本数据以保持顺序
             """
             try:
-                sample = self.generate_sample(**kwargs)
+                sample = await asyncio.wait_for(self.agenerate_sample(**kwargs), self.sample_timeout)
                 return index, sample
+            except asyncio.TimeoutError:
+                # 超时的样本直接放弃（其模型请求随之取消），计为失败
+                return index, None
             except Exception as e:
                 # 生成样本时出错
                 return index, None
         
-        # 使用ThreadPoolExecutor进行并发生成
-        with ThreadPoolExecutor(max_workers=concurrency) as executor:
-            # 提交所有任务
-            future_to_index = {
-                executor.submit(generate_single_sample, i): i 
-                for i in range(num_samples)
-            }
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_index):
-                index, sample = future.result()
+        # 后台线程逐条写入检查点，避免每10个样本重新扫描并重写整个数据集
+        checkpoint_writer = CheckpointWriter(output_file)
+        checkpoint_writer.start()
+        
+        # 处理完成的任务
+        try:
+            async for index, sample in self._aiter_completed(generate_single_sample, num_samples, concurrency):
                 if sample is not None:
                     generated_data[index] = sample
+                    checkpoint_writer.submit(sample)
                 
                 completed_count += 1
                 
                 # 更新进度条
-                if progress_bar is not None:
+                if progress_bar is not None and (completed_count % ui_stride == 0 or completed_count == num_samples):
                     progress = completed_count / num_samples
                     progress_bar.progress(progress)
                     status_text.text(f"{desc}: {completed_count}/{num_samples} ({progress:.1%})")
-                
-                # 每完成10个样本保存一次（只保存非None的样本）
-                if completed_count % 10 == 0:
-                    valid_data = [sample for sample in generated_data if sample is not None]
-                    if valid_data:
-                        self.data_loader.save_data(valid_data, output_file)
+        except BaseException:
+            # 被取消或中断时（未完成的任务已取消）停止写入线程，保留已写入的检查点文件
+            checkpoint_writer.close()
+            raise
         
         # 过滤掉None值，保持原有顺序
         final_data = [sample for sample in generated_data if sample is not None]
@@ -235,12 +366,55 @@ class BaseDatasetGenerator(ABC):
             progress_bar.progress(1.0)
             status_text.text(f"{desc}: 完成 ({len(final_data)}/{num_samples})")
         
-        # 最终保存
+        # 最终保存（按原有顺序），随后删除检查点临时文件
         if final_data:
             self.data_loader.save_data(final_data, output_file)
+        checkpoint_writer.finalize()
         
         return final_data
     
+    @staticmethod
+    async def _aiter_completed(func, num_tasks: int, concurrency: int):
+        """
+        以有限并发运行协程任务，按完成顺序产出结果
+        
+        同一时刻最多只有concurrency个任务存在，每完成一个再补充一个，
+        不会一次性为全部样本创建任务。
+        
+        Args:
+            func: 以任务索引为参数的协程函数
+            num_tasks: 任务总数
+            concurrency: 同时运行的最大任务数
+        """
+        pending = set()
+        next_index = 0
+        try:
+            while next_index < num_tasks or pending:
+                while next_index < num_tasks and len(pending) < concurrency:
+                    pending.add(asyncio.create_task(func(next_index)))
+                    next_index += 1
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # 调用方提前退出或被取消时取消尚未完成的任务，并等待其结束以释放连接
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    
+    def _run_async(self, coro):
+        """
+        在新的事件循环中运行协程，结束后关闭模型调用器的异步连接池
+        """
+        async def runner():
+            try:
+                return await coro
+            finally:
+                await self.model_caller.aclose()
+        
+        return asyncio.run(runner())
+    
     def _generate_dataset_for_folder_separate(
         self,
         num_samples: int,
@@ -274,8 +448,11 @@ class BaseDatasetGenerator(ABC):
             overall_status = st.empty()
         
         total_files = len(self.data_loader.file_paths)
+        parent_loader = self.data_loader
+        # 同一批次的输出文件共用一个时间戳
+        run_timestamp = self._get_short_timestamp()
         
-        for file_idx, file_path in enumerate(self.data_loader.file_paths):
+        for file_idx, file_path in enumerate(parent_loader.file_paths):
             try:
                 # 更新总体进度
                 if overall_progress is not None:
@@ -285,14 +462,12 @@ class BaseDatasetGenerator(ABC):
                         f"正在处理文件 {file_idx + 1}/{total_files}: {os.path.basename(file_path)}"
                     )
                 
-                # 为每个文件创建单独的数据加载器和生成器
-                file_loader = DataLoader(file_path)
-                file_generator = self.__class__(
-                    model_caller=self.model_caller,
-                    data_loader=file_loader,
-                    sample_min=self.sample_min,
-                    sample_max=self.sample_max
-                )
+                # 为每个文件创建单独的数据加载器，直接复用已加载的数据，不再重新读取文件
+                source_data = parent_loader.data_by_file.get(file_path)
+                if not source_data:
+                    # 文件加载失败或为空，跳过
+                    continue
+                file_loader = DataLoader(file_path, data=source_data, file_paths=[file_path])
                 
                 # 生成文件名
                 original_filename = os.path.basename(file_path)
@@ -305,26 +480,25 @@ class BaseDatasetGenerator(ABC):
                 else:
                     # 使用默认命名规则
                     file_base_name = os.path.splitext(original_filename)[0]
-                    timestamp = self._get_short_timestamp()
-                    output_filename = f"{file_base_name}_{timestamp}.json"
+                    output_filename = f"{file_base_name}_{run_timestamp}.json"
                 
                 file_output_path = os.path.join(output_dir, output_filename)
                 
                 # 正在为文件生成数据集
                 
-                # 生成数据
-                if concurrency > 1:
-                    file_data = file_generator._generate_dataset_concurrent(
-                        num_samples, file_output_path, concurrency, **kwargs
-                    )
-                else:
-                    file_data = file_generator._generate_dataset_sequential(
-                        num_samples, file_output_path, **kwargs
-                    )
+                # 生成数据（生成过程中已写入file_output_path）
+                with self._swap_loader(file_loader):
+                    if concurrency > 1:
+                        file_data = self._generate_dataset_concurrent(
+                            num_samples, file_output_path, concurrency, **kwargs
+                        )
+                    else:
+                        file_data = self._generate_dataset_sequential(
+                            num_samples, file_output_path, **kwargs
+                        )
                 
-                # 保存单个文件的结果
+                # 记录单个文件的结果
                 if file_data:
-                    file_loader.save_data(file_data, file_output_path)
                     all_generated_data.extend(file_data)
                     
                     # 记录文件结果
@@ -351,6 +525,24 @@ class BaseDatasetGenerator(ABC):
             'file_results': file_results
         }
     
+    @contextmanager
+    def _swap_loader(self, data_loader: DataLoader):
+        """
+        临时替换数据加载器（同时清空示例池和instruction队列），退出时恢复
+        
+        分别生成模式下用当前实例依次处理每个文件，无需为每个文件重新构造生成器。
+        替换期间不应在其他线程中使用同一个生成器实例。
+        
+        Args:
+            data_loader: 临时使用的数据加载器
+        """
+        saved = (self.data_loader, self._example_pool, self._instruction_queue)
+        self.data_loader, self._example_pool, self._instruction_queue = data_loader, [], deque()
+        try:
+            yield self
+        finally:
+            self.data_loader, self._example_pool, self._instruction_queue = saved
+    
     def _get_short_timestamp(self) -> str:
         """
         获取短时间戳
@@ -369,6 +561,195 @@ class BaseDatasetGenerator(ABC):
         """
         return self.data_loader.get_random_samples(self.sample_min, self.sample_max)
     
+    def _resolve_instruction(self, instruction: Optional[str]) -> str:
+        """
+        固定指令模式下确定要使用的instruction
+        
+        Args:
+            instruction: 固定的指令，如果为None或空字符串则从原始数据集中随机选择
+            
+        Returns:
+            要使用的instruction
+        """
+        # 如果没有提供instruction或instruction为空字符串，从原始数据集中随机选择一个
+        if not instruction or not instruction.strip():
+            sample = self.get_random_examples()[0]
+            instruction = sample.get('instruction', '')
+            if not instruction:
+                raise ValueError("原始数据集中没有找到有效的instruction")
+        return instruction
+    
+    def _set_instructions_needed(self, num_samples: int) -> None:
+        """
+        记录本次生成还需要的instruction数量，补充队列时不会请求超过这个数量
+        
+        Args:
+            num_samples: 本次要生成的样本数量
+        """
+        with self._instruction_lock:
+            self._instructions_needed = num_samples
+    
+    def _instruction_refill_size(self) -> int:
+        """
+        计算补充队列时请求的instruction数量：不超过instruction_batch，也不超过剩余需要的数量
+        """
+        with self._instruction_lock:
+            needed = self._instructions_needed
+        if needed is None:
+            return self.instruction_batch
+        return max(1, min(self.instruction_batch, needed))
+    
+    def _take_queued_instruction(self) -> Optional[str]:
+        """
+        从队列取出一个instruction，队列为空时返回None
+        """
+        with self._instruction_lock:
+            if self._instruction_queue:
+                if self._instructions_needed:
+                    self._instructions_needed -= 1
+                return self._instruction_queue.popleft()
+        return None
+    
+    def _queue_instructions(self, instructions: List[str]) -> None:
+        """
+        把生成的instructions放入队列
+        """
+        if not instructions:
+            raise ValueError("生成instruction失败")
+        with self._instruction_lock:
+            self._instruction_queue.extend(instructions)
+    
+    def _next_instruction(self) -> str:
+        """
+        获取下一个instruction，队列为空时调用子类的generate_instructions批量补充
+        
+        同一时间只有一个线程补充队列，其余线程等待补充完成后直接从队列取用。
+        """
+        while True:
+            instruction = self._take_queued_instruction()
+            if instruction is not None:
+                return instruction
+            with self._instruction_refill_lock:
+                # 等待锁期间其他线程可能已经补充了队列
+                if not self._instruction_queue:
+                    self._queue_instructions(self.generate_instructions(self._instruction_refill_size()))
+    
+    async def _anext_instruction(self) -> str:
+        """
+        异步获取下一个instruction，队列为空时调用子类的agenerate_instructions批量补充
+        
+        同一时间只有一个补充任务在途，其余协程等待该任务完成后直接从队列取用。
+        """
+        while True:
+            instruction = self._take_queued_instruction()
+            if instruction is not None:
+                return instruction
+            task = self._instruction_refill_task
+            if task is None or task.done():
+                task = asyncio.ensure_future(self._arefill_instructions())
+                self._instruction_refill_task = task
+            # 某个等待方被取消时不影响共享的补充任务
+            await asyncio.shield(task)
+    
+    async def _arefill_instructions(self) -> None:
+        """
+        异步批量生成instructions并放入队列
+        """
+        self._queue_instructions(await self.agenerate_instructions(self._instruction_refill_size()))
+    
+    def _parse_instructions(self, response: str, num_to_generate: int) -> List[str]:
+        """
+        从模型响应中解析instructions
+        
+        Args:
+            response: 模型响应
+            num_to_generate: 要生成的instruction数量
+            
+        Returns:
+            解析出的instruction列表
+        """
+        instructions = []
+        
+        # 尝试从三个反引号中提取内容
+        extracted = extract_content_between_backticks(response)
+        
+        # 多个代码块时，每个代码块视为一个 instruction
+        blocks = [block for block in _FENCED_BLOCK_PATTERN.findall(response) if block]
+        if len(blocks) > 1:
+            instructions.extend(dict.fromkeys(blocks))
+        elif extracted:
+            try:
+                # 尝试将提取的内容解析为 JSON 数组
+                parsed_json = self._loads(extracted)
+                if isinstance(parsed_json, list):
+                    # 如果是列表，则每个元素视为一个 instruction
+                    instructions.extend([str(item).strip() for item in parsed_json if str(item).strip()])
+                elif isinstance(parsed_json, str):
+                    # 如果是字符串，按行分割
+                    lines = [line.strip() for line in parsed_json.split('\n') if line.strip()]
+                    instructions.extend(lines)
+                else:
+                    # 其他类型直接转换为字符串
+                    instructions.append(str(parsed_json).strip())
+            except json.JSONDecodeError:
+                # 如果不是有效的 JSON，则按行分割
+                lines = [line.strip() for line in extracted.split('\n') if line.strip()]
+                instructions.extend(lines)
+        
+        # 如果提取后仍然没有足够的 instructions，或者模型直接返回了非反引号包裹的内容
+        if not instructions or len(instructions) < num_to_generate:
+            # 再次尝试直接处理原始响应
+            raw_lines = [line for line in map(str.strip, response.splitlines()) if line]
+            seen = set(instructions)
+            for line in raw_lines:
+                # 过滤掉可能的非 instruction 行，并避免重复添加
+                if line not in seen and self._FILTER_RE.match(line) is None:
+                    instructions.append(line)
+                    seen.add(line)
+        
+        # 确保返回指定数量的instructions
+        return instructions[:num_to_generate]
+    
+    @staticmethod
+    def _loads(text: str) -> Any:
+        """
+        解析JSON文本，优先使用orjson
+        
+        Raises:
+            json.JSONDecodeError: 文本不是有效的JSON（orjson的解析异常同样是其子类）
+        """
+        if orjson is not None:
+            return orjson.loads(text)
+        return json.loads(text)
+    
+    @staticmethod
+    def _dumps(data: Any) -> bytes:
+        """
+        把数据序列化为紧凑的UTF-8 JSON字节串（不缩进），优先使用orjson
+        """
+        if orjson is not None:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    
+    def get_formatted_examples(self) -> str:
+        """
+        获取格式化后的随机示例
+        
+        首次调用时预先抽样并格式化EXAMPLE_POOL_SIZE组示例，之后直接从池中随机选取，
+        避免每次模型调用都重新抽样和拼接字符串。
+        
+        Returns:
+            格式化后的示例字符串
+        """
+        if not self._example_pool:
+            with self._example_pool_lock:
+                if not self._example_pool:
+                    self._example_pool = [
+                        self.format_examples(self.get_random_examples())
+                        for _ in range(self.EXAMPLE_POOL_SIZE)
+                    ]
+        return random.choice(self._example_pool)
+    
     def format_examples(self, examples: List[Dict[str, Any]]) -> str:
         """
         格式化示例
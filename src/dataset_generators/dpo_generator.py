@@ -7,7 +7,7 @@ DPO（直接偏好优化）数据集生成器
 import json
 from typing import List, Dict, Any, Optional
 
-from .base_generator import BaseDatasetGenerator
+from .base_generator import BaseDatasetGenerator, _compile_template
 from ..model_caller import extract_content_between_backticks
 
 
@@ -30,6 +30,19 @@ class DPODatasetGenerator(BaseDatasetGenerator):
     ]
     """
     
+    # 合并生成时追加在instruction提示词之后的输出要求
+    FUSED_OUTPUT_REQUIREMENT = """
+
+请只生成1条数据，并同时给出该指令对应的输入、优质回答和劣质回答。
+劣质回答应看似合理，但在准确性、完整性或有用性上明显不如优质回答。
+请严格按照以下JSON格式输出，并用```json```包裹：
+```json
+{"instruction": "指令", "input": "输入（可为空字符串）", "chosen": "优质回答", "rejected": "劣质回答"}
+```"""
+    
+    # 合并生成结果必须包含的字段
+    FUSED_FIELDS = ("instruction", "input", "chosen", "rejected")
+    
     def __init__(
         self,
         model_caller,
@@ -39,7 +52,10 @@ class DPODatasetGenerator(BaseDatasetGenerator):
         chosen_prompt: str,
         rejected_prompt: str,
         sample_min: int = 3,
-        sample_max: int = 6
+        sample_max: int = 6,
+        rps: float = 10.0,
+        instruction_batch: int = 16,
+        fused: bool = False
     ):
         """
         初始化DPO数据集生成器
@@ -53,12 +69,17 @@ class DPODatasetGenerator(BaseDatasetGenerator):
             rejected_prompt: 生成rejected（劣质回答）的提示模板
             sample_min: 最少示例数量
             sample_max: 最多示例数量
+            rps: 每秒最多发起的模型请求数，小于等于0表示不限流
+            instruction_batch: 完整模式下每次请求批量生成的instruction数量
+            fused: 完整模式下是否先尝试用一次模型调用同时生成instruction、input、chosen和rejected，
+                解析失败时回退为逐步生成
         """
-        super().__init__(model_caller, data_loader, sample_min, sample_max)
+        super().__init__(model_caller, data_loader, sample_min, sample_max, rps, instruction_batch)
         self.instruction_prompt = instruction_prompt
         self.input_prompt = input_prompt
         self.chosen_prompt = chosen_prompt
         self.rejected_prompt = rejected_prompt
+        self.fused = fused
     
     def get_dataset_format_description(self) -> str:
         """
@@ -84,6 +105,63 @@ class DPODatasetGenerator(BaseDatasetGenerator):
         else:
             raise ValueError(f"不支持的生成模式: {mode}")
     
+    async def agenerate_sample(self, mode: str = "complete", fixed_instruction: Optional[str] = None) -> Dict[str, str]:
+        """
+        异步生成单个DPO样本
+        
+        Args:
+            mode: 生成模式，"complete"为完整模式，"input_output"为固定指令模式
+            fixed_instruction: 固定指令（仅在input_output模式下使用）
+            
+        Returns:
+            包含instruction, input, chosen, rejected的字典
+        """
+        if mode == "complete":
+            return await self.agenerate_complete_sample()
+        elif mode == "input_output":
+            return await self.agenerate_input_output_sample(fixed_instruction)
+        else:
+            raise ValueError(f"不支持的生成模式: {mode}")
+    
+    def _build_instruction_prompt(self, num_to_generate: int) -> str:
+        """
+        构建生成instruction的提示词（含随机示例）
+        """
+        return _compile_template(self.instruction_prompt)(
+            num_to_generate=num_to_generate,
+            examples=self.get_formatted_examples()
+        )
+    
+    def _build_input_prompt(self, instruction: str) -> str:
+        """
+        构建生成input的提示词（含随机示例）
+        """
+        return _compile_template(self.input_prompt)(
+            instruction=instruction,
+            examples=self.get_formatted_examples()
+        )
+    
+    def _build_chosen_prompt(self, instruction: str, input_text: str) -> str:
+        """
+        构建生成chosen的提示词（含随机示例）
+        """
+        return _compile_template(self.chosen_prompt)(
+            instruction=instruction,
+            input=input_text,
+            examples=self.get_formatted_examples()
+        )
+    
+    def _build_rejected_prompt(self, instruction: str, input_text: str, chosen: str) -> str:
+        """
+        构建生成rejected的提示词（含随机示例）
+        """
+        return _compile_template(self.rejected_prompt)(
+            instruction=instruction,
+            input=input_text,
+            chosen=chosen,
+            examples=self.get_formatted_examples()
+        )
+    
     def generate_instructions(self, num_to_generate: int = 1) -> List[str]:
         """
         生成新的instructions
@@ -94,59 +172,21 @@ class DPODatasetGenerator(BaseDatasetGenerator):
         Returns:
             生成的instruction列表
         """
-        # 获取随机示例
-        examples = self.get_random_examples()
-        formatted_examples = self.format_examples(examples)
-        
-        # 构建提示词
-        prompt = self.instruction_prompt.format(
-            num_to_generate=num_to_generate,
-            examples=formatted_examples
-        )
-        
-        # 调用模型生成
-        response = self.model_caller.generate(prompt)
-        
-        # 解析生成的instructions
-        instructions = []
-        
-        # 尝试从三个反引号中提取内容
-        extracted = extract_content_between_backticks(response)
-        
-        if extracted:
-            try:
-                # 尝试将提取的内容解析为 JSON 数组
-                parsed_json = json.loads(extracted)
-                if isinstance(parsed_json, list):
-                    # 如果是列表，则每个元素视为一个 instruction
-                    instructions.extend([str(item).strip() for item in parsed_json if str(item).strip()])
-                elif isinstance(parsed_json, str):
-                    # 如果是字符串，按行分割
-                    lines = [line.strip() for line in parsed_json.split('\n') if line.strip()]
-                    instructions.extend(lines)
-                else:
-                    # 其他类型直接转换为字符串
-                    instructions.append(str(parsed_json).strip())
-            except json.JSONDecodeError:
-                # 如果不是有效的 JSON，则按行分割
-                lines = [line.strip() for line in extracted.split('\n') if line.strip()]
-                instructions.extend(lines)
-        
-        # 如果提取后仍然没有足够的 instructions，或者模型直接返回了非反引号包裹的内容
-        if not instructions or len(instructions) < num_to_generate:
-            # 再次尝试直接处理原始响应
-            raw_lines = [line.strip() for line in response.split('\n') if line.strip()]
-            for line in raw_lines:
-                # 过滤掉可能的非 instruction 行
-                if not line.lower().startswith('示例') and \
-                   not line.lower().startswith('以下是') and \
-                   not line.lower().startswith('这是') and \
-                   not line.lower().startswith('json') and \
-                   line not in instructions:  # 避免重复添加
-                    instructions.append(line)
+        response = self.model_caller.generate(self._build_instruction_prompt(num_to_generate))
+        return self._parse_instructions(response, num_to_generate)
+    
+    async def agenerate_instructions(self, num_to_generate: int = 1) -> List[str]:
+        """
+        异步生成新的instructions
         
-        # 确保返回指定数量的instructions
-        return instructions[:num_to_generate]
+        Args:
+            num_to_generate: 要生成的instruction数量
+            
+        Returns:
+            生成的instruction列表
+        """
+        response = await self.model_caller.agenerate(self._build_instruction_prompt(num_to_generate))
+        return self._parse_instructions(response, num_to_generate)
     
     def generate_input(self, instruction: str) -> str:
         """
@@ -158,20 +198,14 @@ class DPODatasetGenerator(BaseDatasetGenerator):
         Returns:
             生成的input
         """
-        # 获取随机示例
-        examples = self.get_random_examples()
-        formatted_examples = self.format_examples(examples)
-        
-        # 构建提示词
-        prompt = self.input_prompt.format(
-            instruction=instruction,
-            examples=formatted_examples
-        )
-        
-        # 调用模型生成
-        response = self.model_caller.generate(prompt)
-        
-        # 提取生成的input
+        response = self.model_caller.generate(self._build_input_prompt(instruction))
+        return extract_content_between_backticks(response)
+    
+    async def agenerate_input(self, instruction: str) -> str:
+        """
+        异步为给定的instruction生成input
+        """
+        response = await self.model_caller.agenerate(self._build_input_prompt(instruction))
         return extract_content_between_backticks(response)
     
     def generate_chosen(self, instruction: str, input_text: str) -> str:
@@ -185,21 +219,14 @@ class DPODatasetGenerator(BaseDatasetGenerator):
         Returns:
             生成的chosen（优质回答）
         """
-        # 获取随机示例
-        examples = self.get_random_examples()
-        formatted_examples = self.format_examples(examples)
-        
-        # 构建提示词
-        prompt = self.chosen_prompt.format(
-            instruction=instruction,
-            input=input_text,
-            examples=formatted_examples
-        )
-        
-        # 调用模型生成
-        response = self.model_caller.generate(prompt)
-        
-        # 提取生成的chosen
+        response = self.model_caller.generate(self._build_chosen_prompt(instruction, input_text))
+        return extract_content_between_backticks(response)
+    
+    async def agenerate_chosen(self, instruction: str, input_text: str) -> str:
+        """
+        异步为给定的instruction和input生成chosen（优质回答）
+        """
+        response = await self.model_caller.agenerate(self._build_chosen_prompt(instruction, input_text))
         return extract_content_between_backticks(response)
     
     def generate_rejected(self, instruction: str, input_text: str, chosen: str) -> str:
@@ -214,22 +241,14 @@ class DPODatasetGenerator(BaseDatasetGenerator):
         Returns:
             生成的rejected（劣质回答）
         """
-        # 获取随机示例
-        examples = self.get_random_examples()
-        formatted_examples = self.format_examples(examples)
-        
-        # 构建提示词
-        prompt = self.rejected_prompt.format(
-            instruction=instruction,
-            input=input_text,
-            chosen=chosen,
-            examples=formatted_examples
-        )
-        
-        # 调用模型生成
-        response = self.model_caller.generate(prompt)
-        
-        # 提取生成的rejected
+        response = self.model_caller.generate(self._build_rejected_prompt(instruction, input_text, chosen))
+        return extract_content_between_backticks(response)
+    
+    async def agenerate_rejected(self, instruction: str, input_text: str, chosen: str) -> str:
+        """
+        异步为给定的instruction、input和chosen生成rejected（劣质回答）
+        """
+        response = await self.model_caller.agenerate(self._build_rejected_prompt(instruction, input_text, chosen))
         return extract_content_between_backticks(response)
     
     def generate_input_output_sample(self, instruction: Optional[str] = None) -> Dict[str, str]:
@@ -242,12 +261,7 @@ class DPODatasetGenerator(BaseDatasetGenerator):
         Returns:
             包含instruction, input, chosen, rejected的字典
         """
-        # 如果没有提供instruction或instruction为空字符串，从原始数据集中随机选择一个
-        if not instruction or not instruction.strip():
-            sample = self.get_random_examples()[0]
-            instruction = sample.get('instruction', '')
-            if not instruction:
-                raise ValueError("原始数据集中没有找到有效的instruction")
+        instruction = self._resolve_instruction(instruction)
         
         # 生成input
         input_text = self.generate_input(instruction)
@@ -265,6 +279,28 @@ class DPODatasetGenerator(BaseDatasetGenerator):
             "rejected": rejected
         }
     
+    async def agenerate_input_output_sample(self, instruction: Optional[str] = None) -> Dict[str, str]:
+        """
+        异步为给定的instruction生成input、chosen和rejected（固定指令模式）
+        
+        Args:
+            instruction: 固定的指令，如果为None或空字符串则从原始数据集中随机选择
+            
+        Returns:
+            包含instruction, input, chosen, rejected的字典
+        """
+        instruction = self._resolve_instruction(instruction)
+        input_text = await self.agenerate_input(instruction)
+        chosen = await self.agenerate_chosen(instruction, input_text)
+        rejected = await self.agenerate_rejected(instruction, input_text, chosen)
+        
+        return {
+            "instruction": instruction,
+            "input": input_text,
+            "chosen": chosen,
+            "rejected": rejected
+        }
+    
     def generate_complete_sample(self) -> Dict[str, str]:
         """
         生成完整的DPO样本（instruction, input, chosen, rejected）
@@ -272,11 +308,14 @@ class DPODatasetGenerator(BaseDatasetGenerator):
         Returns:
             包含instruction, input, chosen, rejected的字典
         """
-        # 生成instruction
-        instructions = self.generate_instructions(1)
-        if not instructions:
-            raise ValueError("生成instruction失败")
-        instruction = instructions[0]
+        # 优先尝试一次调用生成完整样本
+        if self.fused:
+            sample = self.generate_fused_sample()
+            if sample is not None:
+                return sample
+        
+        # 从队列获取instruction，队列为空时批量生成
+        instruction = self._next_instruction()
         
         # 生成input
         input_text = self.generate_input(instruction)
@@ -292,4 +331,81 @@ class DPODatasetGenerator(BaseDatasetGenerator):
             "input": input_text,
             "chosen": chosen,
             "rejected": rejected
-        }
\ No newline at end of file
+        }
+    
+    async def agenerate_complete_sample(self) -> Dict[str, str]:
+        """
+        异步生成完整的DPO样本（instruction, input, chosen, rejected）
+        
+        Returns:
+            包含instruction, input, chosen, rejected的字典
+        """
+        if self.fused:
+            sample = await self.agenerate_fused_sample()
+            if sample is not None:
+                return sample
+        
+        instruction = await self._anext_instruction()
+        
+        input_text = await self.agenerate_input(instruction)
+        chosen = await self.agenerate_chosen(instruction, input_text)
+        rejected = await self.agenerate_rejected(instruction, input_text, chosen)
+        
+        return {
+            "instruction": instruction,
+            "input": input_text,
+            "chosen": chosen,
+            "rejected": rejected
+        }
+    
+    def _build_fused_prompt(self) -> str:
+        """
+        构建合并生成的提示词：instruction提示模板（含随机示例）加上JSON输出要求
+        """
+        return self._build_instruction_prompt(1) + self.FUSED_OUTPUT_REQUIREMENT
+    
+    def generate_fused_sample(self) -> Optional[Dict[str, str]]:
+        """
+        用一次模型调用同时生成instruction、input、chosen和rejected
+        
+        以instruction提示模板（含随机示例）为基础，追加JSON输出要求，
+        省去逐步生成时的另外三次模型往返。
+        
+        Returns:
+            包含instruction, input, chosen, rejected的字典；响应无法解析或缺少字段时返回None
+        """
+        return self._parse_fused_sample(self.model_caller.generate(self._build_fused_prompt()))
+    
+    async def agenerate_fused_sample(self) -> Optional[Dict[str, str]]:
+        """
+        异步用一次模型调用同时生成instruction、input、chosen和rejected
+        """
+        return self._parse_fused_sample(await self.model_caller.agenerate(self._build_fused_prompt()))
+    
+    def _parse_fused_sample(self, response: str) -> Optional[Dict[str, str]]:
+        """
+        解析合并生成的响应
+        
+        Returns:
+            包含instruction, input, chosen, rejected的字典；响应无法解析或缺少字段时返回None
+        """
+        extracted = extract_content_between_backticks(response)
+        if not extracted:
+            return None
+        
+        try:
+            parsed = self._loads(extracted)
+        except json.JSONDecodeError:
+            return None
+        
+        # 模型可能返回只含一个对象的数组
+        if isinstance(parsed, list) and len(parsed) == 1:
+            parsed = parsed[0]
+        if not isinstance(parsed, dict):
+            return None
+        
+        sample = {field: str(parsed.get(field) or "").strip() for field in self.FUSED_FIELDS}
+        # input可以为空，其余字段必须有内容
+        if not (sample["instruction"] and sample["chosen"] and sample["rejected"]):
+            return None
+        return sample
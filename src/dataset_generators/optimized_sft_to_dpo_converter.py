@@ -4,16 +4,29 @@
 支持断点续传和内存优化功能
 """
 
-import json
+import logging
+import mmap
 import os
+import threading
 import time
-from typing import List, Dict, Any, Optional
+from contextlib import contextmanager, suppress
+from functools import partial
+from itertools import islice
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Callable
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
 from .sft_to_dpo_converter import SFTToDPOConverter
-from ..data_loader import DataLoader
+from ..data_loader import DataLoader, _dump_json_bytes, _ensure_dir, _write_bytes_atomic
+from ..checkpoint_writer import CheckpointWriter
 from ..model_caller import ModelCaller
+from ..progress_publisher import ProgressPublisher
+
+# 尝试导入orjson，可用时直接解析内存映射文件的切片，不必复制出每一行
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # 尝试导入streamlit，如果不可用则使用None
 try:
@@ -21,6 +34,17 @@ try:
 except ImportError:
     st = None
 
+# 尝试导入ijson，可用时流式解析JSON数组文件，避免一次性把整个文件读入内存
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+# 可能出现在空行中的空白字节，以这些字节开头的行才需要进一步判断是否为空行
+_BLANK_BYTES = b' \t\r\x0b\x0c'
+
 
 class OptimizedSFTToDPOConverter(SFTToDPOConverter):
     """
@@ -56,6 +80,10 @@ class OptimizedSFTToDPOConverter(SFTToDPOConverter):
         super().__init__(model_caller, data_loader, rejected_prompt, sample_min, sample_max)
         self.checkpoint_dir = checkpoint_dir
         os.makedirs(self.checkpoint_dir, exist_ok=True)
+        # 每个检查点最近一次写入的槽位（0或1），两个槽位交替写入
+        self._checkpoint_slots: Dict[str, int] = {}
+        # 多个工作线程可能同时记录转换失败的样本
+        self._failure_lock = threading.Lock()
     
     def _get_checkpoint_path(self, output_file: str) -> str:
         """获取检查点文件路径"""
@@ -63,27 +91,135 @@ class OptimizedSFTToDPOConverter(SFTToDPOConverter):
         return os.path.join(self.checkpoint_dir, f"{base_name}_checkpoint.json")
     
     def _save_checkpoint(self, checkpoint_path: str, data: Dict[str, Any]):
-        """保存检查点"""
-        with open(checkpoint_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        """
+        保存检查点
+        
+        交替写入 `<检查点>.0` 和 `<检查点>.1` 两个槽位，每次都先写临时文件并同步到磁盘再替换，
+        写入过程中崩溃时另一个槽位仍保留上一份完整的检查点。
+        """
+        slot = self._checkpoint_slots.get(checkpoint_path, 1) ^ 1
+        _write_bytes_atomic(f"{checkpoint_path}.{slot}", self._dumps(data), fsync=True)
+        self._checkpoint_slots[checkpoint_path] = slot
     
     def _load_checkpoint(self, checkpoint_path: str) -> Optional[Dict[str, Any]]:
-        """加载检查点"""
-        if os.path.exists(checkpoint_path):
+        """
+        加载检查点，从两个槽位（以及旧版的单文件检查点）中选出能正常解析且进度最新的一份
+        """
+        latest = None
+        latest_slot = None
+        for slot, path in ((None, checkpoint_path), (0, f"{checkpoint_path}.0"), (1, f"{checkpoint_path}.1")):
             try:
-                with open(checkpoint_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(path, 'rb') as f:
+                    checkpoint = self._loads(f.read())
+            except FileNotFoundError:
+                continue
             except Exception as e:
-                print(f"加载检查点失败: {e}")
-        return None
+                logger.warning("加载检查点失败: %s", e)
+                continue
+            if latest is None or checkpoint.get('completed_count', 0) > latest.get('completed_count', 0):
+                latest = checkpoint
+                latest_slot = slot
+        
+        # 下次写入另一个槽位，保留当前最新的检查点
+        if latest_slot is not None:
+            self._checkpoint_slots[checkpoint_path] = latest_slot
+        return latest
+    
+    def _open_sft_records(self, sft_file_path: str) -> Tuple[int, Callable[[int], Iterator[Dict[str, Any]]]]:
+        """
+        打开SFT数据集，返回样本总数和从指定序号开始逐条产出样本的函数
+        
+        .jsonl文件每行一条样本，逐行解析；.json文件在ijson可用时流式解析，
+        否则一次性加载整个JSON数组。
+        
+        Args:
+            sft_file_path: SFT数据集文件路径
+            
+        Returns:
+            (样本总数, 以起始序号为参数、返回剩余样本迭代器的函数)
+        """
+        if sft_file_path.endswith('.jsonl'):
+            # 只统计非空行，不解析内容
+            with self._map_file(sft_file_path) as mm:
+                total_count = sum(1 for _ in self._iter_jsonl_spans(mm))
+            return total_count, partial(self._iter_jsonl_records, sft_file_path)
+        
+        if ijson is not None:
+            with open(sft_file_path, 'rb') as f:
+                total_count = sum(1 for _ in ijson.items(f, 'item'))
+            if total_count == 0:
+                # 空数组或顶层不是数组，重新完整解析以给出准确的错误
+                self._load_json_array(sft_file_path)
+            return total_count, lambda start_index: islice(self._iter_json_array_records(sft_file_path), start_index, None)
+        
+        sft_data = self._load_json_array(sft_file_path)
+        return len(sft_data), lambda start_index: islice(sft_data, start_index, None)
+    
+    def _iter_jsonl_records(self, sft_file_path: str, start_index: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        逐行解析JSONL文件中的样本，跳过空行
+        
+        文件映射到内存后按换行符切分，orjson直接解析映射区域的切片，不为每行复制字节串；
+        断点续传时前start_index个样本所在的行只查找换行符，不解析、不复制。
+        """
+        with self._map_file(sft_file_path) as mm:
+            spans = islice(self._iter_jsonl_spans(mm), start_index, None)
+            if orjson is None:
+                # 标准库json不接受memoryview，复制出每一行再解析
+                for start, end in spans:
+                    yield self._loads(mm[start:end])
+                return
+            with memoryview(mm) as view:
+                for start, end in spans:
+                    yield self._loads(view[start:end])
+    
+    @staticmethod
+    @contextmanager
+    def _map_file(file_path: str):
+        """
+        以只读方式把文件映射到内存，空文件（无法映射）返回空字节串
+        """
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+    
+    @staticmethod
+    def _iter_jsonl_spans(mm) -> Iterator[Tuple[int, int]]:
+        """
+        扫描映射到内存的JSONL文件，产出每个非空行的(起始偏移, 结束偏移)，结束偏移不含换行符
+        """
+        size = len(mm)
+        start = 0
+        while start < size:
+            end = mm.find(b'\n', start)
+            if end < 0:
+                end = size
+            # 绝大多数行以非空白字符开头，无需复制出来判断是否为空行
+            if end > start and (mm[start] not in _BLANK_BYTES or mm[start:end].strip()):
+                yield start, end
+            start = end + 1
+    
+    @staticmethod
+    def _iter_json_array_records(sft_file_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        使用ijson流式解析JSON数组文件中的样本
+        """
+        with open(sft_file_path, 'rb') as f:
+            yield from ijson.items(f, 'item', use_float=True)
     
     def _delete_checkpoint(self, checkpoint_path: str):
-        """删除检查点文件"""
-        if os.path.exists(checkpoint_path):
+        """删除检查点文件（包括两个槽位）"""
+        self._checkpoint_slots.pop(checkpoint_path, None)
+        for path in (checkpoint_path, f"{checkpoint_path}.0", f"{checkpoint_path}.1"):
             try:
-                os.remove(checkpoint_path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
             except Exception as e:
-                print(f"删除检查点失败: {e}")
+                logger.warning("删除检查点失败: %s", e)
     
     def convert_sft_dataset_to_dpo_optimized(
         self,
@@ -91,74 +227,99 @@ class OptimizedSFTToDPOConverter(SFTToDPOConverter):
         output_file: str,
         concurrency: int = 1,
         resume_conversion: bool = True,
-        save_interval: int = 5
+        save_interval: int = 5,
+        executor: Optional[ThreadPoolExecutor] = None,
+        batch_size: int = 1,
+        pretty: bool = True
     ) -> List[Dict[str, str]]:
         """
         优化版本的SFT到DPO转换，支持断点续传和内存优化
         
+        转换结果逐条追加到 `<output_file>.partial.jsonl` 进度日志中，检查点只记录已处理的样本数
+        和日志长度；全部完成后再把日志整理为最终输出文件（.jsonl输出直接使用日志）。
+        
         Args:
             sft_file_path: SFT数据集文件路径
             output_file: 输出DPO数据集文件路径
             concurrency: 并发请求数
             resume_conversion: 是否启用断点续传
             save_interval: 保存间隔（每转换多少个样本保存一次）
+            executor: 复用的线程池，为None时并发转换临时创建一个
+            batch_size: 并发模式下每个任务通过model_caller.generate_batch一次转换的样本数，
+                模型调用器未实现批量请求时逐条转换
+            pretty: .json输出是否缩进排版，只供程序读取时可关闭以加快写出、减小文件
             
         Returns:
             转换后的DPO数据集
         """
-        # 加载SFT数据集
-        with open(sft_file_path, 'r', encoding='utf-8') as f:
-            sft_data = json.load(f)
-        
-        if not isinstance(sft_data, list):
-            raise ValueError("SFT数据集必须是JSON数组格式")
+        # 打开SFT数据集（流式读取，不一次性加载全部样本）
+        total_count, iter_sft_records = self._open_sft_records(sft_file_path)
         
         checkpoint_path = self._get_checkpoint_path(output_file)
+        partial_path = f"{output_file}.partial.jsonl"
         start_index = 0
-        dpo_data = []
+        
+        _ensure_dir(output_file)
         
         # 尝试从检查点恢复
         if resume_conversion:
             checkpoint = self._load_checkpoint(checkpoint_path)
             if checkpoint:
-                start_index = checkpoint.get('completed_count', 0)
-                dpo_data = checkpoint.get('converted_data', [])
+                start_index = self._restore_partial(checkpoint, partial_path)
                 
                 if st is not None:
-                    st.info(f"🔄 从检查点恢复转换，已完成 {start_index}/{len(sft_data)} 个样本")
-                print(f"从检查点恢复转换，已完成 {start_index}/{len(sft_data)} 个样本")
+                    st.info(f"🔄 从检查点恢复转换，已完成 {start_index}/{total_count} 个样本")
+                print(f"从检查点恢复转换，已完成 {start_index}/{total_count} 个样本")
+                
+                if 0 < start_index < total_count and not sft_file_path.endswith('.jsonl'):
+                    # JSON数组无法按行定位，已完成的样本仍要重新解析一遍
+                    if st is not None:
+                        st.warning("⚠️ JSON数组格式的数据集恢复时需要重新解析已完成的样本，大型数据集建议转换为JSONL格式")
+                    logger.warning("JSON数组格式的数据集恢复时需要重新解析已完成的样本，大型数据集建议转换为JSONL格式")
+        
+        if start_index == 0:
+            # 从头开始转换，清空旧的进度日志和失败记录，并删除旧检查点，避免其中更大的进度被误认为最新
+            open(partial_path, 'wb').close()
+            with suppress(FileNotFoundError):
+                os.remove(self._get_failed_path(output_file))
+            self._delete_checkpoint(checkpoint_path)
         
-        # 如果已经全部完成，直接返回
-        if start_index >= len(sft_data):
+        # 如果已经全部完成，直接整理结果
+        if start_index >= total_count:
             if st is not None:
                 st.success("✅ 转换已完成，直接加载结果")
-            return dpo_data
+            return self._finalize_partial(partial_path, output_file, checkpoint_path, pretty)
         
-        # 继续转换剩余的数据
-        remaining_data = sft_data[start_index:]
+        # 跳过已完成的样本，继续转换剩余的数据
+        remaining_records = iter_sft_records(start_index)
         
         try:
-            if concurrency > 1:
-                new_dpo_data = self._convert_concurrent_optimized(
-                    remaining_data, start_index, len(sft_data), 
-                    checkpoint_path, save_interval, concurrency
-                )
-            else:
-                new_dpo_data = self._convert_sequential_optimized(
-                    remaining_data, start_index, len(sft_data),
-                    checkpoint_path, save_interval
-                )
-            
-            # 合并数据
-            dpo_data.extend(new_dpo_data)
-            
-            # 保存最终结果
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(dpo_data, f, ensure_ascii=False, indent=2)
+            # 由单独的写入线程追加进度日志、同步磁盘并更新检查点，转换循环不会因磁盘写入而停顿
+            writer = CheckpointWriter(
+                output_file,
+                append=True,
+                on_checkpoint=partial(self._write_progress_checkpoint, checkpoint_path),
+                maxsize=max(1, concurrency) * 4
+            )
+            writer.start()
+            try:
+                if concurrency > 1:
+                    self._convert_concurrent_optimized(
+                        remaining_records, start_index, total_count, 
+                        save_interval, concurrency, writer, executor, batch_size
+                    )
+                else:
+                    self._convert_sequential_optimized(
+                        remaining_records, start_index, total_count,
+                        save_interval, writer
+                    )
+            finally:
+                writer.close()
+            if writer.error is not None:
+                raise Exception(f"保存检查点失败: {str(writer.error)}")
             
-            # 删除检查点文件
-            self._delete_checkpoint(checkpoint_path)
+            # 把进度日志整理为最终结果，并删除检查点文件
+            dpo_data = self._finalize_partial(partial_path, output_file, checkpoint_path, pretty)
             
             if st is not None:
                 st.success(f"🎉 转换完成！共转换 {len(dpo_data)} 个样本")
@@ -166,141 +327,281 @@ class OptimizedSFTToDPOConverter(SFTToDPOConverter):
             return dpo_data
             
         except Exception as e:
-            # 发生错误时保存当前进度
-            if dpo_data:
-                checkpoint_data = {
-                    'completed_count': len(dpo_data),
-                    'converted_data': dpo_data,
-                    'error': str(e),
-                    'timestamp': time.time()
-                }
-                self._save_checkpoint(checkpoint_path, checkpoint_data)
-                
-                if st is not None:
-                    st.error(f"❌ 转换过程中出现错误: {str(e)}")
-                    st.info(f"💾 已保存进度到检查点，下次可以继续转换")
+            # 发生错误时进度已写入检查点和进度日志
+            if st is not None:
+                st.error(f"❌ 转换过程中出现错误: {str(e)}")
+                st.info(f"💾 已保存进度到检查点，下次可以继续转换")
             
             raise e
     
+    def _restore_partial(self, checkpoint: Dict[str, Any], partial_path: str) -> int:
+        """
+        根据检查点恢复进度日志
+        
+        日志中检查点之后追加的内容（上次中断前未记入检查点的样本）会被截断，避免重复。
+        旧版检查点直接保存了已转换的样本，此时把样本写入进度日志。
+        
+        Args:
+            checkpoint: 检查点数据
+            partial_path: 进度日志路径
+            
+        Returns:
+            继续转换的起始样本序号，无法恢复时为0
+        """
+        completed_count = checkpoint.get('completed_count', 0)
+        
+        if 'output_offset' in checkpoint and os.path.exists(partial_path):
+            output_offset = checkpoint['output_offset']
+            log_size = os.path.getsize(partial_path)
+            if log_size < output_offset:
+                # 日志比检查点记录的短（被截断或替换），截断到该长度会补零字节，只能从头开始
+                return 0
+            if log_size > output_offset:
+                os.truncate(partial_path, output_offset)
+            return completed_count
+        
+        converted_data = checkpoint.get('converted_data')
+        if converted_data is not None:
+            with open(partial_path, 'wb') as f:
+                f.writelines(CheckpointWriter._dumps_line(sample) for sample in converted_data)
+            return completed_count
+        
+        # 进度日志丢失，只能从头开始
+        return 0
+    
+    def _write_progress_checkpoint(self, checkpoint_path: str, completed_count: int, output_offset: int) -> None:
+        """
+        在检查点中记录已处理的样本数和进度日志长度（进度日志已同步到磁盘后由写入线程调用）
+        
+        Args:
+            checkpoint_path: 检查点文件路径
+            completed_count: 已处理的样本数（包括转换失败的样本）
+            output_offset: 进度日志的长度（字节）
+        """
+        self._save_checkpoint(checkpoint_path, {
+            'completed_count': completed_count,
+            'output_offset': output_offset,
+            'timestamp': time.time()
+        })
+    
+    @staticmethod
+    def _get_failed_path(output_file: str) -> str:
+        """获取记录转换失败样本的文件路径"""
+        return f"{output_file}.failed.jsonl"
+    
+    def _record_failure(self, failed_path: str, index: int, sft_sample: Any, error: Exception) -> None:
+        """
+        记录转换失败的样本（模型调用已在ModelCaller中按退避策略重试过）
+        
+        失败样本连同序号和错误信息追加到 `<output_file>.failed.jsonl`，便于之后单独重新转换。
+        断点续传时，检查点之后失败的样本可能被重复记录。
+        
+        Args:
+            failed_path: 失败记录文件路径（由_get_failed_path得到）
+            index: 样本在数据集中的序号
+            sft_sample: 原始SFT样本
+            error: 转换时抛出的异常
+        """
+        logger.warning("转换样本 %d 时出错: %s", index, error)
+        line = CheckpointWriter._dumps_line({'index': index, 'error': str(error), 'sft': sft_sample})
+        try:
+            with self._failure_lock:
+                with open(failed_path, 'ab') as f:
+                    f.write(line)
+        except Exception as e:
+            # 失败记录只用于排查，写入失败不影响转换
+            logger.warning("记录失败样本 %d 时出错: %s", index, e)
+    
+    def _finalize_partial(
+        self,
+        partial_path: str,
+        output_file: str,
+        checkpoint_path: str,
+        pretty: bool = True
+    ) -> List[Dict[str, str]]:
+        """
+        把进度日志整理为最终输出文件，并删除检查点
+        
+        Returns:
+            转换后的DPO数据集
+        """
+        with open(partial_path, 'rb') as f:
+            dpo_data = [self._loads(line) for line in f if line.strip()]
+        
+        if output_file.endswith('.jsonl'):
+            # JSONL输出直接使用进度日志
+            os.replace(partial_path, output_file)
+        else:
+            _write_bytes_atomic(output_file, _dump_json_bytes(dpo_data, pretty))
+            os.remove(partial_path)
+        
+        self._delete_checkpoint(checkpoint_path)
+        return dpo_data
+    
     def _convert_sequential_optimized(
         self, 
-        sft_data: List[Dict[str, Any]], 
+        sft_records: Iterator[Dict[str, Any]], 
         start_index: int, 
         total_count: int,
-        checkpoint_path: str, 
-        save_interval: int
-    ) -> List[Dict[str, str]]:
+        save_interval: int,
+        writer: CheckpointWriter
+    ) -> None:
         """
-        优化的串行转换
+        优化的串行转换，结果逐条提交给写入线程追加到进度日志
         """
-        dpo_data = []
+        # 失败记录路径在循环外计算一次
+        failed_path = self._get_failed_path(writer.output_file)
         
-        # 创建Streamlit进度条
-        progress_bar = None
-        status_text = None
+        # 创建Streamlit进度条，由发布线程定时刷新，不逐个样本重绘
+        publisher = None
         if st is not None:
-            progress_bar = st.progress(start_index / total_count)
-            status_text = st.empty()
+            publisher = ProgressPublisher(st.progress(start_index / total_count), st.empty())
+            publisher.start()
         
-        for i, sft_sample in enumerate(tqdm(sft_data, desc="转换SFT到DPO", initial=start_index, total=total_count)):
-            try:
+        current_index = start_index
+        try:
+            for i, sft_sample in enumerate(tqdm(sft_records, desc="转换SFT到DPO", initial=start_index, total=total_count)):
                 current_index = start_index + i
+                try:
+                    # 更新进度条
+                    if publisher is not None:
+                        progress = (current_index + 1) / total_count
+                        publisher.publish(progress, f"转换SFT到DPO: {current_index + 1}/{total_count} ({progress:.1%})")
+                    
+                    # 转换单个样本
+                    dpo_sample = self.convert_sft_sample_to_dpo(sft_sample)
+                    writer.submit(dpo_sample)
+                    
+                except Exception as e:
+                    self._record_failure(failed_path, current_index, sft_sample, e)
                 
-                # 更新进度条
-                if progress_bar is not None:
-                    progress = (current_index + 1) / total_count
-                    progress_bar.progress(progress)
-                    status_text.text(f"转换SFT到DPO: {current_index + 1}/{total_count} ({progress:.1%})")
-                
-                # 转换单个样本
-                dpo_sample = self.convert_sft_sample_to_dpo(sft_sample)
-                dpo_data.append(dpo_sample)
+                current_index += 1
                 
                 # 定期保存检查点
                 if (i + 1) % save_interval == 0:
-                    checkpoint_data = {
-                        'completed_count': current_index + 1,
-                        'converted_data': dpo_data,
-                        'timestamp': time.time()
-                    }
-                    self._save_checkpoint(checkpoint_path, checkpoint_data)
+                    writer.sync(current_index)
                     
                     if st is not None:
-                        st.info(f"💾 已保存检查点: {current_index + 1}/{total_count}")
-                
-            except Exception as e:
-                print(f"转换样本 {start_index + i} 时出错: {e}")
-                continue
-        
-        return dpo_data
+                        st.info(f"💾 已保存检查点: {current_index}/{total_count}")
+        except BaseException:
+            # 中断或出错时记录已处理的进度，下次从这里继续
+            writer.sync(current_index)
+            raise
+        finally:
+            if publisher is not None:
+                publisher.close()
     
     def _convert_concurrent_optimized(
         self, 
-        sft_data: List[Dict[str, Any]], 
+        sft_records: Iterator[Dict[str, Any]], 
         start_index: int, 
         total_count: int,
-        checkpoint_path: str, 
         save_interval: int, 
-        concurrency: int
-    ) -> List[Dict[str, str]]:
+        concurrency: int,
+        writer: CheckpointWriter,
+        executor: Optional[ThreadPoolExecutor] = None,
+        batch_size: int = 1
+    ) -> None:
         """
-        优化的并发转换
+        优化的并发转换，边读取样本边提交任务，结果按输入顺序追加到进度日志
+        
+        Args:
+            executor: 复用的线程池，为None时临时创建一个
+            batch_size: 每个任务批量转换的样本数，模型调用器不支持批量请求时固定为1
         """
-        dpo_data = [None] * len(sft_data)
+        # 已完成但尚未按顺序写入进度日志的样本（序号 -> DPO样本，转换失败为None）
+        finished: Dict[int, Optional[Dict[str, str]]] = {}
         completed_count = 0
+        last_sync_count = 0
+        # 下一个要写入进度日志的样本序号（相对start_index），之前的样本都已处理完毕
+        next_to_write = 0
+        
+        if not self._supports_batch_generation():
+            batch_size = 1
         
-        # 创建进度条
-        progress_bar = None
-        status_text = None
+        # 失败记录路径在循环外计算一次
+        failed_path = self._get_failed_path(writer.output_file)
+        
+        # 创建Streamlit进度条，由发布线程定时刷新，不逐个样本重绘
+        publisher = None
         if st is not None:
-            progress_bar = st.progress(start_index / total_count)
-            status_text = st.empty()
+            publisher = ProgressPublisher(st.progress(start_index / total_count), st.empty())
+            publisher.start()
         
-        def convert_single_sample(index: int, sft_sample: Dict[str, Any]) -> tuple:
+        def convert_single_sample(index: int, sft_sample: Dict[str, Any]) -> list:
             try:
                 dpo_sample = self.convert_sft_sample_to_dpo(sft_sample)
-                return index, dpo_sample
+                return [(index, dpo_sample)]
             except Exception as e:
-                print(f"转换样本 {start_index + index} 时出错: {e}")
-                return index, None
-        
-        # 并发转换
-        with ThreadPoolExecutor(max_workers=concurrency) as executor:
-            future_to_index = {
-                executor.submit(convert_single_sample, i, sft_sample): i 
-                for i, sft_sample in enumerate(sft_data)
-            }
+                self._record_failure(failed_path, start_index + index, sft_sample, e)
+                return [(index, None)]
+        
+        def convert_batch(batch_index: int, sft_batch: List[Dict[str, Any]]) -> list:
+            first_index = batch_index * batch_size
+            try:
+                dpo_samples = self.convert_sft_samples_to_dpo_batch(sft_batch)
+            except Exception as e:
+                for offset, sft_sample in enumerate(sft_batch):
+                    self._record_failure(failed_path, start_index + first_index + offset, sft_sample, e)
+                return [(first_index + offset, None) for offset in range(len(sft_batch))]
             
-            for future in as_completed(future_to_index):
-                index, dpo_sample = future.result()
-                if dpo_sample is not None:
-                    dpo_data[index] = dpo_sample
-                
-                completed_count += 1
-                current_total = start_index + completed_count
-                
-                # 更新进度条
-                if progress_bar is not None:
-                    progress = current_total / total_count
-                    progress_bar.progress(progress)
-                    status_text.text(f"并发转换SFT到DPO: {current_total}/{total_count} ({progress:.1%})")
-                
-                # 定期保存检查点
-                if completed_count % save_interval == 0:
-                    # 过滤掉None值
-                    valid_data = [sample for sample in dpo_data if sample is not None]
-                    checkpoint_data = {
-                        'completed_count': start_index + len(valid_data),
-                        'converted_data': valid_data,
-                        'timestamp': time.time()
-                    }
-                    self._save_checkpoint(checkpoint_path, checkpoint_data)
-                    
-                    if st is not None:
-                        st.info(f"💾 已保存检查点: {current_total}/{total_count}")
+            for offset, (sft_sample, dpo_sample) in enumerate(zip(sft_batch, dpo_samples)):
+                if dpo_sample is None:
+                    # 批量转换只对缺少字段的样本返回None，重新检查一次以取得具体原因
+                    try:
+                        self._extract_sft_fields(sft_sample)
+                    except ValueError as e:
+                        self._record_failure(failed_path, start_index + first_index + offset, sft_sample, e)
+            return list(enumerate(dpo_samples, first_index))
+        
+        if batch_size > 1:
+            # 每batch_size个样本组成一个任务，一次批量请求生成全部rejected
+            convert_func = convert_batch
+            tasks = iter(lambda: list(islice(sft_records, batch_size)), [])
+        else:
+            convert_func = convert_single_sample
+            tasks = sft_records
         
-        # 过滤掉None值，保持顺序
-        return [sample for sample in dpo_data if sample is not None]
+        # 并发转换：最多同时存在concurrency*2个任务，完成一个再从输入中读取并提交新的；
+        # 提交的任务最多领先最早未完成任务concurrency*4个，finished中等待按序写入的结果数量有上限
+        with self._use_executor(executor, concurrency) as executor:
+            completed = self._iter_completed(
+                executor, convert_func, tasks, concurrency * 2, max_ahead=concurrency * 4
+            )
+            try:
+                for results in completed:
+                    finished.update(results)
+                    
+                    completed_count += len(results)
+                    current_total = start_index + completed_count
+                    
+                    # 更新进度条
+                    if publisher is not None:
+                        progress = current_total / total_count
+                        publisher.publish(progress, f"并发转换SFT到DPO: {current_total}/{total_count} ({progress:.1%})")
+                    
+                    # 按输入顺序写入已连续完成的样本
+                    while next_to_write in finished:
+                        dpo_sample = finished.pop(next_to_write)
+                        if dpo_sample is not None:
+                            writer.submit(dpo_sample)
+                        next_to_write += 1
+                    
+                    # 定期保存检查点
+                    if completed_count - last_sync_count >= save_interval:
+                        last_sync_count = completed_count
+                        writer.sync(start_index + next_to_write)
+                        
+                        if st is not None:
+                            st.info(f"💾 已保存检查点: {current_total}/{total_count}")
+            except BaseException:
+                # 中断或出错时取消尚未开始的任务，并记录已按顺序写入的进度，下次从这里继续
+                completed.close()
+                writer.sync(start_index + next_to_write)
+                raise
+            finally:
+                if publisher is not None:
+                    publisher.close()
     
     def convert_folder_sft_to_dpo_optimized(
         self,
@@ -308,16 +609,15 @@ class OptimizedSFTToDPOConverter(SFTToDPOConverter):
         output_folder: str,
         concurrency: int = 1,
         resume_conversion: bool = True,
-        save_interval: int = 5
+        save_interval: int = 5,
+        batch_size: int = 1,
+        pretty: bool = True
     ) -> Dict[str, Any]:
         """
         优化版本的批量文件夹转换
         """
-        # 获取所有JSON文件
-        sft_files = []
-        for file_name in os.listdir(sft_folder_path):
-            if file_name.endswith('.json'):
-                sft_files.append(os.path.join(sft_folder_path, file_name))
+        # 获取所有JSON/JSONL文件
+        sft_files = self._list_sft_files(sft_folder_path, ('.json', '.jsonl'))
         
         if not sft_files:
             raise ValueError(f"在文件夹 {sft_folder_path} 中没有找到JSON文件")
@@ -328,30 +628,37 @@ class OptimizedSFTToDPOConverter(SFTToDPOConverter):
         conversion_results = []
         total_converted = 0
         
-        for sft_file in sft_files:
-            try:
-                file_name = os.path.basename(sft_file)
-                output_file = os.path.join(output_folder, f"dpo_{file_name}")
-                
-                if st is not None:
-                    st.info(f"🔄 正在转换文件: {file_name}")
-                
-                # 使用优化转换方法
-                dpo_data = self.convert_sft_dataset_to_dpo_optimized(
-                    sft_file, output_file, concurrency, resume_conversion, save_interval
-                )
-                
-                conversion_results.append({
-                    'input_file': sft_file,
-                    'output_file': output_file,
-                    'converted_count': len(dpo_data)
-                })
-                
-                total_converted += len(dpo_data)
-                
-            except Exception as e:
-                print(f"转换文件 {sft_file} 时出错: {e}")
-                continue
+        # 并发模式下所有文件共用一个线程池，不再为每个文件重复创建
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="sft2dpo") if concurrency > 1 else None
+        try:
+            for sft_file in sft_files:
+                try:
+                    file_name = os.path.basename(sft_file)
+                    output_file = os.path.join(output_folder, f"dpo_{file_name}")
+                    
+                    if st is not None:
+                        st.info(f"🔄 正在转换文件: {file_name}")
+                    
+                    # 使用优化转换方法
+                    dpo_data = self.convert_sft_dataset_to_dpo_optimized(
+                        sft_file, output_file, concurrency, resume_conversion, save_interval,
+                        executor=executor, batch_size=batch_size, pretty=pretty
+                    )
+                    
+                    conversion_results.append({
+                        'input_file': sft_file,
+                        'output_file': output_file,
+                        'converted_count': len(dpo_data)
+                    })
+                    
+                    total_converted += len(dpo_data)
+                    
+                except Exception as e:
+                    logger.warning("转换文件 %s 时出错: %s", sft_file, e)
+                    continue
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
         
         return {
             'conversion_results': conversion_results,
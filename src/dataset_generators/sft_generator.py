@@ -4,10 +4,9 @@ SFT（监督微调）数据集生成器
 支持完整模式和固定指令模式
 """
 
-import json
 from typing import List, Dict, Any, Optional
 
-from .base_generator import BaseDatasetGenerator
+from .base_generator import BaseDatasetGenerator, _compile_template
 from ..model_caller import extract_content_between_backticks
 
 
@@ -28,7 +27,9 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
         input_prompt: str,
         output_prompt: str,
         sample_min: int = 3,
-        sample_max: int = 6
+        sample_max: int = 6,
+        rps: float = 10.0,
+        instruction_batch: int = 16
     ):
         """
         初始化SFT数据集生成器
@@ -41,8 +42,10 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
             output_prompt: 生成output的提示模板
             sample_min: 最少示例数量
             sample_max: 最多示例数量
+            rps: 每秒最多发起的模型请求数，小于等于0表示不限流
+            instruction_batch: 完整模式下每次请求批量生成的instruction数量
         """
-        super().__init__(model_caller, data_loader, sample_min, sample_max)
+        super().__init__(model_caller, data_loader, sample_min, sample_max, rps, instruction_batch)
         self.instruction_prompt = instruction_prompt
         self.input_prompt = input_prompt
         self.output_prompt = output_prompt
@@ -71,6 +74,52 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
         else:
             raise ValueError(f"不支持的生成模式: {mode}")
     
+    async def agenerate_sample(self, mode: str = "complete", fixed_instruction: Optional[str] = None) -> Dict[str, str]:
+        """
+        异步生成单个SFT样本
+        
+        Args:
+            mode: 生成模式，"complete"为完整模式，"input_output"为固定指令模式
+            fixed_instruction: 固定指令（仅在input_output模式下使用）
+            
+        Returns:
+            包含instruction, input, output的字典
+        """
+        if mode == "complete":
+            return await self.agenerate_complete_sample()
+        elif mode == "input_output":
+            return await self.agenerate_input_output_sample(fixed_instruction)
+        else:
+            raise ValueError(f"不支持的生成模式: {mode}")
+    
+    def _build_instruction_prompt(self, num_to_generate: int) -> str:
+        """
+        构建生成instruction的提示词（含随机示例）
+        """
+        return _compile_template(self.instruction_prompt)(
+            num_to_generate=num_to_generate,
+            examples=self.get_formatted_examples()
+        )
+    
+    def _build_input_prompt(self, instruction: str) -> str:
+        """
+        构建生成input的提示词（含随机示例）
+        """
+        return _compile_template(self.input_prompt)(
+            instruction=instruction,
+            examples=self.get_formatted_examples()
+        )
+    
+    def _build_output_prompt(self, instruction: str, input_text: str) -> str:
+        """
+        构建生成output的提示词（含随机示例）
+        """
+        return _compile_template(self.output_prompt)(
+            instruction=instruction,
+            input=input_text,
+            examples=self.get_formatted_examples()
+        )
+    
     def generate_instructions(self, num_to_generate: int = 1) -> List[str]:
         """
         生成新的instructions
@@ -81,59 +130,21 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
         Returns:
             生成的instruction列表
         """
-        # 获取随机示例
-        examples = self.get_random_examples()
-        formatted_examples = self.format_examples(examples)
-        
-        # 构建提示词
-        prompt = self.instruction_prompt.format(
-            num_to_generate=num_to_generate,
-            examples=formatted_examples
-        )
+        response = self.model_caller.generate(self._build_instruction_prompt(num_to_generate))
+        return self._parse_instructions(response, num_to_generate)
+    
+    async def agenerate_instructions(self, num_to_generate: int = 1) -> List[str]:
+        """
+        异步生成新的instructions
         
-        # 调用模型生成
-        response = self.model_caller.generate(prompt)
-        
-        # 解析生成的instructions
-        instructions = []
-        
-        # 尝试从三个反引号中提取内容
-        extracted = extract_content_between_backticks(response)
-        
-        if extracted:
-            try:
-                # 尝试将提取的内容解析为 JSON 数组
-                parsed_json = json.loads(extracted)
-                if isinstance(parsed_json, list):
-                    # 如果是列表，则每个元素视为一个 instruction
-                    instructions.extend([str(item).strip() for item in parsed_json if str(item).strip()])
-                elif isinstance(parsed_json, str):
-                    # 如果是字符串，按行分割
-                    lines = [line.strip() for line in parsed_json.split('\n') if line.strip()]
-                    instructions.extend(lines)
-                else:
-                    # 其他类型直接转换为字符串
-                    instructions.append(str(parsed_json).strip())
-            except json.JSONDecodeError:
-                # 如果不是有效的 JSON，则按行分割
-                lines = [line.strip() for line in extracted.split('\n') if line.strip()]
-                instructions.extend(lines)
-        
-        # 如果提取后仍然没有足够的 instructions，或者模型直接返回了非反引号包裹的内容
-        if not instructions or len(instructions) < num_to_generate:
-            # 再次尝试直接处理原始响应
-            raw_lines = [line.strip() for line in response.split('\n') if line.strip()]
-            for line in raw_lines:
-                # 过滤掉可能的非 instruction 行
-                if not line.lower().startswith('示例') and \
-                   not line.lower().startswith('以下是') and \
-                   not line.lower().startswith('这是') and \
-                   not line.lower().startswith('json') and \
-                   line not in instructions:  # 避免重复添加
-                    instructions.append(line)
-        
-        # 确保返回指定数量的instructions
-        return instructions[:num_to_generate]
+        Args:
+            num_to_generate: 要生成的instruction数量
+            
+        Returns:
+            生成的instruction列表
+        """
+        response = await self.model_caller.agenerate(self._build_instruction_prompt(num_to_generate))
+        return self._parse_instructions(response, num_to_generate)
     
     def generate_input(self, instruction: str) -> str:
         """
@@ -145,20 +156,20 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
         Returns:
             生成的input
         """
-        # 获取随机示例
-        examples = self.get_random_examples()
-        formatted_examples = self.format_examples(examples)
-        
-        # 构建提示词
-        prompt = self.input_prompt.format(
-            instruction=instruction,
-            examples=formatted_examples
-        )
-        
-        # 调用模型生成
-        response = self.model_caller.generate(prompt)
+        response = self.model_caller.generate(self._build_input_prompt(instruction))
+        return extract_content_between_backticks(response)
+    
+    async def agenerate_input(self, instruction: str) -> str:
+        """
+        异步为给定的instruction生成input
         
-        # 提取生成的input
+        Args:
+            instruction: 指令
+            
+        Returns:
+            生成的input
+        """
+        response = await self.model_caller.agenerate(self._build_input_prompt(instruction))
         return extract_content_between_backticks(response)
     
     def generate_output(self, instruction: str, input_text: str) -> str:
@@ -172,21 +183,21 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
         Returns:
             生成的output
         """
-        # 获取随机示例
-        examples = self.get_random_examples()
-        formatted_examples = self.format_examples(examples)
-        
-        # 构建提示词
-        prompt = self.output_prompt.format(
-            instruction=instruction,
-            input=input_text,
-            examples=formatted_examples
-        )
-        
-        # 调用模型生成
-        response = self.model_caller.generate(prompt)
+        response = self.model_caller.generate(self._build_output_prompt(instruction, input_text))
+        return extract_content_between_backticks(response)
+    
+    async def agenerate_output(self, instruction: str, input_text: str) -> str:
+        """
+        异步为给定的instruction和input生成output
         
-        # 提取生成的output
+        Args:
+            instruction: 指令
+            input_text: 输入
+            
+        Returns:
+            生成的output
+        """
+        response = await self.model_caller.agenerate(self._build_output_prompt(instruction, input_text))
         return extract_content_between_backticks(response)
     
     def generate_input_output_sample(self, instruction: Optional[str] = None) -> Dict[str, str]:
@@ -199,12 +210,7 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
         Returns:
             包含instruction, input, output的字典
         """
-        # 如果没有提供instruction或instruction为空字符串，从原始数据集中随机选择一个
-        if not instruction or not instruction.strip():
-            sample = self.get_random_examples()[0]
-            instruction = sample.get('instruction', '')
-            if not instruction:
-                raise ValueError("原始数据集中没有找到有效的instruction")
+        instruction = self._resolve_instruction(instruction)
         
         # 生成input
         input_text = self.generate_input(instruction)
@@ -218,6 +224,26 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
             "output": output
         }
     
+    async def agenerate_input_output_sample(self, instruction: Optional[str] = None) -> Dict[str, str]:
+        """
+        异步为给定的instruction生成input和output（固定指令模式）
+        
+        Args:
+            instruction: 固定的指令，如果为None或空字符串则从原始数据集中随机选择
+            
+        Returns:
+            包含instruction, input, output的字典
+        """
+        instruction = self._resolve_instruction(instruction)
+        input_text = await self.agenerate_input(instruction)
+        output = await self.agenerate_output(instruction, input_text)
+        
+        return {
+            "instruction": instruction,
+            "input": input_text,
+            "output": output
+        }
+    
     def generate_complete_sample(self) -> Dict[str, str]:
         """
         生成完整的样本（instruction, input, output）
@@ -225,11 +251,8 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
         Returns:
             包含instruction, input, output的字典
         """
-        # 生成instruction
-        instructions = self.generate_instructions(1)
-        if not instructions:
-            raise ValueError("生成instruction失败")
-        instruction = instructions[0]
+        # 从队列获取instruction，队列为空时批量生成
+        instruction = self._next_instruction()
         
         # 生成input
         input_text = self.generate_input(instruction)
@@ -241,4 +264,22 @@ class SFTDatasetGenerator(BaseDatasetGenerator):
             "instruction": instruction,
             "input": input_text,
             "output": output
-        }
\ No newline at end of file
+        }
+    
+    async def agenerate_complete_sample(self) -> Dict[str, str]:
+        """
+        异步生成完整的样本（instruction, input, output）
+        
+        Returns:
+            包含instruction, input, output的字典
+        """
+        instruction = await self._anext_instruction()
+        
+        input_text = await self.agenerate_input(instruction)
+        output = await self.agenerate_output(instruction, input_text)
+        
+        return {
+            "instruction": instruction,
+            "input": input_text,
+            "output": output
+        }
@@ -4,14 +4,17 @@ SFT到DPO数据集转换器
 用于将现有的SFT数据集转换为DPO格式，为每条数据自动生成rejected字段
 """
 
-import json
 import os
-from typing import List, Dict, Any, Optional
+from contextlib import contextmanager
+from itertools import islice
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Callable
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-from .base_generator import BaseDatasetGenerator
+from .base_generator import BaseDatasetGenerator, _compile_template
 from ..data_loader import DataLoader
+from ..checkpoint_writer import CheckpointWriter
+from ..progress_publisher import ProgressPublisher
 from ..model_caller import ModelCaller, extract_content_between_backticks
 
 # 尝试导入streamlit，如果不可用则使用None
@@ -80,14 +83,7 @@ class SFTToDPOConverter(BaseDatasetGenerator):
         Returns:
             DPO格式的样本，包含instruction、input、chosen、rejected字段
         """
-        instruction = sft_sample.get('instruction', '')
-        input_text = sft_sample.get('input', '')
-        chosen = sft_sample.get('output', '')  # 原来的output作为chosen
-        
-        if not instruction:
-            raise ValueError("SFT样本中缺少instruction字段")
-        if not chosen:
-            raise ValueError("SFT样本中缺少output字段")
+        instruction, input_text, chosen = self._extract_sft_fields(sft_sample)
         
         # 生成rejected（劣质回答）
         rejected = self.generate_rejected(instruction, input_text, chosen)
@@ -99,32 +95,93 @@ class SFTToDPOConverter(BaseDatasetGenerator):
             "rejected": rejected
         }
     
-    def generate_rejected(self, instruction: str, input_text: str, chosen: str) -> str:
+    def convert_sft_samples_to_dpo_batch(self, sft_samples: List[Dict[str, Any]]) -> List[Optional[Dict[str, str]]]:
         """
-        为给定的instruction、input和chosen生成rejected（劣质回答）
+        批量将SFT样本转换为DPO格式，所有rejected通过一次model_caller.generate_batch调用生成
         
         Args:
-            instruction: 指令
-            input_text: 输入
-            chosen: 优质回答（原SFT数据集的output）
+            sft_samples: SFT样本列表
             
         Returns:
-            生成的rejected（劣质回答）
+            与输入一一对应的DPO样本列表，缺少必要字段的样本为None
         """
-        # 获取随机示例（用于提供上下文）
-        examples = self.get_random_examples()
-        formatted_examples = self.format_examples(examples)
+        fields = []
+        prompts = []
+        for sft_sample in sft_samples:
+            try:
+                sample_fields = self._extract_sft_fields(sft_sample)
+            except ValueError:
+                fields.append(None)
+                continue
+            fields.append(sample_fields)
+            prompts.append(self._build_rejected_prompt(*sample_fields))
+        
+        responses = iter(self.model_caller.generate_batch(prompts) if prompts else [])
+        
+        dpo_samples = []
+        for sample_fields in fields:
+            if sample_fields is None:
+                dpo_samples.append(None)
+                continue
+            instruction, input_text, chosen = sample_fields
+            dpo_samples.append({
+                "instruction": instruction,
+                "input": input_text,
+                "chosen": chosen,
+                "rejected": extract_content_between_backticks(next(responses))
+            })
+        return dpo_samples
+    
+    def _supports_batch_generation(self) -> bool:
+        """
+        判断模型调用器是否重写了generate_batch（真正的批量请求）
         
-        # 构建提示词
-        prompt = self.rejected_prompt.format(
+        未重写时generate_batch只是逐条调用generate，分组提交反而会降低并发度。
+        """
+        generate_batch = getattr(type(self.model_caller), 'generate_batch', None)
+        return generate_batch is not None and generate_batch is not ModelCaller.generate_batch
+    
+    @staticmethod
+    def _extract_sft_fields(sft_sample: Dict[str, Any]) -> tuple:
+        """
+        取出SFT样本的instruction、input和output（作为chosen），缺少必要字段时抛出ValueError
+        """
+        instruction = sft_sample.get('instruction', '')
+        input_text = sft_sample.get('input', '')
+        chosen = sft_sample.get('output', '')  # 原来的output作为chosen
+        
+        if not instruction:
+            raise ValueError("SFT样本中缺少instruction字段")
+        if not chosen:
+            raise ValueError("SFT样本中缺少output字段")
+        
+        return instruction, input_text, chosen
+    
+    def _build_rejected_prompt(self, instruction: str, input_text: str, chosen: str) -> str:
+        """
+        构建生成rejected的提示词（含从预先格式化的示例池中获取的随机示例）
+        """
+        return _compile_template(self.rejected_prompt)(
             instruction=instruction,
             input=input_text,
             chosen=chosen,
-            examples=formatted_examples
+            examples=self.get_formatted_examples()
         )
+    
+    def generate_rejected(self, instruction: str, input_text: str, chosen: str) -> str:
+        """
+        为给定的instruction、input和chosen生成rejected（劣质回答）
         
+        Args:
+            instruction: 指令
+            input_text: 输入
+            chosen: 优质回答（原SFT数据集的output）
+            
+        Returns:
+            生成的rejected（劣质回答）
+        """
         # 调用模型生成
-        response = self.model_caller.generate(prompt)
+        response = self.model_caller.generate(self._build_rejected_prompt(instruction, input_text, chosen))
         
         # 提取生成的rejected
         return extract_content_between_backticks(response)
@@ -133,7 +190,8 @@ class SFTToDPOConverter(BaseDatasetGenerator):
         self,
         sft_file_path: str,
         output_file: str,
-        concurrency: int = 1
+        concurrency: int = 1,
+        executor: Optional[ThreadPoolExecutor] = None
     ) -> List[Dict[str, str]]:
         """
         将整个SFT数据集转换为DPO格式
@@ -142,93 +200,123 @@ class SFTToDPOConverter(BaseDatasetGenerator):
             sft_file_path: SFT数据集文件路径
             output_file: 输出DPO数据集文件路径
             concurrency: 并发请求数，默认为1（串行）
+            executor: 复用的线程池，为None时并发转换临时创建一个
             
         Returns:
             转换后的DPO数据集
         """
         # 加载SFT数据集
-        with open(sft_file_path, 'r', encoding='utf-8') as f:
-            sft_data = json.load(f)
-        
-        if not isinstance(sft_data, list):
-            raise ValueError("SFT数据集必须是JSON数组格式")
+        sft_data = self._load_json_array(sft_file_path)
         
         # 开始转换SFT数据集
         
         # 根据并发数选择转换方式
         if concurrency > 1:
-            dpo_data = self._convert_concurrent(sft_data, concurrency)
+            dpo_data = self._convert_concurrent(sft_data, concurrency, executor)
         else:
             dpo_data = self._convert_sequential(sft_data, output_file)
         
         # 保存转换后的数据
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(dpo_data, f, ensure_ascii=False, indent=2)
+        self.data_loader.save_data(dpo_data, output_file)
         
         # 转换完成
         
         return dpo_data
     
+    def _load_json_array(self, sft_file_path: str) -> List[Dict[str, Any]]:
+        """
+        一次性加载JSON数组格式的SFT数据集
+        
+        Args:
+            sft_file_path: SFT数据集文件路径
+            
+        Returns:
+            SFT样本列表
+        """
+        with open(sft_file_path, 'rb') as f:
+            sft_data = self._loads(f.read())
+        
+        if not isinstance(sft_data, list):
+            raise ValueError("SFT数据集必须是JSON数组格式")
+        return sft_data
+    
     def _convert_sequential(self, sft_data: List[Dict[str, Any]], output_file: str = None) -> List[Dict[str, str]]:
         """
         串行转换SFT数据集
         """
         dpo_data = []
         
-        # 创建Streamlit进度条（如果在Streamlit环境中）
-        progress_bar = None
-        status_text = None
+        # 创建Streamlit进度条（如果在Streamlit环境中），由发布线程定时刷新，不逐个样本重绘
+        publisher = None
         if st is not None:
-            progress_bar = st.progress(0)
-            status_text = st.empty()
+            publisher = ProgressPublisher(st.progress(0), st.empty())
+            publisher.start()
+        
+        # 后台线程把转换结果逐条追加到 `<output_file>.partial.jsonl`，防止中途失败，
+        # 不再每10个样本重写一次包含全部已转换样本的临时文件
+        checkpoint_writer = None
+        if output_file:
+            checkpoint_writer = CheckpointWriter(output_file)
+            checkpoint_writer.start()
         
         # 使用tqdm显示终端进度
-        for i, sft_sample in enumerate(tqdm(sft_data, desc="转换SFT到DPO")):
-            try:
-                # 更新Streamlit进度条
-                if progress_bar is not None:
-                    progress = (i + 1) / len(sft_data)
-                    progress_bar.progress(progress)
-                    status_text.text(f"转换SFT到DPO: {i + 1}/{len(sft_data)} ({progress:.1%})")
-                
-                # 转换单个样本
-                dpo_sample = self.convert_sft_sample_to_dpo(sft_sample)
-                dpo_data.append(dpo_sample)
-                
-                # 每转换10个样本保存一次，防止中途失败
-                if (i + 1) % 10 == 0 and output_file:
-                    temp_output = f"{os.path.splitext(output_file)[0]}_temp.json"
-                    with open(temp_output, 'w', encoding='utf-8') as f:
-                        json.dump(dpo_data, f, ensure_ascii=False, indent=2)
-                
-            except Exception as e:
-                # 转换样本时出错
-                continue
+        try:
+            for i, sft_sample in enumerate(tqdm(sft_data, desc="转换SFT到DPO")):
+                try:
+                    # 更新Streamlit进度条
+                    if publisher is not None:
+                        progress = (i + 1) / len(sft_data)
+                        publisher.publish(progress, f"转换SFT到DPO: {i + 1}/{len(sft_data)} ({progress:.1%})")
+                    
+                    # 转换单个样本
+                    dpo_sample = self.convert_sft_sample_to_dpo(sft_sample)
+                    dpo_data.append(dpo_sample)
+                    if checkpoint_writer is not None:
+                        checkpoint_writer.submit(dpo_sample)
+                    
+                except Exception as e:
+                    # 转换样本时出错
+                    continue
+        except BaseException:
+            # 被用户中断时停止写入线程，保留已转换样本的临时文件
+            if checkpoint_writer is not None:
+                checkpoint_writer.close()
+            if publisher is not None:
+                publisher.close()
+            raise
+        
+        # 全部样本已在内存中，随后由调用方保存，删除临时文件
+        if checkpoint_writer is not None:
+            checkpoint_writer.finalize()
         
         # 完成进度条
-        if progress_bar is not None:
-            progress_bar.progress(1.0)
-            status_text.text(f"转换SFT到DPO: 完成 ({len(dpo_data)}/{len(sft_data)})")
+        if publisher is not None:
+            publisher.close(1.0, f"转换SFT到DPO: 完成 ({len(dpo_data)}/{len(sft_data)})")
         
         return dpo_data
     
     def _convert_concurrent(
         self,
         sft_data: List[Dict[str, Any]],
-        concurrency: int = 3
+        concurrency: int = 3,
+        executor: Optional[ThreadPoolExecutor] = None
     ) -> List[Dict[str, str]]:
         """
         并发转换SFT数据集
+        
+        Args:
+            executor: 复用的线程池，为None时临时创建一个
         """
-        dpo_data = [None] * len(sft_data)  # 预分配列表，保持顺序
+        dpo_data = []
+        # 已完成但尚未按顺序加入结果的样本（序号 -> DPO样本，转换失败为None）
+        finished: Dict[int, Optional[Dict[str, str]]] = {}
+        next_to_append = 0
         
-        # 创建Streamlit进度条（如果在Streamlit环境中）
-        progress_bar = None
-        status_text = None
+        # 创建Streamlit进度条（如果在Streamlit环境中），由发布线程定时刷新，不逐个样本重绘
+        publisher = None
         if st is not None:
-            progress_bar = st.progress(0)
-            status_text = st.empty()
+            publisher = ProgressPublisher(st.progress(0), st.empty())
+            publisher.start()
         
         completed_count = 0
         
@@ -243,37 +331,118 @@ class SFTToDPOConverter(BaseDatasetGenerator):
                 # 转换样本时出错
                 return index, None
         
-        # 使用ThreadPoolExecutor进行并发转换
-        with ThreadPoolExecutor(max_workers=concurrency) as executor:
-            # 提交所有任务
-            future_to_index = {
-                executor.submit(convert_single_sample, i, sft_sample): i 
-                for i, sft_sample in enumerate(sft_data)
-            }
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_index):
-                index, dpo_sample = future.result()
-                if dpo_sample is not None:
-                    dpo_data[index] = dpo_sample
-                
-                completed_count += 1
-                
-                # 更新进度条
-                if progress_bar is not None:
-                    progress = completed_count / len(sft_data)
-                    progress_bar.progress(progress)
-                    status_text.text(f"并发转换SFT到DPO: {completed_count}/{len(sft_data)} ({progress:.1%})")
-        
-        # 过滤掉None值，保持原有顺序
-        final_data = [sample for sample in dpo_data if sample is not None]
+        # 使用ThreadPoolExecutor进行并发转换，同一时刻最多有concurrency*2个任务
+        try:
+            with self._use_executor(executor, concurrency) as executor:
+                # 处理完成的任务
+                completed = self._iter_completed(
+                    executor, convert_single_sample, sft_data, concurrency * 2, max_ahead=concurrency * 4
+                )
+                for index, dpo_sample in completed:
+                    finished[index] = dpo_sample
+                    
+                    # 按输入顺序加入已连续完成的样本，跳过转换失败的样本
+                    while next_to_append in finished:
+                        dpo_sample = finished.pop(next_to_append)
+                        if dpo_sample is not None:
+                            dpo_data.append(dpo_sample)
+                        next_to_append += 1
+                    
+                    completed_count += 1
+                    
+                    # 更新进度条
+                    if publisher is not None:
+                        progress = completed_count / len(sft_data)
+                        publisher.publish(progress, f"并发转换SFT到DPO: {completed_count}/{len(sft_data)} ({progress:.1%})")
+        except BaseException:
+            if publisher is not None:
+                publisher.close()
+            raise
         
         # 完成进度条
-        if progress_bar is not None:
-            progress_bar.progress(1.0)
-            status_text.text(f"并发转换SFT到DPO: 完成 ({len(final_data)}/{len(sft_data)})")
+        if publisher is not None:
+            publisher.close(1.0, f"并发转换SFT到DPO: 完成 ({len(dpo_data)}/{len(sft_data)})")
         
-        return final_data
+        return dpo_data
+    
+    @staticmethod
+    @contextmanager
+    def _use_executor(executor: Optional[ThreadPoolExecutor], concurrency: int):
+        """
+        使用调用方提供的线程池；未提供时临时创建一个，退出时关闭
+        
+        Args:
+            executor: 调用方提供的线程池
+            concurrency: 临时线程池的线程数
+        """
+        if executor is not None:
+            yield executor
+            return
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="sft2dpo") as executor:
+            yield executor
+    
+    @staticmethod
+    def _iter_completed(
+        executor: ThreadPoolExecutor,
+        func: Callable[[int, Any], Any],
+        items: Iterable[Any],
+        max_pending: int,
+        max_ahead: Optional[int] = None
+    ) -> Iterator[Any]:
+        """
+        在线程池中以有限数量的在途任务运行func，按完成顺序产出结果
+        
+        每完成一个任务才从items中读取下一项并提交，不会一次性为全部样本创建Future；
+        迭代器关闭或出错时取消尚未开始的任务。
+        
+        Args:
+            executor: 线程池
+            func: 以(序号, 数据项)为参数的函数
+            items: 数据项，可以是按需读取的迭代器
+            max_pending: 同时存在的最大任务数
+            max_ahead: 已提交的序号最多领先最早未完成任务多少，用于限制调用方按序写出时
+                重排缓冲区的大小；为None时不限制
+        """
+        indexed_items = enumerate(items)
+        # 在途任务 -> 序号
+        pending: Dict[Any, int] = {}
+        next_index = 0
+        try:
+            while True:
+                limit = max_pending - len(pending)
+                if max_ahead is not None and pending:
+                    # 最早的任务迟迟未完成时暂停提交，避免之后完成的结果在缓冲区中无限堆积
+                    limit = min(limit, min(pending.values()) + max_ahead - next_index)
+                for index, item in islice(indexed_items, max(0, limit)):
+                    pending[executor.submit(func, index, item)] = index
+                    next_index = index + 1
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    @staticmethod
+    def _list_sft_files(sft_folder_path: str, extensions: tuple) -> List[str]:
+        """
+        列出文件夹中指定扩展名的SFT数据集文件
+        
+        使用os.scandir，文件类型直接取自目录项，不必对每个文件单独stat。
+        
+        Args:
+            sft_folder_path: SFT数据集文件夹路径
+            extensions: 允许的扩展名
+        """
+        with os.scandir(sft_folder_path) as entries:
+            return [
+                entry.path for entry in entries
+                if entry.name.endswith(extensions) and entry.is_file()
+            ]
     
     def convert_folder_sft_to_dpo(
         self,
@@ -293,10 +462,7 @@ class SFTToDPOConverter(BaseDatasetGenerator):
             转换结果统计
         """
         # 获取文件夹中的所有JSON文件
-        sft_files = []
-        for file_name in os.listdir(sft_folder_path):
-            if file_name.endswith('.json'):
-                sft_files.append(os.path.join(sft_folder_path, file_name))
+        sft_files = self._list_sft_files(sft_folder_path, ('.json',))
         
         if not sft_files:
             raise ValueError(f"在文件夹 {sft_folder_path} 中没有找到JSON文件")
@@ -309,29 +475,35 @@ class SFTToDPOConverter(BaseDatasetGenerator):
         conversion_results = []
         total_converted = 0
         
-        for sft_file in sft_files:
-            try:
-                file_name = os.path.basename(sft_file)
-                output_file = os.path.join(output_folder, f"dpo_{file_name}")
-                
-                # 正在转换文件
-                
-                # 转换单个文件
-                dpo_data = self.convert_sft_dataset_to_dpo(
-                    sft_file, output_file, concurrency
-                )
-                
-                conversion_results.append({
-                    'input_file': sft_file,
-                    'output_file': output_file,
-                    'converted_count': len(dpo_data)
-                })
-                
-                total_converted += len(dpo_data)
-                
-            except Exception as e:
-                # 转换文件时出错
-                continue
+        # 并发模式下所有文件共用一个线程池，不再为每个文件重复创建
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="sft2dpo") if concurrency > 1 else None
+        try:
+            for sft_file in sft_files:
+                try:
+                    file_name = os.path.basename(sft_file)
+                    output_file = os.path.join(output_folder, f"dpo_{file_name}")
+                    
+                    # 正在转换文件
+                    
+                    # 转换单个文件
+                    dpo_data = self.convert_sft_dataset_to_dpo(
+                        sft_file, output_file, concurrency, executor=executor
+                    )
+                    
+                    conversion_results.append({
+                        'input_file': sft_file,
+                        'output_file': output_file,
+                        'converted_count': len(dpo_data)
+                    })
+                    
+                    total_converted += len(dpo_data)
+                    
+                except Exception as e:
+                    # 转换文件时出错
+                    continue
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
         
         # 批量转换完成
         # 成功转换文件
@@ -6,19 +6,64 @@
 
 import os
 import json
+import mmap
+import time
+import itertools
+import functools
 import shutil
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional, Union
 import streamlit as st
 from datetime import datetime
 
+# 尝试导入Streamlit的脚本上下文工具，后台线程需要绑定上下文才能更新组件
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    add_script_run_ctx = None
+    get_script_run_ctx = None
+
+# 尝试导入orjson，如果不可用则使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 尝试导入ijson，可用时流式校验大文件，避免一次性把整个文件解析到内存
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# 上传文件写入磁盘时每次复制的字节数
+_COPY_BUFFER_SIZE = 1 << 20
+
+# JSON文本第一个非空白字节的所有可能取值（对象、数组、字符串、true/false/null、数字）
+_JSON_FIRST_BYTES = frozenset(b'{["tfn-0123456789')
+_JSON_WHITESPACE = b' \t\r\n'
+_UTF8_BOM = b'\xef\xbb\xbf'
+
+# 超过该大小的上传文件使用ijson流式校验
+_STREAM_VALIDATE_THRESHOLD = 32 << 20
+
+# ijson事件中表示一个值开始的事件类型
+_VALUE_START_EVENTS = frozenset({'start_map', 'start_array', 'string', 'number', 'boolean', 'null'})
+
+# 校验JSON时可能抛出的解析异常（orjson的解析异常是json.JSONDecodeError的子类）
+_JSON_ERRORS = (json.JSONDecodeError, ijson.JSONError) if ijson is not None else (json.JSONDecodeError,)
+
 class FileUploadManager:
     """
     文件上传管理器
     负责处理文件上传、临时文件存储和管理
     """
     
+    # 已确认存在的TMP目录（进程内共享）
+    _ensured_dirs = set()
+    
     def __init__(self, project_root: str = None):
         """
         初始化文件上传管理器
@@ -35,19 +80,29 @@ class FileUploadManager:
         
         # 创建TMP目录
         self.tmp_dir = self.project_root / "TMP"
+        # TMP目录绝对路径的字符串形式，常用方法直接用os.path拼接，避免反复构造Path对象
+        self._tmp_dir_str = str(self.tmp_dir.absolute())
+        # 文件名序号，同一秒内上传的多个文件也不会重名
+        self._seq = itertools.count()
+        # 文件路径 -> ((大小, 修改时间), 数据量)，避免页面每次刷新都重新解析文件
+        self._data_count_cache = {}
         self.ensure_tmp_dir()
     
     def ensure_tmp_dir(self):
         """
-        确保TMP目录存在
+        确保TMP目录存在（同一进程内每个目录只检查一次，Streamlit重新运行脚本时不再重复访问磁盘）
         """
+        if self._tmp_dir_str in FileUploadManager._ensured_dirs:
+            return
         try:
-            self.tmp_dir.mkdir(exist_ok=True)
-            # 创建一个.gitignore文件，避免上传的临时文件被提交到git
-            gitignore_path = self.tmp_dir / ".gitignore"
-            if not gitignore_path.exists():
-                with open(gitignore_path, 'w', encoding='utf-8') as f:
+            os.makedirs(self._tmp_dir_str, exist_ok=True)
+            # 创建一个.gitignore文件，避免上传的临时文件被提交到git（已存在时不覆盖）
+            try:
+                with open(os.path.join(self._tmp_dir_str, ".gitignore"), 'x', encoding='utf-8') as f:
                     f.write("# 忽略所有上传的临时文件\n*\n!.gitignore\n")
+            except FileExistsError:
+                pass
+            FileUploadManager._ensured_dirs.add(self._tmp_dir_str)
         except Exception as e:
             st.error(f"创建TMP目录失败: {str(e)}")
     
@@ -58,7 +113,7 @@ class FileUploadManager:
         Returns:
             TMP目录的绝对路径字符串
         """
-        return str(self.tmp_dir.absolute())
+        return self._tmp_dir_str
     
     def save_uploaded_file(self, uploaded_file, custom_filename: str = None) -> Optional[str]:
         """
@@ -68,6 +123,20 @@ class FileUploadManager:
             uploaded_file: Streamlit上传的文件对象
             custom_filename: 自定义文件名，如果为None则使用原文件名
             
+        Returns:
+            保存的文件路径，如果失败返回None
+        """
+        return self._save_to_dir(uploaded_file, self._tmp_dir_str, custom_filename)
+    
+    def _save_to_dir(self, uploaded_file, save_dir: str, custom_filename: str = None) -> Optional[str]:
+        """
+        保存上传的文件到指定目录（save_uploaded_file和save_uploaded_file_to_folder共用）
+        
+        Args:
+            uploaded_file: Streamlit上传的文件对象
+            save_dir: 保存目录的绝对路径
+            custom_filename: 自定义文件名，如果为None则使用原文件名
+            
         Returns:
             保存的文件路径，如果失败返回None
         """
@@ -83,40 +152,113 @@ class FileUploadManager:
             else:
                 filename = uploaded_file.name
             
-            # 添加时间戳避免文件名冲突
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            name_parts = os.path.splitext(filename)
-            unique_filename = f"{name_parts[0]}_{timestamp}{name_parts[1]}"
+            # 添加时间戳和序号避免文件名冲突
+            unique_filename = self._make_unique_filename(filename)
             
             # 保存文件
-            file_path = self.tmp_dir / unique_filename
+            file_path = os.path.join(save_dir, unique_filename)
             
-            # 验证是否为有效的JSON文件
-            try:
-                file_content = uploaded_file.read()
-                if isinstance(file_content, bytes):
-                    file_content = file_content.decode('utf-8')
-                
-                # 验证JSON格式
-                json.loads(file_content)
-                
-                # 保存文件
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(file_content)
-                
-                return str(file_path.absolute())
-                
-            except json.JSONDecodeError as e:
-                st.error(f"文件 {filename} 不是有效的JSON格式: {str(e)}")
-                return None
-            except UnicodeDecodeError as e:
-                st.error(f"文件 {filename} 编码格式不支持: {str(e)}")
-                return None
+            return self._write_uploaded_file(uploaded_file, file_path, filename)
                 
         except Exception as e:
             st.error(f"保存文件失败: {str(e)}")
             return None
     
+    def _make_unique_filename(self, filename: str) -> str:
+        """
+        在文件名后追加时间戳和递增序号
+        
+        Args:
+            filename: 原文件名
+            
+        Returns:
+            形如 name_20240101_120000_000001.json 的文件名
+        """
+        name, ext = os.path.splitext(filename)
+        return f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{next(self._seq):06d}{ext}"
+    
+    def _write_uploaded_file(self, uploaded_file, file_path: str, filename: str) -> Optional[str]:
+        """
+        把上传的文件分块写入临时文件并校验是否为有效的JSON，通过后再替换为目标文件
+        
+        Args:
+            uploaded_file: Streamlit上传的文件对象
+            file_path: 保存路径
+            filename: 用于提示信息的文件名
+            
+        Returns:
+            保存的文件路径，如果不是有效的JSON文件返回None
+        """
+        # 临时文件名带上线程标识，并发保存同名文件时互不干扰
+        tmp_path = f"{file_path}.{threading.get_ident()}.part"
+        try:
+            # 先检查第一块的开头，CSV、HTML等明显不是JSON的文件不再写入磁盘和完整解析
+            head = uploaded_file.read(_COPY_BUFFER_SIZE)
+            self._check_json_head(head)
+            
+            # 分块复制，不把整个文件读入内存再解码成字符串
+            with open(tmp_path, 'wb') as f:
+                f.write(head)
+                shutil.copyfileobj(uploaded_file, f, _COPY_BUFFER_SIZE)
+            
+            self._validate_json_file(tmp_path)
+            os.replace(tmp_path, file_path)
+            return file_path
+        except UnicodeDecodeError as e:
+            st.error(f"文件 {filename} 编码格式不支持: {str(e)}")
+            return None
+        except _JSON_ERRORS as e:
+            st.error(f"文件 {filename} 不是有效的JSON格式: {str(e)}")
+            return None
+        finally:
+            # 校验失败或写入出错时清理临时文件，已存在的同名文件保持不变
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    
+    @staticmethod
+    def _check_json_head(head: bytes) -> None:
+        """
+        根据第一个非空白字节快速排除明显不是JSON的内容
+        
+        Args:
+            head: 文件开头的字节
+            
+        Raises:
+            json.JSONDecodeError: 第一个非空白字节不可能是JSON值的开头
+        """
+        stripped = head.removeprefix(_UTF8_BOM).lstrip(_JSON_WHITESPACE)
+        if stripped and stripped[0] not in _JSON_FIRST_BYTES:
+            raise json.JSONDecodeError("Expecting value", "", len(head) - len(stripped))
+    
+    @staticmethod
+    def _validate_json_file(file_path: str) -> None:
+        """
+        校验文件是否为有效的JSON
+        
+        大文件在ijson可用时流式解析，只检查语法、不构建对象，内存占用与文件大小无关；
+        其余情况一次性解析：orjson直接解析映射到内存的文件（刚写入的文件仍在页缓存中），
+        不再把内容读入一份字节串。
+        
+        Raises:
+            json.JSONDecodeError、ijson.JSONError或UnicodeDecodeError: 文件不是有效的JSON
+        """
+        with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if ijson is not None and file_size > _STREAM_VALIDATE_THRESHOLD:
+                for _ in ijson.parse(f):
+                    pass
+                return
+            if orjson is not None and file_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                    orjson.loads(view)
+                return
+            content = f.read()
+        # 空文件无法映射，交给解析器给出一致的错误
+        if orjson is not None:
+            orjson.loads(content)
+        else:
+            json.loads(content)
+    
     def save_uploaded_files(self, uploaded_files: List) -> List[str]:
         """
         批量保存上传的文件
@@ -127,14 +269,26 @@ class FileUploadManager:
         Returns:
             成功保存的文件路径列表
         """
-        saved_files = []
+        if len(uploaded_files) <= 1:
+            saved_files = [self.save_uploaded_file(uploaded_file) for uploaded_file in uploaded_files]
+            return [file_path for file_path in saved_files if file_path]
+        
+        # 多个文件并发写入和校验（磁盘读写与orjson解析期间会释放GIL），结果保持上传顺序；
+        # 工作线程绑定当前脚本上下文，校验失败时的st.error才能显示在页面上
+        ctx = get_script_run_ctx() if get_script_run_ctx is not None else None
         
-        for uploaded_file in uploaded_files:
-            file_path = self.save_uploaded_file(uploaded_file)
-            if file_path:
-                saved_files.append(file_path)
+        def bind_script_run_ctx():
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
         
-        return saved_files
+        with ThreadPoolExecutor(
+            max_workers=min(8, len(uploaded_files)),
+            thread_name_prefix="upload",
+            initializer=bind_script_run_ctx
+        ) as executor:
+            saved_files = list(executor.map(self.save_uploaded_file, uploaded_files))
+        
+        return [file_path for file_path in saved_files if file_path]
     
     def list_tmp_files(self) -> List[str]:
         """
@@ -144,12 +298,43 @@ class FileUploadManager:
             JSON文件路径列表
         """
         try:
-            json_files = list(self.tmp_dir.glob("*.json"))
-            return [str(f.absolute()) for f in json_files]
+            return self._list_json_files(self._tmp_dir_str)
         except Exception as e:
             st.error(f"列出临时文件失败: {str(e)}")
             return []
     
+    @staticmethod
+    def _scan_json_entries(target_dir: str) -> List[os.DirEntry]:
+        """
+        列出目录中JSON文件的目录项（与glob一致，忽略隐藏文件）
+        
+        使用os.scandir，文件类型直接取自目录项，不必对每个文件单独stat。
+        
+        Args:
+            target_dir: 目录的绝对路径
+            
+        Returns:
+            JSON文件的目录项列表
+        """
+        with os.scandir(target_dir) as entries:
+            return [
+                entry for entry in entries
+                if entry.name.endswith('.json') and not entry.name.startswith('.') and entry.is_file()
+            ]
+    
+    @classmethod
+    def _list_json_files(cls, target_dir: str) -> List[str]:
+        """
+        列出目录中的JSON文件
+        
+        Args:
+            target_dir: 目录的绝对路径
+            
+        Returns:
+            JSON文件路径列表
+        """
+        return [entry.path for entry in cls._scan_json_entries(target_dir)]
+    
     def delete_tmp_file(self, file_path: str) -> bool:
         """
         删除指定的临时文件
@@ -161,9 +346,9 @@ class FileUploadManager:
             删除是否成功
         """
         try:
-            file_path = Path(file_path)
-            if file_path.exists() and file_path.parent == self.tmp_dir:
-                file_path.unlink()
+            file_path = os.path.abspath(file_path)
+            if os.path.dirname(file_path) == self._tmp_dir_str and os.path.exists(file_path):
+                os.unlink(file_path)
                 return True
             return False
         except Exception as e:
@@ -178,12 +363,16 @@ class FileUploadManager:
             清空是否成功
         """
         try:
-            for file_path in self.tmp_dir.iterdir():
-                if file_path.name != ".gitignore":
-                    if file_path.is_file():
-                        file_path.unlink()
-                    elif file_path.is_dir():
-                        shutil.rmtree(file_path)
+            # 文件类型取自目录项，不对每个条目单独stat；子目录交给shutil.rmtree
+            # （Linux下基于文件描述符和scandir遍历，且不会跟随符号链接）
+            with os.scandir(self._tmp_dir_str) as entries:
+                for entry in entries:
+                    if entry.name == ".gitignore":
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
             return True
         except Exception as e:
             st.error(f"清空临时目录失败: {str(e)}")
@@ -200,12 +389,12 @@ class FileUploadManager:
             创建是否成功
         """
         try:
-            folder_path = self.tmp_dir / folder_name
-            if folder_path.exists():
+            folder_path = os.path.join(self._tmp_dir_str, folder_name)
+            if os.path.exists(folder_path):
                 st.warning(f"文件夹 '{folder_name}' 已存在")
                 return False
             
-            folder_path.mkdir(parents=True, exist_ok=True)
+            os.makedirs(folder_path, exist_ok=True)
             return True
         except Exception as e:
             st.error(f"创建文件夹失败: {str(e)}")
@@ -219,10 +408,12 @@ class FileUploadManager:
             文件夹名称列表
         """
         try:
-            folders = []
-            for item in self.tmp_dir.iterdir():
-                if item.is_dir() and item.name != ".git":
-                    folders.append(item.name)
+            # 目录项自带文件类型，判断是否为文件夹无需额外的stat；跳过.git等隐藏文件夹
+            with os.scandir(self._tmp_dir_str) as entries:
+                folders = [
+                    entry.name for entry in entries
+                    if not entry.name.startswith('.') and entry.is_dir()
+                ]
             return sorted(folders)
         except Exception as e:
             st.error(f"列出文件夹失败: {str(e)}")
@@ -240,30 +431,51 @@ class FileUploadManager:
             移动是否成功
         """
         try:
-            source_path = Path(file_path)
+            file_name = os.path.basename(file_path)
             
             # 确定目标文件夹
             if folder_name and folder_name.strip():
-                target_folder = self.tmp_dir / folder_name
-                # 确保目标文件夹存在
-                if not target_folder.exists():
-                    target_folder.mkdir(parents=True, exist_ok=True)
+                target_folder = os.path.join(self._tmp_dir_str, folder_name)
             else:
                 # 移动到根目录
-                target_folder = self.tmp_dir
+                target_folder = self._tmp_dir_str
             
-            # 移动文件
-            target_path = target_folder / source_path.name
-            if target_path.exists():
-                st.warning(f"目标位置已存在同名文件: {source_path.name}")
+            # 移动文件：先建立硬链接再删除源文件，目标已存在时硬链接原子地失败，
+            # 不必预先检查同名文件，也不会在检查与重命名之间被其他上传覆盖
+            target_path = os.path.join(target_folder, file_name)
+            try:
+                self._link_no_clobber(file_path, target_path)
+            except FileExistsError:
+                st.warning(f"目标位置已存在同名文件: {file_name}")
                 return False
+            except FileNotFoundError:
+                if os.path.isdir(target_folder):
+                    raise
+                # 目标文件夹不存在时创建后重试
+                os.makedirs(target_folder, exist_ok=True)
+                self._link_no_clobber(file_path, target_path)
             
-            source_path.rename(target_path)
+            os.unlink(file_path)
             return True
         except Exception as e:
             st.error(f"移动文件失败: {str(e)}")
             return False
     
+    @staticmethod
+    def _link_no_clobber(source: str, target: str) -> None:
+        """
+        为source建立指向target的硬链接，目标已存在时抛出FileExistsError
+        
+        文件系统不支持硬链接时退回到复制，同样在目标已存在时失败。
+        """
+        try:
+            os.link(source, target)
+        except (FileExistsError, FileNotFoundError):
+            raise
+        except OSError:
+            with open(source, 'rb') as src, open(target, 'xb') as dst:
+                shutil.copyfileobj(src, dst, _COPY_BUFFER_SIZE)
+    
     def list_files_in_folder(self, folder_name: str = None) -> List[str]:
         """
         列出指定文件夹中的JSON文件
@@ -276,15 +488,44 @@ class FileUploadManager:
         """
         try:
             if folder_name:
-                target_dir = self.tmp_dir / folder_name
+                target_dir = os.path.join(self._tmp_dir_str, folder_name)
             else:
-                target_dir = self.tmp_dir
+                target_dir = self._tmp_dir_str
             
-            if not target_dir.exists():
-                return []
+            return self._list_json_files(target_dir)
+        except FileNotFoundError:
+            # 文件夹不存在
+            return []
+        except Exception as e:
+            st.error(f"列出文件失败: {str(e)}")
+            return []
+    
+    def list_files_with_info(self, folder_name: str = None) -> List[tuple]:
+        """
+        列出指定文件夹中的JSON文件及其信息
+        
+        一次scandir同时得到路径和文件信息，文件信息取自目录项缓存的stat结果，
+        不必再按路径逐个stat。
+        
+        Args:
+            folder_name: 文件夹名称，如果为None则列出根目录文件
+            
+        Returns:
+            (文件路径, 文件信息字典) 列表
+        """
+        try:
+            if folder_name:
+                target_dir = os.path.join(self._tmp_dir_str, folder_name)
+            else:
+                target_dir = self._tmp_dir_str
             
-            json_files = list(target_dir.glob("*.json"))
-            return [str(f.absolute()) for f in json_files]
+            return [
+                (entry.path, self.get_file_info_from_entry(entry))
+                for entry in self._scan_json_entries(target_dir)
+            ]
+        except FileNotFoundError:
+            # 文件夹不存在
+            return []
         except Exception as e:
             st.error(f"列出文件失败: {str(e)}")
             return []
@@ -300,11 +541,13 @@ class FileUploadManager:
             删除是否成功
         """
         try:
-            folder_path = self.tmp_dir / folder_name
-            if folder_path.exists() and folder_path.is_dir():
+            folder_path = os.path.join(self._tmp_dir_str, folder_name)
+            try:
                 shutil.rmtree(folder_path)
-                return True
-            return False
+            except (FileNotFoundError, NotADirectoryError):
+                # 文件夹不存在或不是文件夹
+                return False
+            return True
         except Exception as e:
             st.error(f"删除文件夹失败: {str(e)}")
             return False
@@ -321,58 +564,21 @@ class FileUploadManager:
         Returns:
             保存的文件路径，如果失败返回None
         """
-        try:
-            if uploaded_file is None:
-                return None
-            
-            # 确定保存目录
-            if folder_name:
-                save_dir = self.tmp_dir / folder_name
-                save_dir.mkdir(parents=True, exist_ok=True)
-            else:
-                save_dir = self.tmp_dir
-            
-            # 确定文件名
-            if custom_filename:
-                filename = custom_filename
-                if not filename.endswith('.json'):
-                    filename += '.json'
-            else:
-                filename = uploaded_file.name
-            
-            # 添加时间戳避免文件名冲突
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            name_parts = os.path.splitext(filename)
-            unique_filename = f"{name_parts[0]}_{timestamp}{name_parts[1]}"
-            
-            # 保存文件
-            file_path = save_dir / unique_filename
-            
-            # 验证是否为有效的JSON文件
+        if uploaded_file is None:
+            return None
+        
+        # 确定保存目录
+        if folder_name:
+            save_dir = os.path.join(self._tmp_dir_str, folder_name)
             try:
-                file_content = uploaded_file.read()
-                if isinstance(file_content, bytes):
-                    file_content = file_content.decode('utf-8')
-                
-                # 验证JSON格式
-                json.loads(file_content)
-                
-                # 保存文件
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(file_content)
-                
-                return str(file_path.absolute())
-                
-            except json.JSONDecodeError as e:
-                st.error(f"文件 {filename} 不是有效的JSON格式: {str(e)}")
-                return None
-            except UnicodeDecodeError as e:
-                st.error(f"文件 {filename} 编码格式不支持: {str(e)}")
+                os.makedirs(save_dir, exist_ok=True)
+            except Exception as e:
+                st.error(f"保存文件失败: {str(e)}")
                 return None
-                
-        except Exception as e:
-            st.error(f"保存文件失败: {str(e)}")
-            return None
+        else:
+            save_dir = self._tmp_dir_str
+        
+        return self._save_to_dir(uploaded_file, save_dir, custom_filename)
     
     def get_file_info(self, file_path: str) -> dict:
         """
@@ -385,32 +591,95 @@ class FileUploadManager:
             包含文件信息的字典
         """
         try:
-            file_path = Path(file_path)
-            if not file_path.exists():
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
                 return {}
             
-            stat = file_path.stat()
+            return self._build_file_info(file_path, os.path.basename(file_path), stat)
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def get_file_info_from_entry(self, entry: os.DirEntry) -> dict:
+        """
+        根据scandir返回的目录项获取文件信息
+        
+        Args:
+            entry: 文件的目录项
+            
+        Returns:
+            包含文件信息的字典
+        """
+        try:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                return {}
             
+            return self._build_file_info(entry.path, entry.name, stat)
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def _build_file_info(self, file_path: str, name: str, stat: os.stat_result) -> dict:
+        """
+        根据stat结果构造文件信息字典
+        
+        数据量按(大小, 修改时间)缓存，文件未变化时页面刷新不必重新解析整个JSON文件。
+        """
+        cache_key = (stat.st_size, stat.st_mtime_ns)
+        cached = self._data_count_cache.get(file_path)
+        if cached is not None and cached[0] == cache_key:
+            data_count = cached[1]
+        else:
             # 尝试读取JSON文件获取数据量
             data_count = 0
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        data_count = len(data)
-                    else:
-                        data_count = 1
+                data_count = self._count_json_items(file_path, stat.st_size)
             except:
                 pass
-            
-            return {
-                'name': file_path.name,
-                'size': stat.st_size,
-                'modified': datetime.fromtimestamp(stat.st_mtime),
-                'data_count': data_count
-            }
-        except Exception as e:
-            return {'error': str(e)}
+            self._data_count_cache[file_path] = (cache_key, data_count)
+        
+        return {
+            'name': name,
+            'size': stat.st_size,
+            'modified': datetime.fromtimestamp(stat.st_mtime),
+            'data_count': data_count
+        }
 
-# 全局文件上传管理器实例
-file_upload_manager = FileUploadManager()
\ No newline at end of file
+    @staticmethod
+    def _count_json_items(file_path: str, file_size: int) -> int:
+        """
+        统计JSON文件中的数据量：顶层为数组时返回元素个数，否则返回1
+        
+        大文件在ijson可用时流式统计顶层数组的元素，不构建对象；其余情况一次性解析
+        （orjson直接解析映射到内存的文件）。
+        
+        Args:
+            file_path: 文件路径
+            file_size: 文件大小（字节）
+        """
+        with open(file_path, 'rb') as f:
+            if ijson is not None and file_size > _STREAM_VALIDATE_THRESHOLD:
+                events = ijson.parse(f)
+                _, first_event, _ = next(events)
+                if first_event != 'start_array':
+                    return 1
+                # 前缀为item的值开始事件对应顶层数组的一个元素
+                return sum(1 for prefix, event, _ in events if prefix == 'item' and event in _VALUE_START_EVENTS)
+            if orjson is not None and file_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                    data = orjson.loads(view)
+            else:
+                content = f.read()
+                data = orjson.loads(content) if orjson is not None else json.loads(content)
+        return len(data) if isinstance(data, list) else 1
+
+@functools.lru_cache(maxsize=1)
+def get_file_upload_manager() -> FileUploadManager:
+    """
+    获取全局文件上传管理器实例（首次调用时才创建，导入模块不再访问磁盘）
+    
+    Returns:
+        文件上传管理器实例
+    """
+    return FileUploadManager()
@@ -3,7 +3,44 @@
 模型调用模块，用于调用大语言模型
 """
 from typing import Dict, List, Any, Optional, Union
+import asyncio
+import json
+import logging
+import random
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+# 尝试导入h2，可用时OpenAI兼容客户端启用HTTP/2，在同一连接上复用多个并发请求
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+# Ollama请求结束后模型在显存中保留的时间，批量生成期间不必反复加载模型
+_OLLAMA_KEEP_ALIVE = '10m'
+# Ollama请求的固定参数和提示词后缀，所有请求共用，不在每次调用时重新构造
+_OLLAMA_OPTIONS = MappingProxyType({'stream': False, 'think': False})
+_OLLAMA_NO_THINK_SUFFIX = ",'/no_think'"
+
+# OpenAI兼容客户端的连接池配置：空闲连接保留30秒，两轮生成之间不必重新握手
+_HTTP_POOL_LIMITS = dict(max_connections=64, max_keepalive_connections=32, keepalive_expiry=30.0)
+# 与OpenAI SDK默认值一致：生成可能较慢，整体超时放宽，连接超时保持较短
+_HTTP_TIMEOUT = dict(timeout=600.0, connect=5.0)
+
+# 值得重试的HTTP状态码（超时、冲突、限流及服务端临时错误）
+_RETRYABLE_STATUS_CODES = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+# 预编译的代码块匹配模式
+_JSON_FENCE_PATTERN = re.compile(r'```json\s*(\{.*\})\s*```', re.DOTALL)
+_GENERAL_FENCE_PATTERN = re.compile(r'```\s*(.*?)\s*```', re.DOTALL)
+
+# 模型回复中常见的多余前缀和后缀（已转为小写）
+_RESPONSE_PREFIXES = tuple(p.lower() for p in ["以下是生成的", "这是", "生成的", "以下是", "json"])
+_RESPONSE_SUFFIXES = tuple(s.lower() for s in ["希望这对你有帮助", "希望这能满足你的需求", "如有需要"])
 
 class ModelCaller:
     """
@@ -17,6 +54,134 @@ class ModelCaller:
             model_name: 模型名称
         """
         self.model_name = model_name
+        # 可选的限流器，每次发送请求前获取令牌，收到429限流响应时通知其暂停发送请求
+        self.rate_limiter = None
+        # 临时性错误的最大重试次数及指数退避的基础/最大等待秒数
+        self.max_retries = 3
+        self.retry_base_delay = 1.0
+        self.retry_max_delay = 30.0
+        # generate_batch并发请求时的最大线程数
+        self.batch_concurrency = 8
+    
+    @staticmethod
+    def _get_retry_after(error: Exception) -> Optional[float]:
+        """
+        读取异常响应头中的Retry-After秒数
+        
+        Args:
+            error: 模型调用时捕获的异常
+            
+        Returns:
+            Retry-After秒数，没有该响应头时返回None
+        """
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+        if headers:
+            try:
+                return float(headers.get('retry-after'))
+            except (TypeError, ValueError):
+                pass
+        return None
+    
+    def _report_rate_limit(self, error: Exception) -> None:
+        """
+        如果异常是429限流响应，则按Retry-After通知限流器暂停
+        
+        Args:
+            error: 模型调用时捕获的异常
+        """
+        if self.rate_limiter is None or getattr(error, 'status_code', None) != 429:
+            return
+        
+        retry_after = self._get_retry_after(error)
+        self.rate_limiter.penalize(retry_after if retry_after is not None else 1.0)
+    
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """
+        判断异常是否为值得重试的临时性错误
+        
+        带状态码的异常只重试超时、限流和5xx等临时错误（其余4xx视为永久错误）；
+        不带状态码的异常只重试连接失败和超时。
+        
+        Args:
+            error: 模型调用时捕获的异常
+        """
+        status_code = getattr(error, 'status_code', None)
+        if isinstance(status_code, int):
+            return status_code in _RETRYABLE_STATUS_CODES
+        if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+            return True
+        # 各SDK的连接/超时异常不继承内置异常，按类名识别
+        name = type(error).__name__
+        return 'Timeout' in name or 'Connect' in name
+    
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """
+        计算第attempt次重试前的等待秒数，优先使用Retry-After，否则为带抖动的指数退避
+        """
+        retry_after = self._get_retry_after(error)
+        if retry_after is not None:
+            return min(self.retry_max_delay, retry_after)
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+    
+    def _handle_failure(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        处理一次失败的调用
+        
+        Returns:
+            重试前需要等待的秒数；不再重试时返回None
+        """
+        self._report_rate_limit(error)
+        if attempt < self.max_retries and self._is_retryable(error):
+            return self._retry_delay(attempt, error)
+        logger.warning(
+            "模型 %s 调用失败（%s，已尝试%d次）: %s",
+            self.model_name, type(error).__name__, attempt + 1, error
+        )
+        return None
+    
+    def _call_with_retry(self, func, prompt: str) -> str:
+        """
+        调用模型，临时性错误按指数退避重试，最终失败时返回空字符串
+        
+        Args:
+            func: 实际发起请求的函数，失败时抛出异常
+            prompt: 提示词
+        """
+        attempt = 0
+        while True:
+            try:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                return func(prompt)
+            except Exception as e:
+                delay = self._handle_failure(e, attempt)
+                if delay is None:
+                    return ""
+                time.sleep(delay)
+                attempt += 1
+    
+    async def _acall_with_retry(self, func, prompt: str) -> str:
+        """
+        异步调用模型，临时性错误按指数退避重试，最终失败时返回空字符串
+        
+        Args:
+            func: 实际发起请求的协程函数，失败时抛出异常
+            prompt: 提示词
+        """
+        attempt = 0
+        while True:
+            try:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.aacquire()
+                return await func(prompt)
+            except Exception as e:
+                delay = self._handle_failure(e, attempt)
+                if delay is None:
+                    return ""
+                await asyncio.sleep(delay)
+                attempt += 1
     
     def generate(self, prompt: str) -> str:
         """
@@ -29,6 +194,71 @@ class ModelCaller:
             生成的文本
         """
         raise NotImplementedError("子类必须实现此方法")
+    
+    async def agenerate(self, prompt: str) -> str:
+        """
+        异步生成文本，默认在线程中调用同步的generate
+        
+        Args:
+            prompt: 提示词
+            
+        Returns:
+            生成的文本
+        """
+        return await asyncio.to_thread(self.generate, prompt)
+    
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        """
+        批量生成文本，默认逐条调用generate
+        
+        支持一次请求处理多个提示词的后端（如vLLM、TGI）可以重写此方法，
+        以分摊每次HTTP请求的开销。
+        
+        Args:
+            prompts: 提示词列表
+            
+        Returns:
+            与提示词一一对应的生成文本列表
+        """
+        return [self.generate(prompt) for prompt in prompts]
+    
+    def _generate_concurrently(self, prompts: List[str]) -> List[str]:
+        """
+        在线程池中并发调用generate，结果与提示词顺序一致
+        
+        供客户端线程安全、支持连接复用的子类实现generate_batch，
+        N个提示词的耗时从N次往返降为约N/batch_concurrency次。
+        
+        Args:
+            prompts: 提示词列表
+            
+        Returns:
+            与提示词一一对应的生成文本列表
+        """
+        if len(prompts) <= 1:
+            return [self.generate(prompt) for prompt in prompts]
+        with ThreadPoolExecutor(
+            max_workers=min(self.batch_concurrency, len(prompts)),
+            thread_name_prefix="generate_batch"
+        ) as executor:
+            return list(executor.map(self.generate, prompts))
+    
+    def check_connectivity(self) -> None:
+        """
+        检查模型服务是否可用，默认发起一次简短的生成请求
+        
+        Raises:
+            RuntimeError: 模型无响应时
+        """
+        test_response = self.generate("测试连接，请回复'连接成功'")
+        if not test_response or test_response.strip() == "":
+            raise RuntimeError("模型无响应")
+    
+    async def aclose(self) -> None:
+        """
+        关闭异步客户端，释放连接池
+        """
+        pass
 
 
 class OllamaModelCaller(ModelCaller):
@@ -43,9 +273,12 @@ class OllamaModelCaller(ModelCaller):
             model_name: Ollama模型名称
         """
         super().__init__(model_name)
+        self._async_client = None
         try:
-            from ollama import chat
-            self.chat = chat
+            from ollama import Client
+            # 调用器持有自己的客户端：连接在多次请求间复用，并设置与OpenAI兼容接口一致的超时，
+            # 避免服务卡死时请求永远挂起（默认客户端不设超时）
+            self.client = Client(timeout=_HTTP_TIMEOUT['timeout'])
             # 成功初始化Ollama模型
         except ImportError:
             raise ImportError("请安装ollama包: pip install ollama")
@@ -60,24 +293,79 @@ class OllamaModelCaller(ModelCaller):
         Returns:
             生成的文本
         """
-        try:
-            response = self.chat(
-                model=self.model_name, 
-                messages=[
-                    {
-                        'role': 'user',
-                        'content': f"{prompt},'/no_think'",
-                    }
-                ],
-                options={
-                    'stream': False,
-                    'think': False
-                }
-            )
-            return response['message']['content']
-        except Exception as e:
-            # Ollama模型调用失败
-            return ""
+        return self._call_with_retry(self._chat_once, prompt)
+    
+    @staticmethod
+    def _build_messages(prompt: str) -> List[Dict[str, str]]:
+        """
+        构造Ollama请求的消息列表（同步和异步请求共用）
+        """
+        return [{'role': 'user', 'content': prompt + _OLLAMA_NO_THINK_SUFFIX}]
+    
+    def _chat_once(self, prompt: str) -> str:
+        """
+        发起一次Ollama请求，失败时抛出异常
+        """
+        response = self.client.chat(
+            model=self.model_name, 
+            messages=self._build_messages(prompt),
+            options=_OLLAMA_OPTIONS,
+            keep_alive=_OLLAMA_KEEP_ALIVE
+        )
+        return response['message']['content']
+    
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        """
+        并发生成多个提示词的文本（Ollama服务端会按OLLAMA_NUM_PARALLEL并行处理）
+        
+        Args:
+            prompts: 提示词列表
+            
+        Returns:
+            与提示词一一对应的生成文本列表
+        """
+        return self._generate_concurrently(prompts)
+    
+    def check_connectivity(self) -> None:
+        """
+        通过查询模型信息确认Ollama服务在运行且模型已下载，不触发推理
+        """
+        self.client.show(self.model_name)
+    
+    async def agenerate(self, prompt: str) -> str:
+        """
+        使用Ollama异步客户端生成文本
+        
+        Args:
+            prompt: 提示词
+            
+        Returns:
+            生成的文本
+        """
+        return await self._acall_with_retry(self._achat_once, prompt)
+    
+    async def _achat_once(self, prompt: str) -> str:
+        """
+        发起一次Ollama异步请求，失败时抛出异常
+        """
+        if self._async_client is None:
+            from ollama import AsyncClient
+            self._async_client = AsyncClient(timeout=_HTTP_TIMEOUT['timeout'])
+        response = await self._async_client.chat(
+            model=self.model_name, 
+            messages=self._build_messages(prompt),
+            options=_OLLAMA_OPTIONS,
+            keep_alive=_OLLAMA_KEEP_ALIVE
+        )
+        return response['message']['content']
+    
+    async def aclose(self) -> None:
+        """
+        关闭Ollama异步客户端
+        """
+        client, self._async_client = self._async_client, None
+        if client is not None and hasattr(client, 'close'):
+            await client.close()
 
 
 class OpenAICompatibleModelCaller(ModelCaller):
@@ -94,15 +382,39 @@ class OpenAICompatibleModelCaller(ModelCaller):
             base_url: API Base URL
         """
         super().__init__(model_name)
+        self.api_key = api_key
+        self.base_url = base_url
+        self._async_client = None
         try:
             from openai import OpenAI
-            self.client = OpenAI(api_key=api_key, base_url=base_url)
+            import httpx
+            # 重试由_call_with_retry统一处理，关闭SDK内置重试避免重试次数叠加；
+            # 显式传入长期复用的httpx客户端，连接池和HTTP/2配置与异步客户端一致
+            self.client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=httpx.Client(**self._http_client_options())
+            )
             # 成功初始化 OpenAI 兼容模型
         except ImportError:
             raise ImportError("请安装 openai 包: pip install openai")
         except Exception as e:
             raise RuntimeError(f"初始化 OpenAI 兼容模型失败: {str(e)}")
 
+    @staticmethod
+    def _http_client_options() -> Dict[str, Any]:
+        """
+        构造httpx客户端的参数（同步和异步客户端共用）
+        """
+        import httpx
+        return {
+            'http2': h2 is not None,
+            'limits': httpx.Limits(**_HTTP_POOL_LIMITS),
+            'timeout': httpx.Timeout(**_HTTP_TIMEOUT),
+            'follow_redirects': True,
+        }
+
     def generate(self, prompt: str) -> str:
         """
         使用 OpenAI 兼容模型生成文本
@@ -113,18 +425,89 @@ class OpenAICompatibleModelCaller(ModelCaller):
         Returns:
             生成的文本
         """
+        return self._call_with_retry(self._chat_once, prompt)
+    
+    def _chat_once(self, prompt: str) -> str:
+        """
+        发起一次 OpenAI 兼容请求，失败时抛出异常
+        """
+        chat_completion = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7, # 可以根据需要调整
+        )
+        return chat_completion.choices[0].message.content
+    
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        """
+        并发生成多个提示词的文本，请求共用同一个连接池
+        
+        Args:
+            prompts: 提示词列表
+            
+        Returns:
+            与提示词一一对应的生成文本列表
+        """
+        return self._generate_concurrently(prompts)
+    
+    def check_connectivity(self) -> None:
+        """
+        通过查询模型信息确认 API 可用，不触发推理
+        
+        部分兼容服务未实现模型查询接口，此时退回到一次简短的生成请求。
+        """
+        from openai import APIStatusError
         try:
-            chat_completion = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7, # 可以根据需要调整
+            self.client.models.retrieve(self.model_name)
+        except APIStatusError as e:
+            # 鉴权失败直接报错，其余状态码（如接口未实现）改用生成请求验证
+            if e.status_code in (401, 403):
+                raise
+            super().check_connectivity()
+    
+    async def agenerate(self, prompt: str) -> str:
+        """
+        使用 OpenAI 兼容的异步客户端生成文本，同一轮生成内复用连接池
+        
+        Args:
+            prompt: 提示词
+            
+        Returns:
+            生成的文本
+        """
+        return await self._acall_with_retry(self._achat_once, prompt)
+    
+    async def _achat_once(self, prompt: str) -> str:
+        """
+        发起一次 OpenAI 兼容异步请求，失败时抛出异常
+        """
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            import httpx
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                http_client=httpx.AsyncClient(**self._http_client_options())
             )
-            return chat_completion.choices[0].message.content
-        except Exception as e:
-            # OpenAI 兼容模型调用失败
-            return ""
+        chat_completion = await self._async_client.chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+        )
+        return chat_completion.choices[0].message.content
+    
+    async def aclose(self) -> None:
+        """
+        关闭 OpenAI 兼容的异步客户端
+        """
+        client, self._async_client = self._async_client, None
+        if client is not None:
+            await client.close()
 
 
 class ModelCallerFactory:
@@ -132,7 +515,13 @@ class ModelCallerFactory:
     模型调用器工厂，用于创建不同类型的模型调用器
     """
     @staticmethod
-    def create(model_type: str, model_name: str, api_key: Optional[str] = None, base_url: Optional[str] = None) -> ModelCaller:
+    def create(
+        model_type: str,
+        model_name: str,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        validate: bool = False
+    ) -> ModelCaller:
         """
         创建模型调用器
         
@@ -141,6 +530,7 @@ class ModelCallerFactory:
             model_name: 模型名称
             api_key: (可选) API Key，用于 OpenAI 兼容模型
             base_url: (可选) API Base URL，用于 OpenAI 兼容模型
+            validate: 是否在创建后测试模型连通性
             
         Returns:
             模型调用器实例
@@ -153,8 +543,9 @@ class ModelCallerFactory:
         else:
             raise ValueError(f"不支持的模型类型: {model_type}")
         
-        # 测试模型连通性
-        ModelCallerFactory.test_model_connectivity(model_caller)
+        # 按需测试模型连通性
+        if validate:
+            ModelCallerFactory.test_model_connectivity(model_caller)
         return model_caller
     
     @staticmethod
@@ -172,11 +563,8 @@ class ModelCallerFactory:
             RuntimeError: 当模型连通性测试失败时
         """
         try:
-            # 正在测试模型连通性
-            test_response = model_caller.generate("测试连接，请回复'连接成功'")
-            
-            if not test_response or test_response.strip() == "":
-                raise RuntimeError(f"模型 {model_caller.model_name} 连通性测试失败：模型无响应")
+            # 正在测试模型连通性（各调用器优先使用不触发推理的轻量接口）
+            model_caller.check_connectivity()
             
             # 模型连通性测试成功
             return True
@@ -201,26 +589,25 @@ def extract_content_between_backticks(text: str) -> str:
     Returns:
         提取的内容
     """
-    import json
-    # 优先匹配 ```json\n{...}\n``` 格式
-    json_pattern = r'```json\s*(\{.*\})\s*```'
-    json_match = re.search(json_pattern, text, re.DOTALL)
-    if json_match:
-        return json_match.group(1).strip()
-
-    # 其次匹配 ```\n{...}\n``` 格式
-    general_pattern = r'```\s*(.*?)\s*```'
-    general_match = re.search(general_pattern, text, re.DOTALL)
-    if general_match:
-        content = general_match.group(1).strip()
-        # 如果提取到的内容以 "json\n" 开头，尝试去除
-        if content.lower().startswith("json\n"):
-            content = content[5:].strip()
-        return content
+    # 只有包含反引号时才需要运行正则
+    if "```" in text:
+        # 优先匹配 ```json\n{...}\n``` 格式
+        json_match = _JSON_FENCE_PATTERN.search(text)
+        if json_match:
+            return json_match.group(1).strip()
+
+        # 其次匹配 ```\n{...}\n``` 格式
+        general_match = _GENERAL_FENCE_PATTERN.search(text)
+        if general_match:
+            content = general_match.group(1).strip()
+            # 如果提取到的内容以 "json\n" 开头，尝试去除
+            if content[:5].lower() == "json\n":
+                content = content[5:].strip()
+            return content
 
     # 如果没有匹配到反引号，尝试直接处理文本
     # 检查是否以 "json\n" 开头，并尝试解析为 JSON
-    if text.lower().startswith("json\n"):
+    if text[:5].lower() == "json\n":
         potential_json_str = text[5:].strip()
         try:
             # 尝试解析为 JSON，如果成功，返回 JSON 字符串
@@ -229,17 +616,15 @@ def extract_content_between_backticks(text: str) -> str:
         except json.JSONDecodeError:
             pass # 不是有效的 JSON，继续处理
 
-    # 尝试去除常见的前缀和后缀
+    # 尝试去除常见的前缀和后缀（只对首尾片段转小写，不再反复转换整段文本）
     cleaned_text = text
-    prefixes = ["以下是生成的", "这是", "生成的", "以下是", "json"]
-    for prefix in prefixes:
-        if cleaned_text.lower().startswith(prefix.lower()):
+    for prefix in _RESPONSE_PREFIXES:
+        if cleaned_text[:len(prefix)].lower() == prefix:
             cleaned_text = cleaned_text[len(prefix):].lstrip()
     
-    # 去除可能的后缀
-    suffixes = ["希望这对你有帮助", "希望这能满足你的需求", "如有需要"]
-    for suffix in suffixes:
-        if cleaned_text.lower().endswith(suffix.lower()):
-            cleaned_text = cleaned_text[:cleaned_text.lower().find(suffix.lower())].rstrip()
+    # 去除可能的后缀（已确认位于末尾，直接按长度截掉，不必把整段文本转小写再查找）
+    for suffix in _RESPONSE_SUFFIXES:
+        if cleaned_text[-len(suffix):].lower() == suffix:
+            cleaned_text = cleaned_text[:-len(suffix)].rstrip()
     
-    return cleaned_text.strip()
\ No newline at end of file
+    return cleaned_text.strip()
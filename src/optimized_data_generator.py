@@ -3,33 +3,56 @@
 优化的数据生成器模块
 支持内存优化（实时存储）和断点续传功能
 """
+import gzip
 import json
 import os
+import queue
 import time
 import threading
+import zlib
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import streamlit as st
 from tqdm import tqdm
 
 from .data_generator import DataGenerator
-from .data_loader import DataLoader
+from .checkpoint_writer import CheckpointWriter
+from .data_loader import DataLoader, _dump_json_bytes, _write_bytes_atomic
 from .model_caller import ModelCallerFactory
+from .utils import _RecordWriter
 from config.config import *
 from config.prompt_config import prompt_manager
 
+# 尝试导入orjson，如果不可用则使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class OptimizedDataGenerator(DataGenerator):
     """优化的数据生成器，支持内存优化和断点续传"""
     
+    # 检查点在内存中更新，每完成这么多样本或经过这么多秒才写入磁盘一次
+    CHECKPOINT_FLUSH_INTERVAL = 16
+    CHECKPOINT_FLUSH_SECONDS = 2.0
+    
     def __init__(self, data_loader: DataLoader, model_caller_type: str, model_name: str, 
                  api_key: str = None, base_url: str = None):
         super().__init__(data_loader, model_caller_type, model_name, api_key, base_url)
         self.checkpoint_dir = os.path.join(PROJECT_ROOT, "checkpoints")
         self.ensure_checkpoint_dir()
         self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        # 生成过程中保持打开的输出文件（带1MB缓冲区），不必每个样本重新打开一次
+        self._out_fh = None
+        # gzip输出文件的tell()只统计本次打开后写入的未压缩字节，续传时加上已有内容的长度
+        self._out_base = 0
+        # 后台检查点写入线程及其队列（长度为1，只保留最新的检查点）
+        self._ckpt_queue = None
+        self._ckpt_thread = None
     
     def ensure_checkpoint_dir(self):
         """确保检查点目录存在"""
@@ -44,9 +67,10 @@ class OptimizedDataGenerator(DataGenerator):
     def save_checkpoint(self, checkpoint_file: str, checkpoint_data: Dict):
         """保存检查点"""
         try:
-            with self._lock:
-                with open(checkpoint_file, 'w', encoding='utf-8') as f:
-                    json.dump(checkpoint_data, f, ensure_ascii=False, indent=2)
+            payload = _dump_json_bytes(checkpoint_data, pretty=False)
+            with self._checkpoint_lock:
+                # 写入临时文件后替换，崩溃时不会留下写了一半的检查点
+                _write_bytes_atomic(checkpoint_file, payload, fsync=CHECKPOINT_FSYNC)
         except Exception as e:
             print(f"保存检查点失败: {e}")
     
@@ -54,12 +78,100 @@ class OptimizedDataGenerator(DataGenerator):
         """加载检查点"""
         try:
             if os.path.exists(checkpoint_file):
-                with open(checkpoint_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(checkpoint_file, 'rb') as f:
+                    return self._loads(f.read())
         except Exception as e:
             print(f"加载检查点失败: {e}")
         return None
     
+    def _maybe_flush_checkpoint(self, checkpoint_file: str, force: bool = False):
+        """
+        按批把内存中的检查点写入磁盘
+        
+        Args:
+            checkpoint_file: 检查点文件路径
+            force: 是否忽略批量间隔立即写入
+        """
+        completed_count = self._checkpoint_state['completed_count']
+        now = time.monotonic()
+        if not force and completed_count - self._last_flush_count < self.CHECKPOINT_FLUSH_INTERVAL \
+                and now - self._last_flush_time < self.CHECKPOINT_FLUSH_SECONDS:
+            return
+        self._checkpoint_state['last_update'] = datetime.now().isoformat()
+        # 记录此时输出文件的长度，续传时截掉之后追加但未计入检查点的样本；
+        # 这里只把缓冲区写入文件，同步磁盘和写检查点交给后台线程，生成线程不等待磁盘IO
+        with self._lock:
+            self._out_fh.flush()
+            self._checkpoint_state['output_size'] = self._out_base + self._out_fh.tell()
+        self._enqueue_checkpoint(checkpoint_file, dict(self._checkpoint_state))
+        self._last_flush_count = completed_count
+        self._last_flush_time = now
+    
+    def _start_checkpoint_writer(self):
+        """启动后台检查点写入线程"""
+        self._ckpt_queue = queue.Queue(maxsize=1)
+        self._ckpt_thread = threading.Thread(target=self._checkpoint_writer_loop, daemon=True)
+        self._ckpt_thread.start()
+    
+    def _stop_checkpoint_writer(self):
+        """通知后台检查点写入线程退出，并等待队列中的检查点写完"""
+        if self._ckpt_thread is None:
+            return
+        self._ckpt_queue.put(None)
+        self._ckpt_thread.join()
+        self._ckpt_queue = None
+        self._ckpt_thread = None
+    
+    def _enqueue_checkpoint(self, checkpoint_file: str, state: Dict):
+        """
+        把检查点交给后台线程写入，队列中尚未写入的旧检查点直接丢弃
+        
+        Args:
+            checkpoint_file: 检查点文件路径
+            state: 检查点数据的副本
+        """
+        if self._ckpt_queue is None:
+            # 没有后台线程时同步写入
+            if CHECKPOINT_FSYNC:
+                os.fsync(self._out_fh.fileno())
+            self.save_checkpoint(checkpoint_file, state)
+            return
+        item = (checkpoint_file, state)
+        try:
+            self._ckpt_queue.put_nowait(item)
+        except queue.Full:
+            # 只有生成线程会放入，取出旧检查点后一定放得进去
+            try:
+                self._ckpt_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._ckpt_queue.put_nowait(item)
+    
+    def _checkpoint_writer_loop(self):
+        """后台检查点写入线程主循环，收到None时退出"""
+        while True:
+            item = self._ckpt_queue.get()
+            if item is None:
+                break
+            checkpoint_file, state = item
+            try:
+                # 先同步输出文件，保证检查点记录的内容确实已经落盘
+                if CHECKPOINT_FSYNC:
+                    os.fsync(self._out_fh.fileno())
+            except Exception as e:
+                print(f"同步输出文件失败: {e}")
+                continue
+            self.save_checkpoint(checkpoint_file, state)
+    
+    @staticmethod
+    def _loads(text: Any) -> Any:
+        """
+        解析JSON文本，优先使用orjson
+        """
+        if orjson is not None:
+            return orjson.loads(text)
+        return json.loads(text)
+    
     def delete_checkpoint(self, checkpoint_file: str):
         """删除检查点文件"""
         try:
@@ -68,28 +180,167 @@ class OptimizedDataGenerator(DataGenerator):
         except Exception as e:
             print(f"删除检查点失败: {e}")
     
+    def get_partial_file(self, output_file: str) -> str:
+        """
+        获取生成过程中逐条追加样本的JSONL文件路径
+        
+        输出文件本身是JSONL（包括压缩的.jsonl.gz）时直接追加到输出文件，
+        否则追加到旁边的 `.partial.jsonl` 文件，生成完成后再由finalize_output整理为JSON数组。
+        """
+        if output_file.endswith(('.jsonl', '.jsonl.gz')):
+            return output_file
+        return f"{output_file}.partial.jsonl"
+    
+    @staticmethod
+    def _open_output_log(path: str):
+        """
+        以追加方式打开JSONL输出文件
+        
+        .gz文件按1级压缩写入（压缩很快，JSON文本通常能缩小数倍，减少磁盘写入量），
+        每次打开追加一个新的gzip成员，读取时各成员依次解压；其余文件使用1MB缓冲区。
+        """
+        if path.endswith('.gz'):
+            return gzip.open(path, 'ab', compresslevel=1)
+        return open(path, 'ab', buffering=1 << 20)
+    
+    @staticmethod
+    def _iter_gzip_chunks(path: str):
+        """
+        逐块解压gzip文件，支持多个成员；中断时残留的不完整结尾只产出能解压的部分
+        """
+        decompressor = zlib.decompressobj(31)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                while chunk:
+                    try:
+                        yield decompressor.decompress(chunk)
+                    except zlib.error:
+                        # 结尾损坏，之后的内容无法解压
+                        return
+                    if not decompressor.eof:
+                        break
+                    # 一个成员结束，剩余数据属于下一个追加的成员
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+    
+    def _rewrite_gzip_log(self, path: str, limit: Optional[int]) -> Tuple[int, int]:
+        """
+        重写gzip压缩的JSONL输出文件，只保留前limit个未压缩字节中的完整行
+        
+        gzip文件无法像普通文件那样原地截断，续传时解压后重新压缩写入临时文件再替换。
+        
+        Args:
+            path: 输出文件路径
+            limit: 保留的未压缩字节数，为None时保留全部完整行
+            
+        Returns:
+            (保留内容的未压缩长度, 保留的行数)
+        """
+        tmp_path = f"{path}.tmp"
+        kept = 0
+        lines = 0
+        tail = b""
+        with gzip.open(tmp_path, 'wb', compresslevel=1) as out:
+            for chunk in self._iter_gzip_chunks(path):
+                chunk = tail + chunk
+                if limit is not None and kept + len(chunk) > limit:
+                    chunk = chunk[:limit - kept]
+                cut = chunk.rfind(b"\n") + 1
+                out.write(chunk[:cut])
+                kept += cut
+                lines += chunk.count(b"\n", 0, cut)
+                tail = chunk[cut:]
+                if limit is not None and kept >= limit:
+                    break
+        os.replace(tmp_path, path)
+        return kept, lines
+    
+    @staticmethod
+    def _trim_to_complete_lines(path: str) -> int:
+        """
+        统计JSONL输出文件中的完整行数，并截掉结尾不完整的一行
+        
+        Args:
+            path: 输出文件路径
+            
+        Returns:
+            完整行数
+        """
+        lines = 0
+        end = 0
+        offset = 0
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                count = chunk.count(b"\n")
+                if count:
+                    lines += count
+                    end = offset + chunk.rindex(b"\n") + 1
+                offset += len(chunk)
+        if end < offset:
+            os.truncate(path, end)
+        return lines
+    
     def append_to_output_file(self, output_file: str, data: Dict):
-        """追加数据到输出文件"""
+        """追加一条数据到输出文件（JSONL格式，每次只写一行，不再读取和重写已有数据）"""
         try:
+            line = CheckpointWriter._dumps_line(data)
             with self._lock:
-                # 检查文件是否存在，如果不存在则创建
-                if not os.path.exists(output_file):
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump([], f, ensure_ascii=False)
-                
-                # 读取现有数据
-                with open(output_file, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-                
-                # 追加新数据
-                existing_data.append(data)
-                
-                # 写回文件
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump(existing_data, f, ensure_ascii=False, indent=2)
+                if self._out_fh is not None:
+                    self._out_fh.write(line)
+                else:
+                    with self._open_output_log(self.get_partial_file(output_file)) as f:
+                        f.write(line)
         except Exception as e:
             print(f"追加数据到文件失败: {e}")
     
+    def finalize_output(self, output_file: str):
+        """
+        把逐条追加的JSONL文件整理为JSON数组写入输出文件（输出文件本身是JSONL时无需处理）
+        
+        逐行读取并逐条写出，内存占用与数据集大小无关；写入临时文件后再替换输出文件。
+        """
+        partial_file = self.get_partial_file(output_file)
+        if partial_file == output_file:
+            return
+        
+        with _RecordWriter(output_file) as writer:
+            if os.path.exists(partial_file):
+                with open(partial_file, 'rb') as f:
+                    for line in f:
+                        if line.strip():
+                            writer.write(self._loads(line))
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+    
+    def _seed_partial_from_output(self, output_file: str, partial_file: str):
+        """
+        续传时把输出文件中已有的JSON数组写入逐条追加的JSONL文件
+        
+        旧版本直接把样本追加到输出文件的JSON数组中，没有 `.partial.jsonl` 文件；
+        不先导入这些样本的话，finalize_output会用新样本覆盖它们。
+        
+        Args:
+            output_file: 输出文件路径（JSON数组）
+            partial_file: 逐条追加样本的JSONL文件路径
+            
+        Returns:
+            导入的样本数量
+        """
+        with open(output_file, 'rb') as f:
+            content = f.read()
+        data = self._loads(content) if content.strip() else []
+        if not isinstance(data, list):
+            raise ValueError(f"输出文件不是JSON数组: {output_file}")
+        payload = b"".join(CheckpointWriter._dumps_line(item) for item in data)
+        _write_bytes_atomic(partial_file, payload, fsync=CHECKPOINT_FSYNC)
+        return len(data)
+    
     def generate_dataset_optimized(self, dataset_type: str, num_samples: int, output_file: str,
                                  mode: str = "complete", fixed_instruction: str = None,
                                  concurrent: bool = False, max_workers: int = 3,
@@ -100,27 +351,85 @@ class OptimizedDataGenerator(DataGenerator):
             start_index = 0
             generated_count = 0
             
+            self._out_base = 0
+            # 输出文件中不属于本次检查点计数的行数（例如续传前输出文件中已有的样本）
+            base_lines = 0
+            
             # 检查是否需要恢复
             if resume:
                 checkpoint_data = self.load_checkpoint(checkpoint_file)
+                completed_count = checkpoint_data.get('completed_count', 0) if checkpoint_data else 0
                 if checkpoint_data:
-                    start_index = checkpoint_data.get('completed_count', 0)
+                    base_lines = checkpoint_data.get('output_base_lines', 0)
+                
+                # 检查点按批写入，截掉最后一次写检查点之后追加的样本，避免续传时重复；
+                # 输出文件比检查点记录的短时（例如未同步磁盘时系统崩溃），记下实际保存的完整行数
+                output_size = checkpoint_data.get('output_size') if checkpoint_data else None
+                partial_file = self.get_partial_file(output_file)
+                log_lines = None
+                if partial_file.endswith('.gz'):
+                    if os.path.exists(partial_file):
+                        self._out_base, lines = self._rewrite_gzip_log(partial_file, output_size)
+                        if checkpoint_data is None:
+                            base_lines = lines
+                        elif output_size is not None and self._out_base < output_size:
+                            log_lines = lines
+                    elif output_size is not None:
+                        log_lines = 0
+                elif os.path.exists(partial_file):
+                    if checkpoint_data is None:
+                        base_lines = self._trim_to_complete_lines(partial_file)
+                    elif output_size is not None:
+                        log_size = os.path.getsize(partial_file)
+                        if log_size > output_size:
+                            os.truncate(partial_file, output_size)
+                        elif log_size < output_size:
+                            log_lines = self._trim_to_complete_lines(partial_file)
+                elif partial_file != output_file and os.path.exists(output_file):
+                    # 还没有逐条追加的文件时，先导入输出文件中已有的样本，避免整理时被覆盖
+                    seeded = self._seed_partial_from_output(output_file, partial_file)
+                    if output_size is None:
+                        # 旧版检查点已完成的样本就保存在输出文件中
+                        base_lines = max(0, seeded - completed_count)
+                    else:
+                        # 检查点记录的样本随日志一起丢失，输出文件中的样本都不计入进度
+                        base_lines = seeded
+                        log_lines = seeded
+                elif output_size is not None:
+                    log_lines = 0
+                
+                if checkpoint_data:
+                    start_index = completed_count
+                    if log_lines is not None:
+                        # 从输出文件中实际保存的样本之后继续，丢失的样本重新生成
+                        start_index = max(0, min(completed_count, log_lines - base_lines))
+                        base_lines = log_lines - start_index
+                        print(f"输出文件中的样本少于检查点记录的进度，从第 {start_index} 个样本继续")
                     generated_count = start_index
                     print(f"从检查点恢复，已完成 {start_index}/{num_samples} 个样本")
                     
                     # 如果已经完成，直接返回
                     if start_index >= num_samples:
                         print("数据集生成已完成")
+                        self.finalize_output(output_file)
                         self.delete_checkpoint(checkpoint_file)
                         return True
             else:
                 # 不恢复时，清空输出文件和检查点
+                partial_file = self.get_partial_file(output_file)
+                if os.path.exists(partial_file):
+                    os.remove(partial_file)
                 if os.path.exists(output_file):
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump([], f, ensure_ascii=False)
+                    with open(output_file, 'wb') as f:
+                        f.write(b"[]")
                 self.delete_checkpoint(checkpoint_file)
             
-            # 保存初始检查点
+            # 保存初始检查点（同时记录输出文件当前的长度，第一次按批写入前中断也能正确续传）
+            if partial_file.endswith('.gz'):
+                output_size = self._out_base
+            else:
+                output_size = os.path.getsize(partial_file) if os.path.exists(partial_file) else 0
+            now = datetime.now().isoformat()
             checkpoint_data = {
                 'dataset_type': dataset_type,
                 'total_samples': num_samples,
@@ -129,12 +438,19 @@ class OptimizedDataGenerator(DataGenerator):
                 'fixed_instruction': fixed_instruction,
                 'concurrent': concurrent,
                 'max_workers': max_workers,
-                'start_time': datetime.now().isoformat(),
-                'last_update': datetime.now().isoformat(),
-                'output_file': output_file
+                'start_time': now,
+                'last_update': now,
+                'output_file': output_file,
+                'output_size': output_size,
+                'output_base_lines': base_lines
             }
             self.save_checkpoint(checkpoint_file, checkpoint_data)
             
+            # 之后的进度只更新内存中的检查点，由_maybe_flush_checkpoint按批写入磁盘
+            self._checkpoint_state = checkpoint_data
+            self._last_flush_count = generated_count
+            self._last_flush_time = time.monotonic()
+            
             # 初始化进度条
             if 'streamlit' in globals() and st.session_state.get('in_streamlit', False):
                 progress_bar = st.progress(generated_count / num_samples)
@@ -146,19 +462,31 @@ class OptimizedDataGenerator(DataGenerator):
             # 生成剩余样本
             remaining_samples = num_samples - start_index
             
-            if concurrent:
-                success = self._generate_concurrent_optimized(
-                    dataset_type, remaining_samples, output_file, checkpoint_file,
-                    mode, fixed_instruction, max_workers, start_index, progress_bar
-                )
-            else:
-                success = self._generate_sequential_optimized(
-                    dataset_type, remaining_samples, output_file, checkpoint_file,
-                    mode, fixed_instruction, start_index, progress_bar
-                )
+            self._out_fh = self._open_output_log(self.get_partial_file(output_file))
+            self._start_checkpoint_writer()
+            try:
+                if concurrent:
+                    success = self._generate_concurrent_optimized(
+                        dataset_type, remaining_samples, output_file, checkpoint_file,
+                        mode, fixed_instruction, max_workers, start_index, progress_bar
+                    )
+                else:
+                    success = self._generate_sequential_optimized(
+                        dataset_type, remaining_samples, output_file, checkpoint_file,
+                        mode, fixed_instruction, start_index, progress_bar
+                    )
+            finally:
+                # 无论成功、失败还是被中断，都把最新进度写入磁盘
+                try:
+                    self._maybe_flush_checkpoint(checkpoint_file, force=True)
+                finally:
+                    self._stop_checkpoint_writer()
+                    self._out_fh.close()
+                    self._out_fh = None
             
             if success:
-                # 完成后删除检查点
+                # 完成后整理输出文件并删除检查点
+                self.finalize_output(output_file)
                 self.delete_checkpoint(checkpoint_file)
                 print(f"数据集生成完成，共生成 {num_samples} 个样本")
             
@@ -168,34 +496,38 @@ class OptimizedDataGenerator(DataGenerator):
             print(f"生成数据集时发生错误: {e}")
             return False
     
+    def _get_sample_generator(self, dataset_type: str):
+        """获取数据集类型对应的样本生成方法，不支持的类型返回None"""
+        if dataset_type == "sft":
+            return self.sft_generator.generate_sample
+        if dataset_type == "dpo":
+            return self.dpo_generator.generate_sample
+        return None
+    
     def _generate_sequential_optimized(self, dataset_type: str, num_samples: int, 
                                      output_file: str, checkpoint_file: str,
                                      mode: str, fixed_instruction: str, 
                                      start_index: int, progress_bar) -> bool:
         """串行生成（优化版本）"""
+        generate_sample = self._get_sample_generator(dataset_type)
+        if generate_sample is None:
+            print(f"不支持的数据集类型: {dataset_type}")
+            return False
+        
         try:
             for i in range(num_samples):
                 current_index = start_index + i
                 
                 # 生成单个样本
-                if dataset_type == "sft":
-                    sample = self.sft_generator.generate_sample(mode, fixed_instruction)
-                elif dataset_type == "dpo":
-                    sample = self.dpo_generator.generate_sample(mode, fixed_instruction)
-                else:
-                    print(f"不支持的数据集类型: {dataset_type}")
-                    return False
+                sample = generate_sample(mode, fixed_instruction)
                 
                 if sample:
                     # 实时保存到文件
                     self.append_to_output_file(output_file, sample)
                     
                     # 更新检查点
-                    checkpoint_data = self.load_checkpoint(checkpoint_file)
-                    if checkpoint_data:
-                        checkpoint_data['completed_count'] = current_index + 1
-                        checkpoint_data['last_update'] = datetime.now().isoformat()
-                        self.save_checkpoint(checkpoint_file, checkpoint_data)
+                    self._checkpoint_state['completed_count'] = current_index + 1
+                    self._maybe_flush_checkpoint(checkpoint_file)
                     
                     # 更新进度条
                     if hasattr(progress_bar, 'progress'):
@@ -220,51 +552,53 @@ class OptimizedDataGenerator(DataGenerator):
                                      mode: str, fixed_instruction: str,
                                      max_workers: int, start_index: int, progress_bar) -> bool:
         """并发生成（优化版本）"""
+        generate_sample = self._get_sample_generator(dataset_type)
+        if generate_sample is None:
+            print(f"不支持的数据集类型: {dataset_type}")
+            return False
+        
         try:
             completed_count = 0
             
+            # 同时在途的任务数，按完成情况逐个补充提交，不一次性为全部样本创建Future
+            max_pending = max_workers * 2
+            submitted = 0
+            pending = set()
+            
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # 提交所有任务
-                futures = []
-                for i in range(num_samples):
-                    if dataset_type == "sft":
-                        future = executor.submit(self.sft_generator.generate_sample, mode, fixed_instruction)
-                    elif dataset_type == "dpo":
-                        future = executor.submit(self.dpo_generator.generate_sample, mode, fixed_instruction)
-                    else:
-                        print(f"不支持的数据集类型: {dataset_type}")
-                        return False
-                    futures.append(future)
-                
-                # 处理完成的任务
-                for future in as_completed(futures):
-                    try:
-                        sample = future.result()
-                        if sample:
-                            # 实时保存到文件
-                            self.append_to_output_file(output_file, sample)
-                            completed_count += 1
-                            
-                            # 更新检查点
-                            checkpoint_data = self.load_checkpoint(checkpoint_file)
-                            if checkpoint_data:
-                                checkpoint_data['completed_count'] = start_index + completed_count
-                                checkpoint_data['last_update'] = datetime.now().isoformat()
-                                self.save_checkpoint(checkpoint_file, checkpoint_data)
-                            
-                            # 更新进度条
-                            if hasattr(progress_bar, 'progress'):
-                                # Streamlit 进度条
-                                progress_bar.progress((start_index + completed_count) / (start_index + num_samples))
-                                if 'status_text' in locals():
-                                    status_text.text(f"正在生成数据集... {start_index + completed_count}/{start_index + num_samples}")
+                while submitted < num_samples or pending:
+                    # 补充提交任务
+                    while submitted < num_samples and len(pending) < max_pending:
+                        pending.add(executor.submit(generate_sample, mode, fixed_instruction))
+                        submitted += 1
+                    
+                    # 处理完成的任务
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            sample = future.result()
+                            if sample:
+                                # 实时保存到文件
+                                self.append_to_output_file(output_file, sample)
+                                completed_count += 1
+                                
+                                # 更新检查点
+                                self._checkpoint_state['completed_count'] = start_index + completed_count
+                                self._maybe_flush_checkpoint(checkpoint_file)
+                                
+                                # 更新进度条
+                                if hasattr(progress_bar, 'progress'):
+                                    # Streamlit 进度条
+                                    progress_bar.progress((start_index + completed_count) / (start_index + num_samples))
+                                    if 'status_text' in locals():
+                                        status_text.text(f"正在生成数据集... {start_index + completed_count}/{start_index + num_samples}")
+                                else:
+                                    # tqdm 进度条
+                                    progress_bar.update(1)
                             else:
-                                # tqdm 进度条
-                                progress_bar.update(1)
-                        else:
-                            print(f"生成样本失败")
-                    except Exception as e:
-                        print(f"处理并发任务时发生错误: {e}")
+                                print(f"生成样本失败")
+                        except Exception as e:
+                            print(f"处理并发任务时发生错误: {e}")
             
             return completed_count == num_samples
             
@@ -281,13 +615,13 @@ class OptimizedDataGenerator(DataGenerator):
         """列出所有检查点"""
         checkpoints = []
         try:
-            for file in os.listdir(self.checkpoint_dir):
-                if file.endswith('_checkpoint.json'):
-                    checkpoint_file = os.path.join(self.checkpoint_dir, file)
-                    checkpoint_data = self.load_checkpoint(checkpoint_file)
-                    if checkpoint_data:
-                        checkpoint_data['checkpoint_file'] = file
-                        checkpoints.append(checkpoint_data)
+            with os.scandir(self.checkpoint_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('_checkpoint.json'):
+                        checkpoint_data = self.load_checkpoint(entry.path)
+                        if checkpoint_data:
+                            checkpoint_data['checkpoint_file'] = entry.name
+                            checkpoints.append(checkpoint_data)
         except Exception as e:
             print(f"列出检查点时发生错误: {e}")
         return checkpoints
@@ -295,13 +629,12 @@ class OptimizedDataGenerator(DataGenerator):
     def clean_old_checkpoints(self, days: int = 7):
         """清理旧的检查点文件"""
         try:
-            current_time = time.time()
-            for file in os.listdir(self.checkpoint_dir):
-                if file.endswith('_checkpoint.json'):
-                    file_path = os.path.join(self.checkpoint_dir, file)
-                    file_time = os.path.getmtime(file_path)
-                    if (current_time - file_time) > (days * 24 * 3600):
-                        os.remove(file_path)
-                        print(f"已删除旧检查点: {file}")
+            cutoff = time.time() - days * 24 * 3600
+            # 先按文件名过滤，只对检查点文件读取修改时间（目录项缓存stat结果）
+            with os.scandir(self.checkpoint_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('_checkpoint.json') and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        print(f"已删除旧检查点: {entry.name}")
         except Exception as e:
             print(f"清理检查点时发生错误: {e}")
\ No newline at end of file
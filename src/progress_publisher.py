@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+进度发布模块
+在独立线程中刷新Streamlit进度条，生成循环只需记录最新进度，不必等待界面更新
+"""
+import threading
+from collections import deque
+from typing import Any, Optional
+
+# 尝试导入Streamlit的脚本上下文工具，后台线程需要绑定上下文才能更新组件
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx
+except ImportError:
+    add_script_run_ctx = None
+
+
+class ProgressPublisher(threading.Thread):
+    """
+    进度发布线程
+
+    publish只把最新状态放入长度为1的deque（旧状态直接被覆盖），
+    发布线程每隔interval秒取出最新状态刷新一次进度条和状态文本。
+    """
+
+    def __init__(self, progress_bar: Any, status_text: Any, interval: float = 0.1):
+        """
+        初始化进度发布线程
+
+        Args:
+            progress_bar: Streamlit进度条组件
+            status_text: Streamlit文本占位组件
+            interval: 刷新间隔（秒）
+        """
+        super().__init__(daemon=True)
+        self.progress_bar = progress_bar
+        self.status_text = status_text
+        self.interval = interval
+        self._latest = deque(maxlen=1)
+        self._stop_event = threading.Event()
+
+        if add_script_run_ctx is not None:
+            add_script_run_ctx(self)
+
+    def publish(self, progress: float, text: str) -> None:
+        """
+        记录最新进度，不阻塞调用方
+
+        Args:
+            progress: 进度（0~1）
+            text: 状态文本
+        """
+        self._latest.append((progress, text))
+
+    def run(self) -> None:
+        """
+        发布线程主循环
+        """
+        while not self._stop_event.wait(self.interval):
+            self._flush()
+
+    def close(self, progress: Optional[float] = None, text: Optional[str] = None) -> None:
+        """
+        停止发布线程，并在当前线程写入最终状态
+
+        Args:
+            progress: 最终进度，为None时使用最后一次发布的进度
+            text: 最终状态文本
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        if progress is not None:
+            self.publish(progress, text or "")
+        self._flush()
+
+    def _flush(self) -> None:
+        """
+        把最新状态写入Streamlit组件
+        """
+        try:
+            progress, text = self._latest.pop()
+        except IndexError:
+            return
+        try:
+            self.progress_bar.progress(progress)
+            self.status_text.text(text)
+        except Exception as e:
+            # 页面已关闭或重新运行时组件可能失效，忽略刷新错误
+            pass
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+限流模块，用于控制模型请求的发送速率
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    令牌桶限流器
+
+    令牌以每秒rate个的速度补充，桶中最多保存capacity个令牌。
+    只有令牌耗尽时才会等待；收到429限流响应时可通过penalize暂停一段时间。
+    线程安全，同时提供同步和异步两种获取方式。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数（即允许的每秒请求数），小于等于0表示不限流
+            capacity: 桶容量（允许的突发请求数），默认与rate相同且至少为1
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """
+        预定一个令牌
+
+        Returns:
+            获取到该令牌前需要等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.rate <= 0:
+                return max(0.0, self._blocked_until - now)
+
+            self._refill(now)
+            # 令牌可以预支为负数，后来的请求会相应地排在更后面
+            self._tokens -= 1
+            # 暂停期间_last位于未来，令牌从暂停结束时才开始补充
+            wait = max(0.0, self._last - now)
+            if self._tokens < 0:
+                wait += -self._tokens / self.rate
+            return wait
+
+    def _refill(self, now: float) -> None:
+        """
+        按经过的时间补充令牌（调用方需持有锁）
+
+        Args:
+            now: 当前时间（time.monotonic）
+        """
+        if now > self._last:
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+    def acquire(self) -> None:
+        """
+        获取一个令牌，令牌不足时阻塞等待
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self) -> None:
+        """
+        异步获取一个令牌，令牌不足时让出事件循环等待
+        """
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds: float) -> None:
+        """
+        在接下来的一段时间内暂停发放令牌（用于响应429限流）
+
+        Args:
+            seconds: 暂停的秒数，通常取自响应头Retry-After
+        """
+        with self._lock:
+            now = time.monotonic()
+            until = now + seconds
+            self._blocked_until = max(self._blocked_until, until)
+            if self.rate > 0 and until > self._last:
+                # 暂停期间不补充令牌；恢复后只放行一个请求，其余按速率依次发出，避免同时涌向服务端
+                self._refill(now)
+                self._tokens = min(self._tokens, 1.0)
+                self._last = until
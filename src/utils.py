@@ -3,12 +3,40 @@
 工具函数模块，提供一些通用的辅助功能
 """
 import os
+import gzip
 import json
-import random
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 import time
 from datetime import datetime
 
+import numpy as np
+
+from src.data_loader import _dump_json_bytes
+
+# 尝试导入orjson，如果不可用则使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 尝试导入ijson，可用时逐条流式读取大型JSON数组，避免一次性加载到内存
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# 超过该大小的JSON数组文件使用ijson流式读取
+_STREAM_READ_THRESHOLD = 32 << 20
+
+
+def _loads(text: Any) -> Any:
+    """
+    解析JSON文本，优先使用orjson
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
 
 def setup_directories(dirs: List[str]) -> None:
     """
@@ -32,39 +60,165 @@ def get_timestamp() -> str:
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
 
-def merge_datasets(file_paths: List[str], output_file: str) -> None:
+def _is_jsonl(file_path: str) -> bool:
     """
-    合并多个数据集文件
+    判断数据集文件是否为JSONL格式（包括gzip压缩的.jsonl.gz）
+    """
+    return file_path.endswith(('.jsonl', '.jsonl.gz'))
+
+
+def _open_dataset(file_path: str, mode: str = 'rb') -> Any:
+    """
+    以二进制方式打开数据集文件，.gz文件透明地解压或按1级压缩写入
     
     Args:
-        file_paths: 数据集文件路径列表
-        output_file: 输出文件路径
+        file_path: 数据集文件路径
+        mode: 打开模式（'rb'或'wb'）
     """
-    merged_data = []
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode, compresslevel=1)
+    return open(file_path, mode, buffering=1 << 20)
+
+
+def _load_records(file_path: str) -> Any:
+    """
+    加载数据集文件，.jsonl文件逐行解析为列表，其余按JSON解析，.gz文件先解压
     
-    for file_path in file_paths:
-        if not os.path.exists(file_path):
-            # 文件不存在，跳过
-            continue
+    Args:
+        file_path: 数据集文件路径
         
+    Returns:
+        解析后的数据
+    """
+    with _open_dataset(file_path) as f:
+        if _is_jsonl(file_path):
+            return [_loads(line) for line in f if line.strip()]
+        return _loads(f.read())
+
+
+def _streams_records(file_path: str) -> bool:
+    """
+    判断_iter_records是否会流式读取该文件（否则会一次性加载整个文件）
+    """
+    return _is_jsonl(file_path) or (
+        ijson is not None and os.path.getsize(file_path) > _STREAM_READ_THRESHOLD
+    )
+
+
+def _iter_records(file_path: str) -> Iterator[Any]:
+    """
+    逐条读取数据集文件中的记录
+    
+    .jsonl文件逐行解析；大型JSON数组在ijson可用时流式解析，其余一次性加载。
+    顶层不是数组的JSON文件不产出任何记录。.gz文件边读边解压。
+    
+    Args:
+        file_path: 数据集文件路径
+    """
+    with _open_dataset(file_path) as f:
+        if _is_jsonl(file_path):
+            for line in f:
+                if line.strip():
+                    yield _loads(line)
+            return
+        if _streams_records(file_path):
+            yield from ijson.items(f, 'item', use_float=True)
+            return
+        data = _loads(f.read())
+    if isinstance(data, list):
+        yield from data
+
+
+class _RecordWriter:
+    """
+    逐条写出数据集记录：.jsonl文件每行一条，其余写为缩进2格的JSON数组
+    （与一次性json.dump(..., indent=2)的输出相同），不需要先在内存中汇总全部记录；
+    文件名以.gz结尾时压缩写入。
+    
+    记录先写入同目录下的临时文件，正常关闭后才替换输出文件，
+    因此输出文件同时也是输入文件时，读取过程中不会被提前清空。
+    """
+    
+    def __init__(self, output_file: str):
+        """
+        Args:
+            output_file: 输出文件路径
+        """
+        self._jsonl = _is_jsonl(output_file)
+        self._output_file = output_file
+        # 临时文件保留原文件名的后缀，_open_dataset据此判断是否压缩
+        self._tmp_file = os.path.join(
+            os.path.dirname(output_file), f".tmp_{os.path.basename(output_file)}"
+        )
+        self._file = _open_dataset(self._tmp_file, 'wb')
+        self.count = 0
+    
+    def write(self, record: Any) -> None:
+        """
+        写出一条记录
+        """
+        if self._jsonl:
+            self._file.write(_dump_json_bytes(record, pretty=False) + b"\n")
+        else:
+            # JSON字符串中的换行已被转义，按行缩进不会改动字符串内容
+            self._file.write(b",\n  " if self.count else b"[\n  ")
+            self._file.write(_dump_json_bytes(record).replace(b"\n", b"\n  "))
+        self.count += 1
+    
+    def close(self) -> None:
+        """
+        结束JSON数组，关闭文件并替换输出文件
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    merged_data.extend(data)
-                    # 成功加载数据
-                else:
-                    # 文件不是有效的JSON数组，跳过
-                    pass
-        except Exception as e:
-            # 加载文件时出错
-            pass
+            if not self._jsonl:
+                self._file.write(b"\n]" if self.count else b"[]")
+        finally:
+            self._file.close()
+        os.replace(self._tmp_file, self._output_file)
+    
+    def discard(self) -> None:
+        """
+        关闭并删除临时文件，输出文件保持不变
+        """
+        self._file.close()
+        if os.path.exists(self._tmp_file):
+            os.remove(self._tmp_file)
     
-    # 保存合并后的数据
+    def __enter__(self) -> "_RecordWriter":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def merge_datasets(file_paths: List[str], output_file: str) -> None:
+    """
+    合并多个数据集文件
+    
+    记录逐条从输入文件读出并写入输出文件，内存占用与数据集总大小无关。
+    
+    Args:
+        file_paths: 数据集文件路径列表
+        output_file: 输出文件路径
+    """
     try:
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(merged_data, f, ensure_ascii=False, indent=2)
+        with _RecordWriter(output_file) as writer:
+            for file_path in file_paths:
+                if not os.path.exists(file_path):
+                    # 文件不存在，跳过
+                    continue
+                
+                try:
+                    for record in _iter_records(file_path):
+                        writer.write(record)
+                    # 成功合并数据
+                except Exception as e:
+                    # 读取文件时出错，跳过该文件剩余的内容
+                    pass
         # 成功保存合并数据
     except Exception as e:
         # 保存合并数据时出错
@@ -92,36 +246,39 @@ def split_dataset(file_path: str, train_ratio: float = 0.8,
         output_dir = os.path.dirname(file_path)
     os.makedirs(output_dir, exist_ok=True)
     
-    # 加载数据集
+    # 能流式读取的文件先用一遍只统计记录数量，其余文件只加载一次
+    records = None
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        if _streams_records(file_path):
+            total = sum(1 for _ in _iter_records(file_path))
+        else:
+            records = _load_records(file_path)
+            if not isinstance(records, list):
+                records = []
+            total = len(records)
     except Exception as e:
         raise Exception(f"加载数据集失败: {str(e)}")
     
-    # 随机打乱数据
-    random.shuffle(data)
+    # 随机选出训练集的记录：随机排列中序号小于分割点的位置归入训练集
+    split_idx = int(total * train_ratio)
+    is_train = np.random.permutation(total) < split_idx
     
-    # 计算分割点
-    split_idx = int(len(data) * train_ratio)
-    train_data = data[:split_idx]
-    val_data = data[split_idx:]
-    
-    # 构建输出文件路径
-    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    # 构建输出文件路径（输入为JSONL时输出同样为JSONL，压缩的JSONL同样压缩输出）
+    base_name, ext = os.path.splitext(os.path.basename(file_path))
+    if ext == '.gz' and base_name.endswith('.jsonl'):
+        base_name, ext = base_name[:-len('.jsonl')], '.jsonl.gz'
+    ext = ext if ext in ('.jsonl', '.jsonl.gz') else '.json'
     timestamp = get_timestamp()
-    train_file = os.path.join(output_dir, f"{base_name}_train_{timestamp}.json")
-    val_file = os.path.join(output_dir, f"{base_name}_val_{timestamp}.json")
+    train_file = os.path.join(output_dir, f"{base_name}_train_{timestamp}{ext}")
+    val_file = os.path.join(output_dir, f"{base_name}_val_{timestamp}{ext}")
     
-    # 保存训练集和验证集
+    # 第二遍逐条写入训练集和验证集，保持记录在原文件中的相对顺序
     try:
-        with open(train_file, 'w', encoding='utf-8') as f:
-            json.dump(train_data, f, ensure_ascii=False, indent=2)
-        # 成功保存训练集
-        
-        with open(val_file, 'w', encoding='utf-8') as f:
-            json.dump(val_data, f, ensure_ascii=False, indent=2)
-        # 成功保存验证集
+        with _RecordWriter(train_file) as train_writer, _RecordWriter(val_file) as val_writer:
+            source = _iter_records(file_path) if records is None else records
+            for record, train in zip(source, is_train):
+                (train_writer if train else val_writer).write(record)
+        # 成功保存训练集和验证集
     except Exception as e:
         raise Exception(f"保存数据集失败: {str(e)}")
     
@@ -146,59 +303,25 @@ def analyze_dataset(file_path: str) -> Dict[str, Any]:
     
     # 加载数据集
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = _load_records(file_path)
     except Exception as e:
         raise Exception(f"加载数据集失败: {str(e)}")
     
     # 基本统计信息
-    stats = {
-        "total_samples": len(data),
-        "instruction_length": {
-            "min": float('inf'),
-            "max": 0,
-            "avg": 0
-        },
-        "input_length": {
-            "min": float('inf'),
-            "max": 0,
-            "avg": 0
-        },
-        "output_length": {
-            "min": float('inf'),
-            "max": 0,
-            "avg": 0
-        }
-    }
+    stats = {"total_samples": len(data)}
     
-    # 计算长度统计
-    total_instruction_len = 0
-    total_input_len = 0
-    total_output_len = 0
-    
-    for item in data:
-        # 指令长度
-        instr_len = len(item.get("instruction", ""))
-        stats["instruction_length"]["min"] = min(stats["instruction_length"]["min"], instr_len)
-        stats["instruction_length"]["max"] = max(stats["instruction_length"]["max"], instr_len)
-        total_instruction_len += instr_len
-        
-        # 输入长度
-        input_len = len(item.get("input", ""))
-        stats["input_length"]["min"] = min(stats["input_length"]["min"], input_len)
-        stats["input_length"]["max"] = max(stats["input_length"]["max"], input_len)
-        total_input_len += input_len
-        
-        # 输出长度
-        output_len = len(item.get("output", ""))
-        stats["output_length"]["min"] = min(stats["output_length"]["min"], output_len)
-        stats["output_length"]["max"] = max(stats["output_length"]["max"], output_len)
-        total_output_len += output_len
-    
-    # 计算平均长度
-    if len(data) > 0:
-        stats["instruction_length"]["avg"] = total_instruction_len / len(data)
-        stats["input_length"]["avg"] = total_input_len / len(data)
-        stats["output_length"]["avg"] = total_output_len / len(data)
-    
-    return stats
\ No newline at end of file
+    # 计算长度统计：每个字段的长度先收集到NumPy数组，再一次性求最小、最大和平均值
+    for field in ("instruction", "input", "output"):
+        lengths = np.fromiter(
+            (len(item.get(field, "")) for item in data), dtype=np.int64, count=len(data)
+        )
+        if len(lengths) > 0:
+            stats[f"{field}_length"] = {
+                "min": int(lengths.min()),
+                "max": int(lengths.max()),
+                "avg": float(lengths.mean())
+            }
+        else:
+            stats[f"{field}_length"] = {"min": float('inf'), "max": 0, "avg": 0}
+    
+    return stats
@@ -137,6 +137,163 @@ def test_optimized_generator():
         print(f"测试过程中出现错误: {str(e)}")
         print("这可能是因为缺少某些依赖或配置\n")
 
+# 测试批量生成instruction时的多代码块解析
+def test_parse_instructions_multiple_fenced_blocks():
+    print("=== 测试多代码块instruction解析 ===")
+    
+    from src.data_generator import DataGenerator
+    from src.dataset_generators.sft_generator import SFTDatasetGenerator
+    
+    # 默认提示词要求每个instruction各自用三个反引号包裹
+    response = (
+        "以下是生成的指令：\n"
+        "```\n写一首关于春天的诗\n```\n"
+        "```\n解释光合作用\n```\n"
+        "```\n翻译这句话\n```\n"
+    )
+    expected = ['写一首关于春天的诗', '解释光合作用', '翻译这句话']
+    
+    for cls in (SFTDatasetGenerator, DataGenerator):
+        parser = cls.__new__(cls)
+        instructions = parser._parse_instructions(response, 4)
+        print(f"{cls.__name__}: {instructions}")
+        assert instructions == expected
+    
+    print("多代码块instruction解析测试完成\n")
+
+# 测试续传时保留输出文件中已有的样本
+def test_resume_keeps_existing_output_samples():
+    print("=== 测试续传保留已有样本 ===")
+    
+    import shutil
+    import threading
+    from src.optimized_data_generator import OptimizedDataGenerator
+    
+    class FakeSampleGenerator:
+        def __init__(self):
+            self.count = 0
+        
+        def generate_sample(self, mode, fixed_instruction):
+            self.count += 1
+            return {"instruction": f"i{self.count}", "input": "", "output": ""}
+    
+    output_dir = tempfile.mkdtemp()
+    try:
+        output_file = os.path.join(output_dir, "out.json")
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump([{"instruction": "old1"}, {"instruction": "old2"}], f, ensure_ascii=False)
+        
+        # OptimizedDataGenerator的构造函数需要真实的模型配置，这里只初始化生成过程用到的属性
+        generator = OptimizedDataGenerator.__new__(OptimizedDataGenerator)
+        generator.checkpoint_dir = os.path.join(output_dir, "checkpoints")
+        generator.ensure_checkpoint_dir()
+        generator._lock = threading.Lock()
+        generator._checkpoint_lock = threading.Lock()
+        generator._out_fh = None
+        generator._ckpt_queue = None
+        generator._ckpt_thread = None
+        generator.sft_generator = FakeSampleGenerator()
+        
+        # 没有检查点时续传，新样本应追加在已有样本之后
+        assert generator.generate_dataset_optimized('sft', 3, output_file, resume=True)
+        with open(output_file, 'r', encoding='utf-8') as f:
+            instructions = [item["instruction"] for item in json.load(f)]
+        print(f"输出文件中的instruction: {instructions}")
+        assert instructions == ["old1", "old2", "i1", "i2", "i3"]
+    finally:
+        shutil.rmtree(output_dir)
+    
+    print("续传保留已有样本测试完成\n")
+
+# 测试续传时输出文件比检查点记录的短
+def test_resume_with_truncated_output_log():
+    print("=== 测试输出文件缺失样本时续传 ===")
+    
+    import shutil
+    import threading
+    from src.optimized_data_generator import OptimizedDataGenerator
+    
+    class FakeSampleGenerator:
+        def __init__(self, interrupt_at=None):
+            self.count = 0
+            self.interrupt_at = interrupt_at
+        
+        def generate_sample(self, mode, fixed_instruction):
+            self.count += 1
+            if self.count == self.interrupt_at:
+                raise KeyboardInterrupt
+            return {"instruction": f"i{self.count}", "input": "", "output": ""}
+    
+    def make_generator(checkpoint_dir, sample_generator):
+        # OptimizedDataGenerator的构造函数需要真实的模型配置，这里只初始化生成过程用到的属性
+        generator = OptimizedDataGenerator.__new__(OptimizedDataGenerator)
+        generator.checkpoint_dir = checkpoint_dir
+        generator._lock = threading.Lock()
+        generator._checkpoint_lock = threading.Lock()
+        generator._out_fh = None
+        generator._ckpt_queue = None
+        generator._ckpt_thread = None
+        generator.sft_generator = sample_generator
+        return generator
+    
+    output_dir = tempfile.mkdtemp()
+    try:
+        output_file = os.path.join(output_dir, "out.json")
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump([{"instruction": "old1"}], f, ensure_ascii=False)
+        
+        # 生成5个样本后中断，检查点记录5个已完成
+        generator = make_generator(output_dir, FakeSampleGenerator(interrupt_at=6))
+        try:
+            generator.generate_dataset_optimized('sft', 8, output_file, resume=True)
+        except KeyboardInterrupt:
+            pass
+        
+        # 模拟未同步到磁盘的内容丢失：去掉最后两个样本并留下半行
+        partial_file = generator.get_partial_file(output_file)
+        with open(partial_file, 'rb') as f:
+            lines = f.read().splitlines(True)
+        with open(partial_file, 'wb') as f:
+            f.write(b"".join(lines[:-2]) + b'{"instr')
+        
+        generator = make_generator(output_dir, FakeSampleGenerator())
+        assert generator.generate_dataset_optimized('sft', 8, output_file, resume=True)
+        with open(output_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        print(f"输出样本数量: {len(data)}")
+        assert data[0]["instruction"] == "old1"
+        assert len(data) == 1 + 8
+    finally:
+        shutil.rmtree(output_dir)
+    
+    print("输出文件缺失样本时续传测试完成\n")
+
+# 测试合并数据集时输出文件同时也是输入文件
+def test_merge_into_input_file():
+    print("=== 测试合并到输入文件 ===")
+    
+    import shutil
+    from src.utils import merge_datasets
+    
+    output_dir = tempfile.mkdtemp()
+    try:
+        file_a = os.path.join(output_dir, "a.json")
+        file_b = os.path.join(output_dir, "b.jsonl")
+        with open(file_a, 'w', encoding='utf-8') as f:
+            json.dump([{"instruction": "a1"}, {"instruction": "a2"}], f, ensure_ascii=False)
+        with open(file_b, 'w', encoding='utf-8') as f:
+            f.write('{"instruction": "b1"}\n')
+        
+        merge_datasets([file_a, file_b], file_a)
+        with open(file_a, 'r', encoding='utf-8') as f:
+            instructions = [item["instruction"] for item in json.load(f)]
+        print(f"合并结果: {instructions}")
+        assert instructions == ["a1", "a2", "b1"]
+    finally:
+        shutil.rmtree(output_dir)
+    
+    print("合并到输入文件测试完成\n")
+
 # 测试配置文件
 def test_config_files():
     print("=== 测试配置文件 ===")
@@ -163,6 +320,30 @@ def main():
     # 测试配置文件
     test_config_files()
     
+    # 测试多代码块instruction解析
+    try:
+        test_parse_instructions_multiple_fenced_blocks()
+    except Exception as e:
+        print(f"多代码块instruction解析测试失败: {str(e)}\n")
+    
+    # 测试续传保留已有样本
+    try:
+        test_resume_keeps_existing_output_samples()
+    except Exception as e:
+        print(f"续传保留已有样本测试失败: {str(e)}\n")
+    
+    # 测试输出文件缺失样本时续传
+    try:
+        test_resume_with_truncated_output_log()
+    except Exception as e:
+        print(f"输出文件缺失样本时续传测试失败: {str(e)}\n")
+    
+    # 测试合并到输入文件
+    try:
+        test_merge_into_input_file()
+    except Exception as e:
+        print(f"合并到输入文件测试失败: {str(e)}\n")
+    
     # 测试提示词版本管理
     try:
         test_prompt_version_management()